@@ -1,5 +1,5 @@
 """Demo B API server."""
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 import requests
 import os
 
@@ -7,6 +7,14 @@ app = Flask(__name__)
 _renderer = os.getenv('RENDERER_SERVICE', 'demo-b-renderer:5001')
 RENDERER_SERVICE = _renderer if _renderer.startswith('http') else f'http://{_renderer}'
 
+# Mount of the renderer's exports volume: results on it are sent from disk
+# instead of through the renderer (empty = stream everything through)
+EXPORTS_DIR = os.getenv('EXPORTS_DIR', '')
+
+# Renderer response headers passed on with downloaded files
+FILE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Content-Disposition',
+                'ETag', 'Last-Modified', 'X-Cache', 'X-Result-Location')
+
 # Allowed origins for CORS (development)
 ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -16,8 +24,10 @@ ALLOWED_ORIGINS = [
 def get_cors_headers(origin=None):
     """Get CORS headers for response."""
     headers = {
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match, Cache-Control, Range, If-Range',
+        'Access-Control-Expose-Headers': 'ETag, Content-Disposition, Content-Range, Accept-Ranges, X-Cache, '
+                                         'X-Result-Location, X-Refine-Job, X-Refine-Location, X-Refine-Error',
         'Access-Control-Max-Age': '86400',
     }
 
@@ -47,26 +57,101 @@ def add_cors_headers(response):
         response.headers[key] = value
     return response
 
+def _send_export(handle: dict, headers: dict) -> Response:
+    """Send a file on the exports volume named by a renderer handle
+    (conditional and Range requests are answered here).
+
+    Raises:
+        FileNotFoundError: if the file is gone (e.g. evicted from the cache)
+    """
+    root = os.path.realpath(EXPORTS_DIR)
+    path = os.path.realpath(os.path.join(root, handle['path']))
+    if not path.startswith(root + os.sep):
+        raise FileNotFoundError(handle['path'])
+    response = send_file(path, mimetype=handle['mimetype'], as_attachment=True, download_name=handle['filename'],
+                         etag=handle.get('etag') or True)
+    for header in ('X-Cache', 'X-Result-Location'):
+        if header in headers:
+            response.headers[header] = headers[header]
+    return response
+
+def _stream_file(response) -> Response:
+    """Pass a renderer file response through in chunks."""
+    headers = {header: response.headers[header] for header in FILE_HEADERS if header in response.headers}
+
+    def generate():
+        try:
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                yield chunk
+        finally:
+            response.close()
+
+    return Response(stream_with_context(generate()), status=response.status_code, headers=headers)
+
+def _renderer_file(method: str, path: str, headers: dict, **kwargs):
+    """Request a file download from the renderer service.
+
+    With EXPORTS_DIR set, the renderer is asked for a handle to results on
+    the shared volume, which are then sent from disk. If the file is gone
+    by the time it is opened, the request is repeated without.
+
+    Returns:
+        (renderer response, Flask response): the Flask response sends the
+        file for a 200/206 and is None otherwise, in which case the caller
+        handles (and closes) the renderer response
+    """
+    for use_handle in ((True, False) if EXPORTS_DIR else (False,)):
+        request_headers = dict(headers, **{'X-Export-Handle': '1'}) if use_handle else headers
+        response = requests.request(method, f"{RENDERER_SERVICE}{path}", headers=request_headers, stream=True,
+                                    **kwargs)
+        if response.status_code not in (200, 206):
+            return response, None
+        if 'X-Export-Handle' not in response.headers:
+            return response, _stream_file(response)
+        handle = response.json()
+        response.close()
+        try:
+            return response, _send_export(handle, response.headers)
+        except FileNotFoundError:
+            continue
+
+def _forwarded_headers(*names) -> dict:
+    """Request headers to pass on to the renderer service."""
+    return {name: request.headers[name] for name in names if request.headers.get(name)}
+
 def _render_handler():
     """Render endpoint handler - proxies to renderer service."""
     data = request.json
 
+    # Forward conditional request so unchanged exports come back as 304
+    forward_headers = _forwarded_headers('If-None-Match', 'Cache-Control')
+
     try:
-        response = requests.post(
-            f"{RENDERER_SERVICE}/render",
-            json=data,
-            timeout=300
-        )
+        response, file_response = _renderer_file('POST', '/render', forward_headers, json=data, timeout=300)
+
+        # Draft renders may point at a queued full-resolution job
+        refine_headers = {header: response.headers[header]
+                          for header in ('X-Refine-Job', 'X-Refine-Location', 'X-Refine-Error')
+                          if header in response.headers}
+
+        if file_response is not None:
+            file_response.headers.update(refine_headers)
+            return file_response
 
-        # Handle validation errors (400) with JSON response
-        if response.status_code == 400:
-            return response.json(), 400
+        try:
+            if response.status_code == 304:
+                return '', 304, dict(refine_headers, ETag=response.headers.get('ETag', ''))
 
-        response.raise_for_status()
+            # Handle validation errors (400) and busy renderer (503) with JSON response
+            if response.status_code == 400:
+                return response.json(), 400
+            if response.status_code == 503:
+                return response.json(), 503, {'Retry-After': response.headers.get('Retry-After', '30')}
 
-        return response.content, response.status_code, {
-            'Content-Type': response.headers.get('Content-Type', 'image/png')
-        }
+            response.raise_for_status()
+            return response.json(), response.status_code
+        finally:
+            response.close()
     except requests.RequestException as e:
         return jsonify({'error': str(e)}), 500
 
@@ -80,6 +165,156 @@ def api_render():
     """API render endpoint - same as /render but with /api prefix."""
     return _render_handler()
 
+def _render_batch_handler():
+    """Batch render handler - streams the ZIP archive from the renderer service."""
+    forward_headers = {}
+    if request.headers.get('Cache-Control'):
+        forward_headers['Cache-Control'] = request.headers['Cache-Control']
+
+    try:
+        response = requests.post(
+            f"{RENDERER_SERVICE}/render/batch",
+            json=request.json,
+            headers=forward_headers,
+            stream=True,
+            timeout=600
+        )
+        if response.status_code != 200:
+            status = response.status_code
+            body = response.json()
+            headers = {}
+            if 'Retry-After' in response.headers:
+                headers['Retry-After'] = response.headers['Retry-After']
+            response.close()
+            return body, status, headers
+
+        headers = {}
+        for header in ('Content-Type', 'Content-Length', 'Content-Disposition', 'X-Cache-Hits'):
+            if header in response.headers:
+                headers[header] = response.headers[header]
+
+        def generate():
+            try:
+                for chunk in response.iter_content(chunk_size=256 * 1024):
+                    yield chunk
+            finally:
+                response.close()
+
+        return Response(stream_with_context(generate()), status=200, headers=headers)
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/render/batch', methods=['POST', 'OPTIONS'])
+@app.route('/api/render/batch', methods=['POST', 'OPTIONS'])
+def render_batch():
+    """Render one map in several themes and download them as a ZIP archive."""
+    return _render_batch_handler()
+
+def _create_job_handler():
+    """Job creation handler - proxies to renderer service."""
+    data = request.json
+
+    try:
+        response = requests.post(
+            f"{RENDERER_SERVICE}/jobs",
+            json=data,
+            timeout=30
+        )
+        headers = {}
+        if 'Location' in response.headers:
+            headers['Location'] = response.headers['Location']
+        if 'Retry-After' in response.headers:
+            headers['Retry-After'] = response.headers['Retry-After']
+        return response.json(), response.status_code, headers
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
+def _job_status_handler(job_id):
+    """Job status handler - proxies to renderer service."""
+    try:
+        response = requests.get(
+            f"{RENDERER_SERVICE}/jobs/{job_id}",
+            timeout=10
+        )
+        return response.json(), response.status_code
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
+def _job_result_handler(job_id):
+    """Job result handler - sends the finished file (resumable with Range requests)."""
+    return _file_download_handler(f"/jobs/{job_id}/result")
+
+def _file_download_handler(path: str):
+    """Download a file from the renderer service, forwarding conditional and Range headers."""
+    forward_headers = _forwarded_headers('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+    try:
+        response, file_response = _renderer_file('GET', path, forward_headers, params=request.args, timeout=30)
+        if file_response is not None:
+            return file_response
+
+        status = response.status_code
+        try:
+            if status in (304, 416):
+                headers = {header: response.headers[header] for header in ('ETag', 'Content-Range')
+                           if header in response.headers}
+                return '', status, headers
+            return response.json(), status
+        finally:
+            response.close()
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['POST', 'OPTIONS'])
+def create_job():
+    """Create an asynchronous render job (same body as /render)."""
+    return _create_job_handler()
+
+@app.route('/api/jobs', methods=['POST', 'OPTIONS'])
+def api_create_job():
+    """API job endpoint - same as /jobs but with /api prefix."""
+    return _create_job_handler()
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Get render job state and progress."""
+    return _job_status_handler(job_id)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Download the result of a finished render job."""
+    return _job_result_handler(job_id)
+
+@app.route('/results/<name>', methods=['GET'])
+@app.route('/api/results/<name>', methods=['GET'])
+def result(name):
+    """Download a cached render result by ETag (X-Result-Location of /render)."""
+    return _file_download_handler(f"/results/{name}")
+
+@app.route('/tiles/<theme>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+@app.route('/api/tiles/<theme>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def tile(theme, z, x, y):
+    """Map tile - proxies to renderer service (conditional requests are forwarded)."""
+    forward_headers = {}
+    if request.headers.get('If-None-Match'):
+        forward_headers['If-None-Match'] = request.headers['If-None-Match']
+
+    try:
+        response = requests.get(
+            f"{RENDERER_SERVICE}/tiles/{theme}/{z}/{x}/{y}.png",
+            params=request.args,
+            headers=forward_headers,
+            timeout=120
+        )
+        headers = {}
+        for header in ('Content-Type', 'ETag', 'Cache-Control', 'X-Cache', 'Retry-After'):
+            if header in response.headers:
+                headers[header] = response.headers[header]
+        return response.content, response.status_code, headers
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/validate', methods=['POST'])
 def validate():
     """Validate render parameters - proxies to renderer service."""
@@ -107,6 +342,19 @@ def get_preset_limits():
     except requests.RequestException as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Renderer Prometheus metrics - proxies to renderer service."""
+    try:
+        response = requests.get(
+            f"{RENDERER_SERVICE}/metrics",
+            timeout=10
+        )
+        return Response(response.content, status=response.status_code,
+                        content_type=response.headers.get('Content-Type', 'text/plain'))
+    except requests.RequestException as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
@@ -114,10 +362,3 @@ def health():
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
-
-
-
-
-
-
-
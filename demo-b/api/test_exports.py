@@ -0,0 +1,73 @@
+"""Test file downloads served from the shared exports volume."""
+import json
+
+import pytest
+
+import app as api
+
+
+class FakeRendererResponse:
+    """Renderer response as returned by requests with stream=True."""
+
+    def __init__(self, status_code, body=b'', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'EXPORTS_DIR', str(tmp_path))
+    (tmp_path / 'cache').mkdir()
+    (tmp_path / 'cache' / 'result.png').write_bytes(b'0123456789')
+    return tmp_path
+
+
+def handle_response(path):
+    body = json.dumps({'path': path, 'mimetype': 'image/png', 'filename': 'map.png', 'etag': 'abc'})
+    return FakeRendererResponse(200, body.encode(), {'X-Export-Handle': '1', 'X-Cache': 'HIT'})
+
+
+def test_handle_served_from_volume_with_ranges(exports, monkeypatch):
+    sent = []
+    monkeypatch.setattr(api.requests, 'request',
+                        lambda method, url, headers, **kwargs: sent.append(headers) or handle_response('cache/result.png'))
+    client = api.app.test_client()
+
+    response = client.get('/results/abc.png', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b'2345'
+    assert response.headers['Content-Range'] == 'bytes 2-5/10'
+    assert response.headers['X-Cache'] == 'HIT'
+    assert sent[0]['X-Export-Handle'] == '1'
+
+    response = client.post('/render', json={'theme': 'paper'})
+    assert response.status_code == 200
+    assert response.data == b'0123456789'
+    assert 'filename=map.png' in response.headers['Content-Disposition']
+
+
+def test_missing_handle_falls_back_to_streaming(exports, monkeypatch):
+    responses = [handle_response('cache/evicted.png'),
+                 FakeRendererResponse(200, b'streamed', {'Content-Type': 'image/png'})]
+    sent = []
+    monkeypatch.setattr(api.requests, 'request',
+                        lambda method, url, headers, **kwargs: sent.append(headers) or responses.pop(0))
+
+    response = api.app.test_client().post('/render', json={'theme': 'paper'})
+    assert response.data == b'streamed'
+    assert 'X-Export-Handle' not in sent[1]
+
+
+def test_handle_outside_volume_rejected(exports):
+    with pytest.raises(FileNotFoundError):
+        api._send_export(json.loads(handle_response('../secret').body), {})
@@ -0,0 +1,45 @@
+-- Merge contours staged by load_contours.sh into the contours table.
+--
+-- Variables: preset (bbox preset name), staging (staging table name).
+-- The preset's previous contours are replaced in one transaction, so a
+-- re-load is idempotent and renders never see a half-loaded preset.
+--
+-- interval_m is the coarsest contour class (2, 10 or 50 m) an elevation
+-- belongs to; a style showing N m contours selects interval_m >= N in a
+-- single index lookup on (preset, interval_m, way).
+
+\set ON_ERROR_STOP on
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE TABLE IF NOT EXISTS contours (
+    gid bigserial PRIMARY KEY,
+    preset text NOT NULL,
+    elevation real NOT NULL,
+    interval_m smallint NOT NULL,
+    way geometry(LineString, 3857) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS contours_preset_interval_way_idx
+    ON contours USING GIST (preset, interval_m, way);
+
+BEGIN;
+
+DELETE FROM contours WHERE preset = :'preset';
+
+INSERT INTO contours (preset, elevation, interval_m, way)
+SELECT
+    :'preset',
+    elevation,
+    CASE
+        WHEN elevation::numeric % 50 = 0 THEN 50
+        WHEN elevation::numeric % 10 = 0 THEN 10
+        ELSE 2
+    END,
+    (ST_Dump(way)).geom
+FROM :"staging";
+
+COMMIT;
+
+DROP TABLE :"staging";
+ANALYZE contours;
@@ -0,0 +1,77 @@
+#!/bin/bash
+# Export a preset's render tables from PostGIS into local FlatGeobuf files.
+#
+# Run after import.sh and load_contours.sh. The renderer reads the files instead
+# of PostGIS (RENDER_DATA_SOURCE=auto or snapshot), so renders of the preset
+# need no database connection. Each file carries a packed Hilbert R-tree for
+# bbox queries. The snapshot is built in a temporary directory and swapped in
+# with a rename, so renderers never see a half-written snapshot.
+set -e
+
+PRESET="${1:-stockholm_core}"
+SNAPSHOT_DIR="${SNAPSHOT_DIR:-/snapshots}"
+POSTGRES_HOST="${POSTGRES_HOST:-demo-b-db}"
+POSTGRES_DB="${POSTGRES_DB:-gis}"
+POSTGRES_USER="${POSTGRES_USER:-postgres}"
+PG="PG:host=${POSTGRES_HOST} dbname=${POSTGRES_DB} user=${POSTGRES_USER} password=${POSTGRES_PASSWORD}"
+
+# Per-layer render tables and their generalized versions (must match
+# layer_table() in demo-b/renderer/src/scale_bands.py)
+TABLES="render_water render_parks render_roads_minor render_roads_major render_buildings
+gen_water_mid gen_parks_mid gen_roads_minor_mid gen_roads_major_mid gen_buildings_mid
+gen_water_low gen_parks_low gen_roads_major_low gen_buildings_low"
+
+TARGET="${SNAPSHOT_DIR}/${PRESET}"
+BUILD="${SNAPSHOT_DIR}/.${PRESET}.build.$$"
+rm -rf "${BUILD}"
+mkdir -p "${BUILD}"
+trap 'rm -rf "${BUILD}"' EXIT
+
+export_layer() {
+    local name="$1" sql="$2"
+    ogr2ogr \
+      -f FlatGeobuf \
+      "${BUILD}/${name}.fgb" \
+      "${PG}" \
+      -sql "${sql}" \
+      -nln "${name}" \
+      -a_srs EPSG:3857 \
+      -lco SPATIAL_INDEX=YES
+    echo "  ${name}: $(stat -c %s "${BUILD}/${name}.fgb") bytes"
+}
+
+echo "Exporting render tables for ${PRESET} to ${TARGET}"
+for table in ${TABLES}; do
+    export_layer "${table}" "SELECT way FROM ${table}"
+done
+
+PRESET_LITERAL="${PRESET//\'/\'\'}"
+CONTOUR_ROWS=$(PGPASSWORD=${POSTGRES_PASSWORD} psql -h "${POSTGRES_HOST}" -U "${POSTGRES_USER}" -d "${POSTGRES_DB}" \
+  -tA -c "SELECT count(*) FROM contours WHERE preset = '${PRESET_LITERAL}'" 2>/dev/null || echo 0)
+CONTOURS=false
+if [ "${CONTOUR_ROWS:-0}" -gt 0 ]; then
+    export_layer contours "SELECT way, interval_m FROM contours WHERE preset = '${PRESET_LITERAL}'"
+    CONTOURS=true
+else
+    echo "  contours: none loaded for ${PRESET} (renders fall back to PostGIS for contours)"
+fi
+
+# Written last: the renderer only uses snapshots that have a manifest
+cat > "${BUILD}/manifest.json" <<EOF
+{
+  "preset": "${PRESET}",
+  "format": "FlatGeobuf",
+  "created_at": "$(date -u +%Y-%m-%dT%H:%M:%SZ)",
+  "contours": ${CONTOURS}
+}
+EOF
+
+# Swap in the new snapshot; renders that opened the old files keep reading them
+if [ -d "${TARGET}" ]; then
+    mv "${TARGET}" "${SNAPSHOT_DIR}/.${PRESET}.old.$$"
+fi
+mv "${BUILD}" "${TARGET}"
+rm -rf "${SNAPSHOT_DIR}/.${PRESET}.old.$$"
+trap - EXIT
+
+echo "Snapshot written: ${TARGET}"
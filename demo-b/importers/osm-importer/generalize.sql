@@ -0,0 +1,119 @@
+-- Scale-band generalized geometry tables for small-scale renders.
+--
+-- Built from the per-layer render tables (render_tables.sql) by refresh.sh
+-- after every osm2pgsql import. The renderer picks a band from the output
+-- scale denominator (see scale_bands.py in the renderer):
+--   full  below 1:100 000  - render_* tables, untouched
+--   mid   1:100 000 - 1:400 000
+--   low   from 1:400 000
+--
+-- Per band, features are simplified to about a third of a pixel at the
+-- band's largest scale, features smaller than a pixel or two are dropped,
+-- and touching polygons / connected road segments are merged. Merging is
+-- grouped by a coarse grid cell of each feature's centroid so the unions
+-- stay cheap on regional extracts; features are never clipped.
+--
+-- Tolerances and areas are in EPSG:3857 map units (pixel sizes at the
+-- band boundaries with the standard 0.28 mm rendering pixel:
+-- 1:100 000 = 28 m/px, 1:400 000 = 112 m/px).
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+-- mid band -----------------------------------------------------------------
+
+DROP TABLE IF EXISTS gen_water_mid;
+CREATE TABLE gen_water_mid AS
+SELECT (ST_Dump(ST_Union(ST_SimplifyPreserveTopology(way, 10)))).geom::geometry(Polygon, 3857) AS way
+FROM render_water
+WHERE ST_Area(way) >= 2000
+GROUP BY ST_SnapToGrid(ST_Centroid(way), 20000);
+
+DROP TABLE IF EXISTS gen_parks_mid;
+CREATE TABLE gen_parks_mid AS
+SELECT (ST_Dump(ST_Union(ST_SimplifyPreserveTopology(way, 10)))).geom::geometry(Polygon, 3857) AS way
+FROM render_parks
+WHERE ST_Area(way) >= 2000
+GROUP BY ST_SnapToGrid(ST_Centroid(way), 20000);
+
+DROP TABLE IF EXISTS gen_buildings_mid;
+CREATE TABLE gen_buildings_mid AS
+SELECT (ST_Dump(ST_Union(ST_SimplifyPreserveTopology(way, 10)))).geom::geometry(Polygon, 3857) AS way
+FROM render_buildings
+WHERE ST_Area(way) >= 1500
+GROUP BY ST_SnapToGrid(ST_Centroid(way), 5000);
+
+DROP TABLE IF EXISTS gen_roads_major_mid;
+CREATE TABLE gen_roads_major_mid AS
+SELECT highway, ST_SimplifyPreserveTopology(geom, 10)::geometry(LineString, 3857) AS way
+FROM (
+    SELECT highway, (ST_Dump(ST_LineMerge(ST_Collect(way)))).geom AS geom
+    FROM render_roads_major
+    GROUP BY highway, ST_SnapToGrid(ST_Centroid(way), 20000)
+) merged;
+
+DROP TABLE IF EXISTS gen_roads_minor_mid;
+CREATE TABLE gen_roads_minor_mid AS
+SELECT highway, ST_SimplifyPreserveTopology(geom, 10)::geometry(LineString, 3857) AS way
+FROM (
+    SELECT highway, (ST_Dump(ST_LineMerge(ST_Collect(way)))).geom AS geom
+    FROM render_roads_minor
+    WHERE highway IN ('residential', 'unclassified')
+    GROUP BY highway, ST_SnapToGrid(ST_Centroid(way), 20000)
+) merged
+WHERE ST_Length(geom) >= 100;
+
+-- low band -----------------------------------------------------------------
+-- No minor roads; only large buildings (industrial halls, hospitals, ...)
+
+DROP TABLE IF EXISTS gen_water_low;
+CREATE TABLE gen_water_low AS
+SELECT (ST_Dump(ST_Union(ST_SimplifyPreserveTopology(way, 40)))).geom::geometry(Polygon, 3857) AS way
+FROM render_water
+WHERE ST_Area(way) >= 40000
+GROUP BY ST_SnapToGrid(ST_Centroid(way), 50000);
+
+DROP TABLE IF EXISTS gen_parks_low;
+CREATE TABLE gen_parks_low AS
+SELECT (ST_Dump(ST_Union(ST_SimplifyPreserveTopology(way, 40)))).geom::geometry(Polygon, 3857) AS way
+FROM render_parks
+WHERE ST_Area(way) >= 40000
+GROUP BY ST_SnapToGrid(ST_Centroid(way), 50000);
+
+DROP TABLE IF EXISTS gen_buildings_low;
+CREATE TABLE gen_buildings_low AS
+SELECT ST_SimplifyPreserveTopology(geom, 40)::geometry(Polygon, 3857) AS way
+FROM (
+    SELECT (ST_Dump(way)).geom AS geom
+    FROM render_buildings
+    WHERE ST_Area(way) >= 25000
+) parts;
+
+DROP TABLE IF EXISTS gen_roads_major_low;
+CREATE TABLE gen_roads_major_low AS
+SELECT highway, ST_SimplifyPreserveTopology(geom, 40)::geometry(LineString, 3857) AS way
+FROM (
+    SELECT highway, (ST_Dump(ST_LineMerge(ST_Collect(way)))).geom AS geom
+    FROM render_roads_major
+    WHERE highway IN ('primary', 'secondary', 'trunk', 'motorway')
+    GROUP BY highway, ST_SnapToGrid(ST_Centroid(way), 50000)
+) merged
+WHERE ST_Length(geom) >= 500;
+
+COMMIT;
+
+-- Indexes and planner statistics -------------------------------------------
+
+CREATE INDEX gen_water_mid_way_idx ON gen_water_mid USING GIST (way);
+CREATE INDEX gen_parks_mid_way_idx ON gen_parks_mid USING GIST (way);
+CREATE INDEX gen_buildings_mid_way_idx ON gen_buildings_mid USING GIST (way);
+CREATE INDEX gen_roads_major_mid_way_idx ON gen_roads_major_mid USING GIST (way);
+CREATE INDEX gen_roads_minor_mid_way_idx ON gen_roads_minor_mid USING GIST (way);
+CREATE INDEX gen_water_low_way_idx ON gen_water_low USING GIST (way);
+CREATE INDEX gen_parks_low_way_idx ON gen_parks_low USING GIST (way);
+CREATE INDEX gen_buildings_low_way_idx ON gen_buildings_low USING GIST (way);
+CREATE INDEX gen_roads_major_low_way_idx ON gen_roads_major_low USING GIST (way);
+
+ANALYZE gen_water_mid, gen_parks_mid, gen_buildings_mid, gen_roads_major_mid, gen_roads_minor_mid,
+        gen_water_low, gen_parks_low, gen_buildings_low, gen_roads_major_low;
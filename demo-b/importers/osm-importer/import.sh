@@ -31,6 +31,8 @@ osm2pgsql \
   --host "${POSTGRES_HOST}" \
   "${OSM_PBF}"
 
+/bin/bash /app/refresh.sh
+
 echo "OSM import complete"
 
 
@@ -0,0 +1,49 @@
+#!/bin/bash
+# Load extracted contours (prep-service extract_contours.py) into PostGIS.
+# Re-running replaces the preset's contours.
+set -e
+
+PRESET="${1:-stockholm_core}"
+DATA_DIR="${DATA_DIR:-/data}"
+CONTOURS_DIR="${DATA_DIR}/terrain/contours"
+POSTGRES_HOST="${POSTGRES_HOST:-demo-b-db}"
+POSTGRES_DB="${POSTGRES_DB:-gis}"
+POSTGRES_USER="${POSTGRES_USER:-postgres}"
+SQL_DIR="$(dirname "$0")"
+STAGING_TABLE="contours_staging_${PRESET}"
+
+# The finest extracted interval contains every coarser contour line
+CONTOURS_FILE=""
+for interval in 2 10 50; do
+    if [ -f "${CONTOURS_DIR}/${PRESET}_${interval}m.geojson" ]; then
+        CONTOURS_FILE="${CONTOURS_DIR}/${PRESET}_${interval}m.geojson"
+        break
+    fi
+done
+
+if [ -z "${CONTOURS_FILE}" ]; then
+    echo "ERROR: No contours found for ${PRESET} in ${CONTOURS_DIR}" >&2
+    echo "Run: python3 /app/src/extract_contours.py --preset ${PRESET} (prep service)" >&2
+    exit 1
+fi
+
+echo "Loading contours from ${CONTOURS_FILE}"
+
+# Stream into an unindexed staging table with COPY
+PG_USE_COPY=YES ogr2ogr \
+  -f PostgreSQL \
+  PG:"host=${POSTGRES_HOST} dbname=${POSTGRES_DB} user=${POSTGRES_USER} password=${POSTGRES_PASSWORD}" \
+  "${CONTOURS_FILE}" \
+  -nln "${STAGING_TABLE}" \
+  -overwrite \
+  -t_srs EPSG:3857 \
+  -select elevation \
+  -lco GEOMETRY_NAME=way \
+  -lco SPATIAL_INDEX=NONE \
+  -lco PRECISION=NO
+
+PGPASSWORD=${POSTGRES_PASSWORD} psql -h "${POSTGRES_HOST}" -U "${POSTGRES_USER}" -d "${POSTGRES_DB}" \
+  -v ON_ERROR_STOP=1 -v preset="${PRESET}" -v staging="${STAGING_TABLE}" \
+  -f "${SQL_DIR}/contours.sql"
+
+echo "Contours loaded for ${PRESET}"
@@ -0,0 +1,22 @@
+#!/bin/bash
+# Rebuild the render tables (per-layer and generalized) from the osm2pgsql tables.
+# Run after every import; import.sh calls this automatically.
+set -e
+
+POSTGRES_HOST="${POSTGRES_HOST:-demo-b-db}"
+POSTGRES_DB="${POSTGRES_DB:-gis}"
+POSTGRES_USER="${POSTGRES_USER:-postgres}"
+SQL_DIR="$(dirname "$0")"
+
+psql_file() {
+    PGPASSWORD=${POSTGRES_PASSWORD} psql -h "${POSTGRES_HOST}" -U "${POSTGRES_USER}" -d "${POSTGRES_DB}" \
+      -v ON_ERROR_STOP=1 -f "$1"
+}
+
+echo "Building per-layer render tables"
+psql_file "${SQL_DIR}/render_tables.sql"
+
+echo "Building scale-band generalized tables"
+psql_file "${SQL_DIR}/generalize.sql"
+
+echo "Render tables refreshed"
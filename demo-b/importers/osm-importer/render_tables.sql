@@ -0,0 +1,68 @@
+-- Dedicated per-layer render tables.
+--
+-- Built from the osm2pgsql tables after every import (import.sh runs
+-- refresh.sh). Each table holds exactly the features of one style layer,
+-- so a render query is a plain bbox lookup on a small GIST index instead of
+-- a scan of the shared planet_osm_* index followed by row-by-row tag
+-- filtering. Tables are clustered on their spatial index, so features that
+-- are close on the map are close on disk.
+--
+-- Each table is rebuilt in its own transaction: concurrent renders wait for
+-- the new table instead of failing on a missing one.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+DROP TABLE IF EXISTS render_water;
+CREATE TABLE render_water AS
+SELECT osm_id, way
+FROM planet_osm_polygon
+WHERE "natural" = 'water' OR waterway IS NOT NULL;
+CREATE INDEX render_water_way_idx ON render_water USING GIST (way);
+CLUSTER render_water USING render_water_way_idx;
+ANALYZE render_water;
+COMMIT;
+
+BEGIN;
+DROP TABLE IF EXISTS render_parks;
+CREATE TABLE render_parks AS
+SELECT osm_id, landuse, way
+FROM planet_osm_polygon
+WHERE landuse IN ('park', 'recreation_ground', 'forest');
+CREATE INDEX render_parks_way_idx ON render_parks USING GIST (way);
+CLUSTER render_parks USING render_parks_way_idx;
+ANALYZE render_parks;
+COMMIT;
+
+BEGIN;
+DROP TABLE IF EXISTS render_roads_major;
+CREATE TABLE render_roads_major AS
+SELECT osm_id, highway, way
+FROM planet_osm_line
+WHERE highway IN ('primary', 'secondary', 'tertiary', 'trunk', 'motorway');
+CREATE INDEX render_roads_major_way_idx ON render_roads_major USING GIST (way);
+CLUSTER render_roads_major USING render_roads_major_way_idx;
+ANALYZE render_roads_major;
+COMMIT;
+
+BEGIN;
+DROP TABLE IF EXISTS render_roads_minor;
+CREATE TABLE render_roads_minor AS
+SELECT osm_id, highway, way
+FROM planet_osm_line
+WHERE highway IN ('residential', 'service', 'unclassified');
+CREATE INDEX render_roads_minor_way_idx ON render_roads_minor USING GIST (way);
+CLUSTER render_roads_minor USING render_roads_minor_way_idx;
+ANALYZE render_roads_minor;
+COMMIT;
+
+BEGIN;
+DROP TABLE IF EXISTS render_buildings;
+CREATE TABLE render_buildings AS
+SELECT osm_id, way
+FROM planet_osm_polygon
+WHERE building IS NOT NULL;
+CREATE INDEX render_buildings_way_idx ON render_buildings USING GIST (way);
+CLUSTER render_buildings USING render_buildings_way_idx;
+ANALYZE render_buildings;
+COMMIT;
@@ -0,0 +1,87 @@
+"""Shared layer data for rendering several styles of the same map.
+
+A gallery renders one bbox and output size in many themes and layer
+configurations. Their PostGIS layers read identical data (the layer
+datasource depends only on layer, scale band and preset), so a batch
+fetches each distinct layer datasource once into a Mapnik
+MemoryDatasource and points the layers of every variant's map at it.
+Raster layers keep reading their files.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+import mapnik
+
+from datasources import layer_share_keys
+
+# Variants of a batch rendered at the same time (Mapnik releases the GIL while rendering)
+BATCH_RENDER_THREADS = int(os.getenv('BATCH_RENDER_THREADS', str(min(4, os.cpu_count() or 1))))
+
+
+def _fetch(datasource, box: mapnik.Box2d, resolution: Tuple[float, float], scale_denominator: float):
+    """Read all features of a datasource within a box into a MemoryDatasource."""
+    query = mapnik.Query(box, resolution, scale_denominator)
+    for name in datasource.fields():
+        query.add_property_name(name)
+    memory = mapnik.MemoryDatasource()
+    for feature in datasource.features(query):
+        memory.add_feature(feature)
+    return memory
+
+
+@contextmanager
+def shared_layer_data(maps: List[Tuple[mapnik.Map, str]], timings: dict = None):
+    """Point the PostGIS layers of zoomed maps at data fetched once per distinct layer.
+
+    Args:
+        maps: (map, style XML) pairs, already zoomed to the same extent and size
+        timings: Optional dict; 'fetch' receives the fetch time in seconds and
+            'shared_layers' the number of distinct layers fetched
+
+    Yields:
+        None; the original datasources are restored on exit, so the maps
+        can go back to the template cache
+    """
+    start = time.perf_counter()
+    keys = [layer_share_keys(xml) for _, xml in maps]
+
+    # Query box per distinct layer: union of the buffered render extents of its maps
+    targets = {}
+    for (map_obj, _), map_keys in zip(maps, keys):
+        for layer, key in zip(map_obj.layers, map_keys):
+            if key is None:
+                continue
+            box = map_obj.buffered_envelope()
+            if key in targets:
+                targets[key]['box'].expand_to_include(box)
+            else:
+                targets[key] = {
+                    'box': box,
+                    'datasource': layer.datasource,
+                    'resolution': (map_obj.width / map_obj.envelope().width(),
+                                   map_obj.height / map_obj.envelope().height()),
+                    'scale_denominator': map_obj.scale_denominator()
+                }
+
+    memory = {
+        key: _fetch(t['datasource'], t['box'], t['resolution'], t['scale_denominator'])
+        for key, t in targets.items()
+    }
+    if timings is not None:
+        timings['fetch'] = time.perf_counter() - start
+        timings['shared_layers'] = len(memory)
+
+    originals = []
+    try:
+        for (map_obj, _), map_keys in zip(maps, keys):
+            for layer, key in zip(map_obj.layers, map_keys):
+                if key is not None:
+                    originals.append((layer, layer.datasource))
+                    layer.datasource = memory[key]
+        yield
+    finally:
+        for layer, datasource in originals:
+            layer.datasource = datasource
@@ -0,0 +1,299 @@
+"""Renderer benchmark over a fixed matrix of presets, paper sizes, DPIs and formats.
+
+Drives MapnikRenderer directly (no HTTP, worker pool or result cache) and
+records wall time, CPU time, peak RSS, output size and stage timings for
+each case. Results are written as JSON and compared against a committed
+baseline; a case regresses when a metric exceeds its baseline value by more
+than the baseline's relative threshold (and by more than its absolute noise
+floor).
+
+Needs a reachable PostGIS database loaded with the benchmarked presets
+(see scripts/benchmark_demo_b.sh, which loads stockholm_core as fixture).
+
+Usage:
+    python src/benchmark.py [--presets stockholm_core] [--papers A4 A3] [--dpis 72 150]
+                            [--formats png] [--repeat 3] [--update-baseline]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config_registry import registry as config
+from datasources import contours_loaded, load_preset_bboxes, preset_bbox
+from result_cache import RENDERER_OUTPUT_VERSION
+from snapshots import RENDER_DATA_SOURCE, snapshot_manifest
+
+PAPER_SIZES_MM = {
+    'A4': (210, 297),
+    'A3': (297, 420),
+    'A2': (420, 594),
+    'A1': (594, 841)
+}
+BENCHMARK_DPIS = (72, 150, 300)
+BENCHMARK_FORMATS = ('png', 'pdf', 'svg')
+BENCHMARK_THEME = 'paper'
+
+BENCHMARK_DIR = Path(os.getenv('BENCHMARK_DIR', str(Path(__file__).parent.parent / 'benchmarks')))
+BENCHMARK_RESULTS_DIR = Path(os.getenv('BENCHMARK_RESULTS_DIR', '/exports/benchmarks'))
+
+# Used when the baseline does not define thresholds: allowed relative
+# increase per metric, and the absolute increase below which changes are noise
+DEFAULT_THRESHOLDS = {
+    'wall_s': {'relative': 0.20, 'absolute': 0.05},
+    'cpu_s': {'relative': 0.20, 'absolute': 0.05},
+    'peak_rss_mb': {'relative': 0.15, 'absolute': 16},
+    'output_bytes': {'relative': 0.05, 'absolute': 1024}
+}
+
+
+def case_id(preset: str, paper: str, dpi: int, format_type: str) -> str:
+    return f"{preset}/{paper}/{dpi}/{format_type}"
+
+
+def build_matrix(presets: List[str], papers: List[str], dpis: List[int], formats: List[str],
+                 respect_limits: bool = True) -> List[Dict]:
+    """Benchmark cases for all combinations.
+
+    Args:
+        presets: Bbox preset names
+        papers: Paper sizes (keys of PAPER_SIZES_MM)
+        dpis: Output DPIs
+        formats: Output formats
+        respect_limits: Skip combinations the server rejects (max_dpi and
+            allowed_formats from preset_limits.json)
+
+    Returns:
+        List of cases with keys: id, preset, paper, dpi, format, output_size
+    """
+    limits = config.preset_limits().get('presets', {}) if respect_limits else {}
+    cases = []
+    for preset in presets:
+        preset_limits = limits.get(preset, {}).get('limits', {})
+        for paper in papers:
+            if preset_limits.get('allowed_formats') and paper not in preset_limits['allowed_formats']:
+                continue
+            width_mm, height_mm = PAPER_SIZES_MM[paper]
+            for dpi in dpis:
+                if dpi > preset_limits.get('max_dpi', dpi):
+                    continue
+                output_size = (round(width_mm * dpi / 25.4), round(height_mm * dpi / 25.4))
+                for format_type in formats:
+                    cases.append({
+                        'id': case_id(preset, paper, dpi, format_type),
+                        'preset': preset,
+                        'paper': paper,
+                        'dpi': dpi,
+                        'format': format_type,
+                        'output_size': output_size
+                    })
+    return cases
+
+
+def _coverage(preset: str) -> dict:
+    # Same rule as server.check_coverage()
+    hillshade = os.path.exists(f"/data/terrain/hillshade/{preset}_hillshade.tif")
+    manifest = snapshot_manifest(preset) if RENDER_DATA_SOURCE != 'postgis' else None
+    contours = bool(manifest and manifest.get('contours')) or contours_loaded(preset)
+    return {'osm': True, 'contours': contours, 'hillshade': hillshade}
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(renderer, theme: dict, case: Dict, repeat: int = 3, warmup: int = 1) -> Dict:
+    """Render one case repeatedly and summarize it.
+
+    Strips are rendered in-process (tiled=False) so CPU time covers all
+    rendering work. Wall and CPU times are medians over the measured runs;
+    peak RSS is the maximum.
+    """
+    preset = case['preset']
+    args = (theme, preset_bbox(preset), case['output_size'], case['dpi'], case['format'], preset,
+            None, _coverage(preset))
+    runs = []
+    for i in range(warmup + repeat):
+        timings = {}
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_seconds()
+        data = renderer.render(*args, tiled=False, timings=timings)
+        run = {
+            'wall_s': time.perf_counter() - wall_start,
+            'cpu_s': _cpu_seconds() - cpu_start,
+            'peak_rss_mb': timings.get('peak_rss_mb'),
+            'output_bytes': len(data),
+            'stages': {k: v for k, v in timings.items() if isinstance(v, float) and k != 'peak_rss_mb'}
+        }
+        if i >= warmup:
+            runs.append(run)
+
+    peak_rss = [r['peak_rss_mb'] for r in runs if r['peak_rss_mb'] is not None]
+    median_run = sorted(runs, key=lambda r: r['wall_s'])[len(runs) // 2]
+    return {
+        'preset': preset,
+        'paper': case['paper'],
+        'dpi': case['dpi'],
+        'format': case['format'],
+        'output_size': list(case['output_size']),
+        'runs': len(runs),
+        'wall_s': statistics.median(r['wall_s'] for r in runs),
+        'cpu_s': statistics.median(r['cpu_s'] for r in runs),
+        'peak_rss_mb': max(peak_rss) if peak_rss else None,
+        'output_bytes': runs[-1]['output_bytes'],
+        'stages': median_run['stages']
+    }
+
+
+def _environment() -> dict:
+    try:
+        import mapnik
+        mapnik_version = mapnik.mapnik_version()
+    except (ImportError, AttributeError):
+        mapnik_version = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'mapnik_version': mapnik_version,
+        'renderer_output_version': RENDERER_OUTPUT_VERSION
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict) -> List[Dict]:
+    """Compare benchmark results against a baseline.
+
+    Returns:
+        One entry per case and metric with keys: case, metric, baseline,
+        current, change (relative) and status ('ok', 'regression',
+        'improved' or 'new')
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS, **baseline.get('thresholds', {}))
+    baseline_results = baseline.get('results', {})
+    comparison = []
+    for cid, result in sorted(results.items()):
+        base = baseline_results.get(cid)
+        for metric, threshold in thresholds.items():
+            current = result.get(metric)
+            if current is None:
+                continue
+            entry = {'case': cid, 'metric': metric, 'current': current, 'baseline': None,
+                     'change': None, 'status': 'new'}
+            if base is not None and base.get(metric):
+                previous = base[metric]
+                entry['baseline'] = previous
+                entry['change'] = (current - previous) / previous
+                delta = current - previous
+                if entry['change'] > threshold['relative'] and delta > threshold['absolute']:
+                    entry['status'] = 'regression'
+                elif entry['change'] < -threshold['relative'] and -delta > threshold['absolute']:
+                    entry['status'] = 'improved'
+                else:
+                    entry['status'] = 'ok'
+            comparison.append(entry)
+    return comparison
+
+
+def _print_comparison(comparison: List[Dict]):
+    for entry in comparison:
+        if entry['status'] == 'new':
+            print(f"  {entry['case']:<32} {entry['metric']:<13} {entry['current']:>14.3f}  (no baseline)")
+            continue
+        print(f"  {entry['case']:<32} {entry['metric']:<13} {entry['current']:>14.3f}  "
+              f"baseline {entry['baseline']:>14.3f}  {entry['change']:+7.1%}  {entry['status'].upper()}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the Demo B Mapnik renderer')
+    parser.add_argument('--presets', nargs='+', default=None, help='Bbox presets (default: all in bbox_presets.json)')
+    parser.add_argument('--papers', nargs='+', default=list(PAPER_SIZES_MM), choices=list(PAPER_SIZES_MM))
+    parser.add_argument('--dpis', nargs='+', type=int, default=list(BENCHMARK_DPIS))
+    parser.add_argument('--formats', nargs='+', default=list(BENCHMARK_FORMATS), choices=list(BENCHMARK_FORMATS))
+    parser.add_argument('--theme', default=BENCHMARK_THEME)
+    parser.add_argument('--repeat', type=int, default=3, help='Measured runs per case')
+    parser.add_argument('--warmup', type=int, default=1, help='Unmeasured runs per case before measuring')
+    parser.add_argument('--ignore-limits', action='store_true', help='Also run cases preset_limits.json rejects')
+    parser.add_argument('--baseline', type=Path, default=BENCHMARK_DIR / 'baseline.json')
+    parser.add_argument('--output', type=Path, default=None, help='Results JSON (default: timestamped file in BENCHMARK_RESULTS_DIR)')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    presets = args.presets or sorted(load_preset_bboxes())
+    unknown = [p for p in presets if preset_bbox(p) is None]
+    if unknown:
+        parser.error(f"Unknown presets: {', '.join(unknown)}")
+
+    theme = config.theme(args.theme)
+    if theme is None:
+        parser.error(f"Unknown theme: {args.theme}")
+
+    cases = build_matrix(presets, args.papers, args.dpis, args.formats, respect_limits=not args.ignore_limits)
+    print(f"Benchmarking {len(cases)} cases ({args.warmup} warmup + {args.repeat} measured runs each)")
+
+    from mapnik_renderer import MapnikRenderer
+    renderer = MapnikRenderer()
+
+    results = {}
+    for n, case in enumerate(cases, 1):
+        result = run_case(renderer, theme, case, repeat=args.repeat, warmup=args.warmup)
+        results[case['id']] = result
+        print(f"[{n}/{len(cases)}] {case['id']}: {result['wall_s']:.2f}s wall, {result['cpu_s']:.2f}s cpu, "
+              f"{result['output_bytes']:,} bytes", file=sys.stderr)
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': _environment(),
+        'settings': {'theme': args.theme, 'repeat': args.repeat, 'warmup': args.warmup},
+        'results': results
+    }
+
+    baseline = {}
+    if args.baseline.exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    comparison = compare(results, baseline)
+    report['comparison'] = comparison
+
+    output = args.output or BENCHMARK_RESULTS_DIR / f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    print(f"Comparison against {args.baseline}:")
+    _print_comparison(comparison)
+    regressions = [e for e in comparison if e['status'] == 'regression']
+
+    if args.update_baseline:
+        baseline_results = dict(baseline.get('results', {}), **results)
+        new_baseline = {
+            'thresholds': baseline.get('thresholds', DEFAULT_THRESHOLDS),
+            'environment': report['environment'],
+            'settings': report['settings'],
+            'updated_at': report['created_at'],
+            'results': {cid: {k: v for k, v in r.items() if k != 'stages'} for cid, r in sorted(baseline_results.items())}
+        }
+        with open(args.baseline, 'w') as f:
+            json.dump(new_baseline, f, indent=2)
+            f.write('\n')
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"FAIL: {len(regressions)} regressions beyond thresholds")
+        return 1
+    print("PASS: no regressions beyond thresholds")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Shared registry of the renderer's JSON configuration.
+
+Themes, bbox presets, export presets and preset limits are parsed once and
+kept in memory. Each file is re-checked at most every
+CONFIG_RELOAD_CHECK_SECONDS: a changed mtime or size reloads it, and a
+changed directory mtime re-indexes themes and export presets, so edits
+are picked up without restarting the server and without disk reads on
+every request.
+
+Callers get deep copies and may modify them freely (the server adds
+composition settings to themes, for example).
+"""
+
+import copy
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# Minimum seconds between checks of a config file for changes (0 = check on every access)
+CONFIG_RELOAD_CHECK_SECONDS = float(os.getenv('CONFIG_RELOAD_CHECK_SECONDS', '2'))
+
+_REPO_ROOT = Path(__file__).parent.parent.parent.parent
+
+THEMES_DIRS = [Path('/app/themes'), _REPO_ROOT / 'themes']
+
+BBOX_PRESETS_PATHS = [
+    Path('/app/prep-config/bbox_presets.json'),
+    _REPO_ROOT / 'prep-service' / 'config' / 'bbox_presets.json'
+]
+
+PRESET_LIMITS_PATHS = [
+    Path('/app/prep-config/preset_limits.json'),
+    _REPO_ROOT / 'prep-service' / 'config' / 'preset_limits.json'
+]
+
+EXPORT_PRESETS_DIRS = [
+    _REPO_ROOT / 'config' / 'export_presets',
+    Path('/app/export_presets'),
+    Path.cwd() / 'config' / 'export_presets'
+]
+
+
+def _file_signature(path: Path):
+    """(mtime_ns, size) of a file or directory, or None if it does not exist."""
+    try:
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _load_json(path: Path) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ConfigFile:
+    """One JSON file (the first existing of several candidate paths), reloaded when it changes."""
+
+    def __init__(self, paths: List[Path], default: Any = None, on_load: Callable[[Path], None] = None,
+                 check_seconds: float = CONFIG_RELOAD_CHECK_SECONDS):
+        self.paths = [Path(p) for p in paths]
+        self.default = default
+        self.on_load = on_load
+        self.check_seconds = check_seconds
+        self._value = default
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _resolve(self) -> Optional[Path]:
+        for path in self.paths:
+            if path.exists():
+                return path
+        return None
+
+    def get(self) -> Any:
+        """Parsed file content (not copied), or the default if no file exists."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return self._value
+            self._checked_at = now
+
+            path = self._resolve()
+            signature = (path, _file_signature(path)) if path else None
+            if signature == self._signature:
+                return self._value
+
+            if path is None:
+                self._value = self.default
+            else:
+                try:
+                    self._value = _load_json(path)
+                    if self.on_load:
+                        self.on_load(path)
+                except Exception as e:
+                    # Keep serving the last good version of a file being edited
+                    print(f"Warning: Failed to load config {path}: {e}", file=sys.stderr)
+                    if self._signature is None:
+                        self._value = self.default
+            self._signature = signature
+            return self._value
+
+
+class ConfigDirectory:
+    """JSON files of a directory indexed by file stem, re-indexed when the directory changes."""
+
+    def __init__(self, dirs: List[Path], check_seconds: float = CONFIG_RELOAD_CHECK_SECONDS):
+        self.dirs = [Path(d) for d in dirs]
+        self.check_seconds = check_seconds
+        self._files = {}
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _index(self) -> Dict[str, ConfigFile]:
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return self._files
+            self._checked_at = now
+
+            signature = tuple(_file_signature(d) for d in self.dirs)
+            if signature != self._signature:
+                names = {}
+                for directory in self.dirs:
+                    if not directory.is_dir():
+                        continue
+                    for path in sorted(directory.glob('*.json')):
+                        # Earlier directories take precedence
+                        names.setdefault(path.stem, [])
+                        names[path.stem].append(path)
+                # Keep loaded entries so unchanged files are not parsed again
+                self._files = {name: self._files.get(name) or ConfigFile(paths, check_seconds=self.check_seconds)
+                               for name, paths in names.items()}
+                self._signature = signature
+            return self._files
+
+    def names(self) -> List[str]:
+        return sorted(self._index())
+
+    def get(self, name: str) -> Any:
+        """Parsed content of ``<name>.json`` (not copied), or None if there is none."""
+        entry = self._index().get(name)
+        return entry.get() if entry is not None else None
+
+
+class ConfigRegistry:
+    """Themes, bbox presets, export presets and preset limits."""
+
+    def __init__(self, check_seconds: float = CONFIG_RELOAD_CHECK_SECONDS):
+        self._themes = ConfigDirectory(THEMES_DIRS, check_seconds)
+        self._export_presets = ConfigDirectory(EXPORT_PRESETS_DIRS, check_seconds)
+        self._bbox_presets = ConfigFile(BBOX_PRESETS_PATHS, {}, check_seconds=check_seconds)
+        self._preset_limits = ConfigFile(
+            PRESET_LIMITS_PATHS, {}, check_seconds=check_seconds,
+            on_load=lambda path: print(f"Loaded preset limits from {path}", file=sys.stderr)
+        )
+
+    def theme(self, name: str) -> Optional[Dict[str, Any]]:
+        """Theme by name (file stem, e.g. 'paper'), or None if unknown."""
+        return copy.deepcopy(self._themes.get(name))
+
+    def theme_names(self) -> List[str]:
+        return self._themes.names()
+
+    def export_preset(self, preset_id: str) -> Optional[Dict[str, Any]]:
+        """Export preset by ID (e.g. 'A2_Paper_v1'), or None if unknown."""
+        return copy.deepcopy(self._export_presets.get(preset_id))
+
+    def bbox_presets(self) -> Dict[str, tuple]:
+        """WGS84 bboxes (min_lon, min_lat, max_lon, max_lat) of all bbox presets by name."""
+        config = self._bbox_presets.get() or {}
+        try:
+            return {entry['name']: tuple(entry['bbox_wgs84']) for entry in config.get('presets', [])}
+        except (KeyError, TypeError, AttributeError) as e:
+            print(f"Warning: Invalid bbox presets config: {e}", file=sys.stderr)
+            return {}
+
+    def preset_limits(self) -> Dict[str, Any]:
+        """Preset limits configuration ({} if not configured)."""
+        return copy.deepcopy(self._preset_limits.get() or {})
+
+
+# Shared by all modules of a process
+registry = ConfigRegistry()
@@ -0,0 +1,178 @@
+"""Render cost model fitted on the render history.
+
+Predicts render time, peak memory and output size for any bbox, output
+size and DPI from linear least-squares fits over the most recent completed
+renders (render_history.py). Fits are made per output format, and per
+format and theme once a theme has enough renders of its own. The model is
+refitted as new renders come in, so estimates track data, theme and
+hardware changes.
+
+Features per render: a constant, output megapixels, log(1 + bbox area in
+km²) (data volume grows with area but generalized tables flatten it at
+small scales) and their product.
+"""
+
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from render_history import RenderHistory, bbox_area_km2
+
+# Renders per format the model is fitted on (most recent first)
+COST_MODEL_WINDOW = int(os.getenv('COST_MODEL_WINDOW', '500'))
+
+# Renders needed before a group (format, or format + theme) gets its own fit
+COST_MODEL_MIN_SAMPLES = int(os.getenv('COST_MODEL_MIN_SAMPLES', '8'))
+
+# Refit after this many new renders
+COST_MODEL_REFIT_EVERY = int(os.getenv('COST_MODEL_REFIT_EVERY', '10'))
+
+TARGETS = ('duration_s', 'peak_rss_mb', 'output_bytes')
+
+# Relative ridge term keeping fits stable when renders cover few distinct sizes/areas
+RIDGE = 1e-9
+
+
+def features(width_px: int, height_px: int, area_km2: float) -> List[float]:
+    megapixels = width_px * height_px / 1e6
+    log_area = math.log1p(max(area_km2, 0.0))
+    return [1.0, megapixels, log_area, megapixels * log_area]
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Solve a small dense linear system by Gaussian elimination with partial pivoting."""
+    n = len(vector)
+    a = [row[:] + [vector[i]] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        if abs(a[col][col]) < 1e-12:
+            continue
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            for c in range(col, n + 1):
+                a[r][c] -= factor * a[col][c]
+    solution = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        if abs(a[r][r]) < 1e-12:
+            continue
+        solution[r] = (a[r][n] - sum(a[r][c] * solution[c] for c in range(r + 1, n))) / a[r][r]
+    return solution
+
+
+def fit_least_squares(xs: List[List[float]], ys: List[float], ridge: float = RIDGE) -> List[float]:
+    """Coefficients minimizing ||X·b - y||² + λ·||b||² (normal equations),
+    with λ = ridge relative to the largest diagonal entry of XᵀX.
+
+    Features that do not vary across the samples (other than the leading
+    constant) get a zero coefficient: their effect cannot be told apart
+    from the constant, and extrapolating it to unseen values would be a guess.
+    """
+    n = len(xs[0])
+    active = [0] + [i for i in range(1, n)
+                    if max(x[i] for x in xs) - min(x[i] for x in xs) > 1e-9 * max(1.0, max(abs(x[i]) for x in xs))]
+    # The interaction term varies whenever megapixels does; keep it only with both factors
+    active = [i for i in active if i != 3 or (1 in active and 2 in active)]
+    reduced = [[x[i] for i in active] for x in xs]
+
+    m = len(active)
+    xtx = [[sum(x[i] * x[j] for x in reduced) for j in range(m)] for i in range(m)]
+    damping = ridge * max(xtx[i][i] for i in range(m))
+    for i in range(m):
+        xtx[i][i] += damping
+    xty = [sum(x[i] * y for x, y in zip(reduced, ys)) for i in range(m)]
+
+    coefficients = [0.0] * n
+    for i, value in zip(active, _solve(xtx, xty)):
+        coefficients[i] = value
+    return coefficients
+
+
+def _predict(coefficients: List[float], x: List[float]) -> float:
+    return sum(c * v for c, v in zip(coefficients, x))
+
+
+def fit_group(samples: List[Dict]) -> Dict[str, Tuple[List[float], int]]:
+    """Fit every target on a group of history entries.
+
+    Returns:
+        {target: (coefficients, samples used)} for targets with enough samples
+    """
+    fits = {}
+    for target in TARGETS:
+        rows = [s for s in samples if s.get(target) is not None]
+        if len(rows) < COST_MODEL_MIN_SAMPLES:
+            continue
+        xs = [features(s['width_px'], s['height_px'], s['area_km2']) for s in rows]
+        fits[target] = (fit_least_squares(xs, [float(s[target]) for s in rows]), len(rows))
+    return fits
+
+
+class RenderCostModel:
+    """Predicts render cost from the render history."""
+
+    def __init__(self, history: RenderHistory, window: int = COST_MODEL_WINDOW,
+                 refit_every: int = COST_MODEL_REFIT_EVERY):
+        self.history = history
+        self.window = window
+        self.refit_every = refit_every
+        self._fits = {}  # format -> (history version, {group: fits})
+        self._lock = threading.Lock()
+
+    def _format_fits(self, format_type: str) -> Dict:
+        with self._lock:
+            cached = self._fits.get(format_type)
+            if cached is not None:
+                version, groups = cached
+                new_renders = self.history.version - version
+                # Until there is a first fit, every new render may complete one
+                if new_renders == 0 or (new_renders < self.refit_every and any(groups.values())):
+                    return groups
+
+        version = self.history.version
+        samples = self.history.recent(format_type, self.window)
+        groups = {None: fit_group(samples)}
+        for theme in {s['theme'] for s in samples}:
+            theme_samples = [s for s in samples if s['theme'] == theme]
+            if len(theme_samples) >= COST_MODEL_MIN_SAMPLES:
+                groups[theme] = fit_group(theme_samples)
+
+        with self._lock:
+            self._fits[format_type] = (version, groups)
+        return groups
+
+    def predict(self, bbox_3857: tuple, output_size: tuple, format_type: str = 'png',
+                theme: Optional[str] = None) -> Optional[Dict]:
+        """Estimate the cost of a render.
+
+        Args:
+            bbox_3857: (min_x, min_y, max_x, max_y) in EPSG:3857
+            output_size: (width_px, height_px)
+            format_type: 'png', 'pdf' or 'svg'
+            theme: Theme name (uses the theme's own fit when it has one)
+
+        Returns:
+            dict with duration_s, peak_rss_mb, output_bytes (each None
+            without enough history), samples and basis ('theme' or
+            'format'); None if nothing can be estimated yet
+        """
+        groups = self._format_fits(format_type)
+        theme_fits = groups.get(theme) or {}
+        format_fits = groups.get(None) or {}
+        if not theme_fits and not format_fits:
+            return None
+
+        x = features(output_size[0], output_size[1], bbox_area_km2(bbox_3857))
+        estimate = {'basis': 'theme' if theme_fits else 'format', 'samples': 0}
+        for target in TARGETS:
+            fit = theme_fits.get(target) or format_fits.get(target)
+            if fit is None:
+                estimate[target] = None
+                continue
+            coefficients, samples = fit
+            estimate[target] = max(0.0, _predict(coefficients, x))
+            estimate['samples'] = max(estimate['samples'], samples)
+        if estimate['output_bytes'] is not None:
+            estimate['output_bytes'] = int(round(estimate['output_bytes']))
+        return estimate
@@ -0,0 +1,212 @@
+"""PostGIS datasource configuration for generated Mapnik styles.
+
+All vector layers inherit from one named ``<Datasource>`` template, so they
+share connection settings and Mapnik's connection pool. Mapnik keeps one
+pool per connection string and process; with ``persist_connection`` the
+connections stay open across renders in a long-lived render worker.
+
+Each layer also gets an explicit extent (that of the imported data) and
+SRID/geometry column, so Mapnik does not query PostGIS for them when a
+style is loaded.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from config_registry import registry
+
+# Connection settings
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'demo-b-db')
+POSTGRES_PORT = int(os.getenv('POSTGRES_PORT', '5432'))
+POSTGRES_DB = os.getenv('POSTGRES_DB', 'gis')
+POSTGRES_USER = os.getenv('POSTGRES_USER', 'postgres')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', '')
+
+# Connection pool per render process (Mapnik postgis plugin max_size/initial_size)
+POSTGIS_POOL_MAX_SIZE = int(os.getenv('POSTGIS_POOL_MAX_SIZE', '10'))
+POSTGIS_POOL_INITIAL_SIZE = int(os.getenv('POSTGIS_POOL_INITIAL_SIZE', '1'))
+
+# Rows fetched per round trip through a server-side cursor (0 = fetch all at once)
+POSTGIS_CURSOR_SIZE = int(os.getenv('POSTGIS_CURSOR_SIZE', '10000'))
+
+# Name of the shared datasource template in the style XML
+POSTGIS_DATASOURCE = 'postgis'
+
+# Seconds a "contours loaded for this preset" lookup is reused
+CONTOURS_CHECK_TTL_SECONDS = int(os.getenv('CONTOURS_CHECK_TTL_SECONDS', '60'))
+
+# Full EPSG:3857 extent (used for custom bboxes)
+WEB_MERCATOR_EXTENT = (-20037508.34, -20037508.34, 20037508.34, 20037508.34)
+
+# Buffer in degrees the importer clips OSM data with around a preset bbox
+# (prep-service/src/clip_osm.py), so the data extends this far past it
+IMPORT_BUFFER_DEGREES = 0.1
+
+# Latitude limit of EPSG:3857
+MAX_MERCATOR_LAT = 85.0511287798
+
+_contours_checked: Dict[str, Tuple[float, bool]] = {}
+_contours_lock = threading.Lock()
+
+def _wgs84_to_mercator(lon: float, lat: float) -> Tuple[float, float]:
+    earth_radius = 6378137.0
+    x = math.radians(lon) * earth_radius
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * earth_radius
+    return (x, y)
+
+
+def load_preset_bboxes() -> Dict[str, Tuple[float, float, float, float]]:
+    """WGS84 bboxes of all presets in bbox_presets.json, by preset name
+    (empty if no config file could be read)."""
+    return registry.bbox_presets()
+
+
+def preset_bbox(preset: str) -> Optional[Tuple[float, float, float, float]]:
+    """EPSG:3857 bbox of a preset, or None if unknown."""
+    bbox = load_preset_bboxes().get(preset)
+    if bbox is None:
+        return None
+    min_lon, min_lat, max_lon, max_lat = bbox
+    min_x, min_y = _wgs84_to_mercator(min_lon, min_lat)
+    max_x, max_y = _wgs84_to_mercator(max_lon, max_lat)
+    return (min_x, min_y, max_x, max_y)
+
+
+def tile_preset(bbox_3857: Tuple[float, float, float, float]) -> str:
+    """Smallest bbox preset containing the centre of a bbox ('custom' if none does)."""
+    center_x = (bbox_3857[0] + bbox_3857[2]) / 2
+    center_y = (bbox_3857[1] + bbox_3857[3]) / 2
+    best, best_area = 'custom', math.inf
+    for name in load_preset_bboxes():
+        bbox = preset_bbox(name)
+        if bbox[0] <= center_x <= bbox[2] and bbox[1] <= center_y <= bbox[3]:
+            area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+            if area < best_area:
+                best, best_area = name, area
+    return best
+
+
+def preset_extent(preset: str) -> Optional[Tuple[float, float, float, float]]:
+    """EPSG:3857 extent of the data imported for a bbox preset (the bbox
+    plus the import buffer), or None if unknown."""
+    bbox = load_preset_bboxes().get(preset)
+    if bbox is None:
+        return None
+    min_lon, min_lat, max_lon, max_lat = bbox
+    min_x, min_y = _wgs84_to_mercator(max(-180.0, min_lon - IMPORT_BUFFER_DEGREES),
+                                      max(-MAX_MERCATOR_LAT, min_lat - IMPORT_BUFFER_DEGREES))
+    max_x, max_y = _wgs84_to_mercator(min(180.0, max_lon + IMPORT_BUFFER_DEGREES),
+                                      min(MAX_MERCATOR_LAT, max_lat + IMPORT_BUFFER_DEGREES))
+    return (min_x, min_y, max_x, max_y)
+
+
+def layer_extent(preset: str) -> Tuple[float, float, float, float]:
+    """Extent declared on the PostGIS layers of a style for this preset."""
+    return preset_extent(preset) or WEB_MERCATOR_EXTENT
+
+
+def _parameter(name: str, value) -> str:
+    return f'<Parameter name="{name}">{escape(str(value))}</Parameter>'
+
+
+def postgis_datasource_template() -> str:
+    """Shared PostGIS ``<Datasource name=...>`` element for the top of the style."""
+    params = [
+        ('type', 'postgis'),
+        ('host', POSTGRES_HOST),
+        ('port', POSTGRES_PORT),
+        ('dbname', POSTGRES_DB),
+        ('user', POSTGRES_USER),
+    ]
+    if POSTGRES_PASSWORD:
+        params.append(('password', POSTGRES_PASSWORD))
+    params += [
+        ('persist_connection', 'true'),
+        ('max_size', POSTGIS_POOL_MAX_SIZE),
+        ('initial_size', POSTGIS_POOL_INITIAL_SIZE),
+        ('cursor_size', POSTGIS_CURSOR_SIZE),
+        ('estimate_extent', 'false'),
+        ('srid', 3857),
+        ('geometry_field', 'way'),
+    ]
+    lines = '\n'.join(f"      {_parameter(name, value)}" for name, value in params)
+    return f"""    <Datasource name="{POSTGIS_DATASOURCE}">
+{lines}
+    </Datasource>"""
+
+
+def postgis_layer_datasource(table: str, preset: str) -> str:
+    """``<Datasource>`` element for a PostGIS layer, inheriting the shared template.
+
+    Args:
+        table: Subquery (or table name) for the layer
+        preset: Bbox preset name (selects the declared extent)
+    """
+    extent = ','.join(repr(v) for v in layer_extent(preset))
+    return f"""      <Datasource base="{POSTGIS_DATASOURCE}">
+        {_parameter('table', table)}
+        {_parameter('extent', extent)}
+      </Datasource>"""
+
+
+def _query_contours_loaded(preset: str) -> bool:
+    import psycopg2
+
+    conn = psycopg2.connect(host=POSTGRES_HOST, port=POSTGRES_PORT, dbname=POSTGRES_DB, user=POSTGRES_USER,
+                            password=POSTGRES_PASSWORD or None, connect_timeout=5)
+    try:
+        with conn.cursor() as cur:
+            # load_contours.sh creates the table; databases it never ran on have none
+            cur.execute("SELECT to_regclass('contours') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return False
+            cur.execute("SELECT EXISTS (SELECT 1 FROM contours WHERE preset = %s)", (preset,))
+            return bool(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def contours_loaded(preset: str) -> bool:
+    """Whether PostGIS holds contours for a preset (load_contours.sh).
+
+    Lookups are cached for CONTOURS_CHECK_TTL_SECONDS. A failed lookup
+    counts as no contours, so renders leave the layer out rather than fail.
+    """
+    now = time.monotonic()
+    with _contours_lock:
+        checked = _contours_checked.get(preset)
+    if checked is not None and now - checked[0] < CONTOURS_CHECK_TTL_SECONDS:
+        return checked[1]
+
+    try:
+        loaded = _query_contours_loaded(preset)
+    except Exception as e:
+        print(f"Warning: Could not check contours of preset '{preset}': {e}", file=sys.stderr)
+        loaded = False
+    with _contours_lock:
+        _contours_checked[preset] = (now, loaded)
+    return loaded
+
+
+def layer_share_keys(xml: str) -> List[Optional[str]]:
+    """Data identity of each layer of a style, in map layer order.
+
+    Layers inheriting the PostGIS datasource template are identified by
+    their serialized datasource (table subquery and extent); other layers
+    get None and are not shared.
+    """
+    root = ET.fromstring(xml.encode('utf-8'))
+    keys = []
+    for layer in root.findall('Layer'):
+        datasource = layer.find('Datasource')
+        if datasource is None or datasource.get('base') != POSTGIS_DATASOURCE:
+            keys.append(None)
+        else:
+            keys.append(ET.tostring(datasource, encoding='unicode'))
+    return keys
@@ -0,0 +1,167 @@
+"""Size-bounded on-disk LRU cache.
+
+Entries are files named by key (sharded by the first two characters).
+Reads touch the file's mtime, so eviction removes the least recently used
+files first once the total size exceeds the budget. Scratch files left
+behind by crashed processes are removed when a cache is opened.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+# Scratch (.part) files untouched for this long are left over from a crash
+SCRATCH_MAX_AGE_SECONDS = 3600
+
+
+class DiskCache:
+    """Files keyed by hex digest under a root directory, bounded in total size."""
+
+    # Entry files relative to the root (see path_for)
+    entry_glob = '*/*'
+
+    def __init__(self, root, max_bytes: int):
+        """
+        Args:
+            root: Cache directory (created on first write)
+            max_bytes: Total size budget (0 disables the cache)
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # Lazily computed total size in bytes
+        self.sweep_scratch()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path_for(self, key: str, ext: str) -> Path:
+        """Location of an entry (whether or not it exists)."""
+        return self.root / key[:2] / f"{key}.{ext}"
+
+    def scratch_path(self, ext: str) -> Path:
+        """Unique path on the cache filesystem for writing a new entry
+        before put_file() moves it into place (ignored by eviction)."""
+        scratch_dir = self.root / 'tmp'
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+        return scratch_dir / f"{uuid.uuid4().hex}.{ext}.part"
+
+    def sweep_scratch(self, max_age_seconds: float = SCRATCH_MAX_AGE_SECONDS) -> int:
+        """Delete scratch files not written to for max_age_seconds (other
+        processes sharing the cache may still be writing newer ones).
+
+        Returns:
+            Number of files deleted
+        """
+        if not self.root.exists():
+            return 0
+        cutoff = time.time() - max_age_seconds
+        deleted = 0
+        for path in set(self.root.glob('tmp/*.part')) | set(self.root.glob(self.entry_glob + '.part')):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+    def get(self, key: str, ext: str) -> Optional[Path]:
+        """Return the entry path and mark it as recently used, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put_bytes(self, key: str, data: bytes, ext: str) -> Optional[Path]:
+        """Store bytes under a key (atomically) and evict if over budget."""
+        if not self.enabled or len(data) > self.max_bytes:
+            return None
+        path = self.path_for(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._added(len(data))
+        return path
+
+    def put_file(self, key: str, src_path, ext: str) -> Optional[Path]:
+        """Move an existing file into the cache (same filesystem) and evict if over budget."""
+        size = os.path.getsize(src_path)
+        if not self.enabled or size > self.max_bytes:
+            return None
+        path = self.path_for(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src_path, path)
+        self._added(size)
+        return path
+
+    def _entries(self):
+        if not self.root.exists():
+            return []
+        entries = []
+        for path in self.root.glob(self.entry_glob):
+            if path.suffix == '.part':
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _added(self, size: int):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until under 90% of the budget."""
+        entries = sorted(self._entries())
+        total = sum(entry[1] for entry in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def clear(self):
+        """Delete all entries."""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._size = None
+
+    def stats(self) -> dict:
+        """Approximate total size (tracked in memory, scanned once)."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._entries())
+            return {'size_bytes': self._size, 'max_bytes': self.max_bytes}
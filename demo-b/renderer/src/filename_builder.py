@@ -3,12 +3,12 @@
 Generates deterministic filenames based on preset usage and modification status.
 """
 
-import json
 import os
 import sys
-from pathlib import Path
 from typing import Optional, Dict, Any
 
+from config_registry import registry
+
 
 def load_preset(preset_id: Optional[str]) -> Optional[Dict[str, Any]]:
     """Load export preset by ID.
@@ -22,22 +22,7 @@ def load_preset(preset_id: Optional[str]) -> Optional[Dict[str, Any]]:
     if not preset_id:
         return None
 
-    # Try multiple possible paths
-    possible_paths = [
-        Path(__file__).parent.parent.parent.parent / 'config' / 'export_presets' / f'{preset_id}.json',
-        Path('/app/export_presets') / f'{preset_id}.json',
-        Path(Path.cwd()) / 'config' / 'export_presets' / f'{preset_id}.json'
-    ]
-
-    for preset_path in possible_paths:
-        if preset_path.exists():
-            try:
-                with open(preset_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"[FilenameBuilder] Failed to parse preset {preset_id} from {preset_path}: {e}", file=sys.stderr)
-
-    return None
+    return registry.export_preset(preset_id)
 
 
 def field_differs(preset: Dict[str, Any], field_path: str, request_value: Any) -> bool:
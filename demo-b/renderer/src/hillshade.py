@@ -0,0 +1,230 @@
+"""Hillshade computed from the DEM for the rendered extent.
+
+The prepared hillshade (generate_hillshade.py) is baked with gdaldem's
+default lighting (azimuth 315, altitude 45) and only exists for presets.
+Themes that set their own lighting in their ``hillshade`` block
+(``azimuth``, ``altitude``, ``zFactor``), and bboxes without a prepared
+hillshade, are shaded here instead: the DEM window of the bbox is warped to
+the output pixel grid (GDAL reads only the blocks and overview level it
+needs) and shaded with the Horn method in NumPy, strip by strip so memory
+stays bounded for posters. The result is a single-band GeoTIFF on exactly
+the render's pixel grid (the envelope mapnik grows the bbox to, with square
+pixels), cached by DEM, extent, size and lighting, which the hillshade
+layer then reads instead of the baked file.
+"""
+
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from datasources import tile_preset
+from disk_cache import DiskCache
+
+# Hillshade source: 'auto' (prepared file for default lighting, else the DEM),
+# 'baked' (prepared files only) or 'dem' (always computed from the DEM)
+HILLSHADE_SOURCE = os.getenv('HILLSHADE_SOURCE', 'auto')
+
+# DEM files ({preset}_eudem.tif, as written by download_dem.py)
+DEM_DIR = Path(os.getenv('DEM_DIR', '/data/dem'))
+
+# Computed hillshade cache location and size budget (0 disables the cache)
+HILLSHADE_CACHE_DIR = Path(os.getenv('HILLSHADE_CACHE_DIR', '/exports/hillshade'))
+HILLSHADE_CACHE_MAX_MB = int(os.getenv('HILLSHADE_CACHE_MAX_MB', '1024'))
+
+# Output rows shaded per DEM read
+HILLSHADE_STRIP_ROWS = int(os.getenv('HILLSHADE_STRIP_ROWS', '1024'))
+
+# Lighting of the prepared hillshade files (gdaldem defaults)
+DEFAULT_LIGHTING = {'azimuth': 315.0, 'altitude': 45.0, 'z_factor': 1.0}
+
+
+def theme_lighting(theme: Dict) -> Dict[str, float]:
+    """Lighting parameters of a theme's hillshade block (defaults for missing keys)."""
+    block = theme.get('hillshade', {})
+    return {
+        'azimuth': float(block.get('azimuth', DEFAULT_LIGHTING['azimuth'])),
+        'altitude': float(block.get('altitude', DEFAULT_LIGHTING['altitude'])),
+        'z_factor': float(block.get('zFactor', DEFAULT_LIGHTING['z_factor']))
+    }
+
+
+def dem_path(preset: str) -> Optional[Path]:
+    """DEM file of a preset, or None if it has none."""
+    for path in (DEM_DIR / f"{preset}_eudem.tif", DEM_DIR / 'manual' / f"{preset}_eudem.tif"):
+        if path.exists():
+            return path
+    return None
+
+
+def dem_for_bbox(preset: str, bbox_3857: Tuple[float, float, float, float]) -> Optional[Path]:
+    """DEM to shade a bbox from: the preset's own, else that of the smallest
+    preset containing the bbox centre (for custom bboxes)."""
+    path = dem_path(preset)
+    if path is None:
+        containing = tile_preset(bbox_3857)
+        if containing != 'custom':
+            path = dem_path(containing)
+    return path
+
+
+def use_dem_hillshade(theme: Dict, preset: str, coverage: Optional[Dict[str, bool]]) -> bool:
+    """Whether a render shades the DEM instead of using the prepared hillshade."""
+    if HILLSHADE_SOURCE == 'baked':
+        return False
+    if HILLSHADE_SOURCE == 'dem':
+        return True
+    has_baked = coverage.get('hillshade', False) if coverage is not None else False
+    return not has_baked or theme_lighting(theme) != DEFAULT_LIGHTING
+
+
+def shade(elevation: np.ndarray, xres: float, yres: float, azimuth: float = 315.0, altitude: float = 45.0,
+          z_factor: float = 1.0) -> np.ndarray:
+    """Horn hillshade of an elevation grid, scaled like gdaldem hillshade.
+
+    Args:
+        elevation: float array of shape (h + 2, w + 2), north up, with a
+            one-pixel border around the shaded area (NaN = no data)
+        xres, yres: Pixel width and height in elevation units
+        azimuth: Light direction in degrees clockwise from north
+        altitude: Light elevation above the horizon in degrees
+        z_factor: Vertical exaggeration
+
+    Returns:
+        uint8 array of shape (h, w): 1 (unlit) to 255, 0 where the 3x3
+        window touches no data
+    """
+    z = elevation
+    # Neighbourhood: a b c / d e f / g h i
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, f = z[1:-1, :-2], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xres)
+    dzdy = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * yres)  # Northward gradient
+
+    az = math.radians(azimuth)
+    alt = math.radians(altitude)
+    # Cosine of the angle between the surface normal (-z dz/dx, -z dz/dy, 1) and the sun
+    lit = (math.sin(alt) - z_factor * math.cos(alt) * (dzdx * math.sin(az) + dzdy * math.cos(az))) \
+        / np.sqrt(1 + (z_factor * z_factor) * (dzdx * dzdx + dzdy * dzdy))
+
+    out = 1.0 + 254.0 * np.clip(lit, 0.0, 1.0)
+    out = np.where(np.isnan(out), 0.0, out)
+    return (out + 0.5).astype(np.uint8)
+
+
+def hillshade_cache_key(dem: Path, envelope_3857: tuple, output_size: tuple, lighting: Dict[str, float]) -> str:
+    """Cache key of a computed hillshade (DEM version, extent, size, lighting)."""
+    stat = dem.stat()
+    payload = {
+        'dem': [str(dem), stat.st_mtime, stat.st_size],
+        'envelope_3857': list(envelope_3857),
+        'output_size': list(output_size),
+        'lighting': lighting
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def pixel_grid(envelope_3857: tuple, output_size: tuple) -> Tuple[float, float, float]:
+    """Top-left corner and square pixel size of the output grid.
+
+    The envelope should already match the output aspect ratio (see
+    tiled_render.full_envelope); any remaining mismatch is absorbed by
+    growing the shorter side around the centre, as mapnik does.
+
+    Returns:
+        (min_x, max_y, res) in EPSG:3857 units
+    """
+    width, height = output_size
+    min_x, min_y, max_x, max_y = envelope_3857
+    res = max((max_x - min_x) / width, (max_y - min_y) / height)
+    centre_x, centre_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+    return centre_x - res * width / 2, centre_y + res * height / 2, res
+
+
+def write_hillshade(path, dem: Path, envelope_3857: tuple, output_size: tuple, lighting: Dict[str, float]):
+    """Shade the DEM window of a map envelope at output resolution into a GeoTIFF."""
+    from osgeo import gdal
+
+    width, height = output_size
+    min_x, max_y, res = pixel_grid(envelope_3857, output_size)
+    max_x = min_x + res * width
+
+    source = gdal.Open(str(dem))
+    if source is None:
+        raise ValueError(f"Cannot open DEM {dem}")
+    band = source.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+
+    target = gdal.GetDriverByName('GTiff').Create(str(path), width, height, 1, gdal.GDT_Byte,
+                                                  options=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=2'])
+    target.SetGeoTransform((min_x, res, 0.0, max_y, 0.0, -res))
+    target.SetProjection(_web_mercator_wkt())
+    target.GetRasterBand(1).SetNoDataValue(0)
+
+    for row in range(0, height, HILLSHADE_STRIP_ROWS):
+        rows = min(HILLSHADE_STRIP_ROWS, height - row)
+        # Strip plus a one-pixel border on every side, on the output pixel grid
+        strip_top = max_y - (row - 1) * res
+        window = gdal.Warp('', source, format='MEM', dstSRS='EPSG:3857',
+                           outputBounds=(min_x - res, strip_top - (rows + 2) * res, max_x + res, strip_top),
+                           width=width + 2, height=rows + 2, resampleAlg='bilinear',
+                           outputType=gdal.GDT_Float32, srcNodata=nodata, dstNodata=np.nan)
+        elevation = window.GetRasterBand(1).ReadAsArray()
+        window = None
+        target.GetRasterBand(1).WriteArray(shade(elevation, res, res, **lighting), 0, row)
+
+    target.FlushCache()
+    target = None
+
+
+def _web_mercator_wkt() -> str:
+    from osgeo import osr
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3857)
+    return srs.ExportToWkt()
+
+
+class HillshadeService:
+    """Computed hillshade files for renders, cached on disk."""
+
+    def __init__(self, cache: DiskCache):
+        self.cache = cache
+
+    def hillshade_file(self, theme: Dict, envelope_3857: tuple, output_size: tuple, preset: str,
+                       coverage: Optional[Dict[str, bool]]) -> Optional[str]:
+        """Path of a hillshade computed for a render (computed and cached on
+        a miss), or None if the render uses the prepared hillshade, no DEM
+        covers it or the cache is disabled.
+
+        envelope_3857 is the extent mapnik renders, i.e. the bbox grown to
+        the output aspect ratio (tiled_render.full_envelope).
+        """
+        if not self.cache.enabled or not use_dem_hillshade(theme, preset, coverage):
+            return None
+        dem = dem_for_bbox(preset, envelope_3857)
+        if dem is None:
+            return None
+
+        lighting = theme_lighting(theme)
+        key = hillshade_cache_key(dem, envelope_3857, output_size, lighting)
+        path = self.cache.get(key, 'tif')
+        if path is None:
+            scratch = self.cache.scratch_path('tif')
+            try:
+                write_hillshade(scratch, dem, envelope_3857, output_size, lighting)
+                path = self.cache.put_file(key, scratch, 'tif')
+            finally:
+                # Left behind if the render failed or is larger than the whole cache
+                scratch.unlink(missing_ok=True)
+        return str(path) if path is not None else None
+
+
+def create_hillshade_service() -> HillshadeService:
+    """Hillshade service with a cache configured from the environment."""
+    return HillshadeService(DiskCache(HILLSHADE_CACHE_DIR, HILLSHADE_CACHE_MAX_MB * 1024 * 1024))
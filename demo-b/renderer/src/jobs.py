@@ -0,0 +1,202 @@
+"""Asynchronous render jobs.
+
+A job wraps one validated render request. Jobs run on a small thread pool
+that feeds the renderer (usually the worker process pool), record their
+state and progress, and write the result to a file under RENDER_JOBS_DIR
+so it can be downloaded once finished. Finished jobs expire after
+RENDER_JOB_TTL_SECONDS.
+
+With a result cache, a job whose render is already cached finishes at once
+with the cached file, new results are stored in the cache, and submitting
+a render that is already queued or running returns the pending job.
+"""
+
+import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from disk_cache import DiskCache
+from render_pool import RENDER_WORKERS, RenderQueueFull
+
+# Directory where finished job results are stored
+RENDER_JOBS_DIR = Path(os.getenv('RENDER_JOBS_DIR', '/exports/jobs'))
+
+# Jobs rendering at the same time (extra jobs wait in the job queue)
+RENDER_JOB_CONCURRENCY = int(os.getenv('RENDER_JOB_CONCURRENCY', str(max(1, RENDER_WORKERS))))
+
+# Maximum number of queued + running jobs
+RENDER_JOBS_MAX_PENDING = int(os.getenv('RENDER_JOBS_MAX_PENDING', '32'))
+
+# Seconds finished jobs (and their result files) are kept
+RENDER_JOB_TTL_SECONDS = int(os.getenv('RENDER_JOB_TTL_SECONDS', '3600'))
+
+JOB_STATES = ('queued', 'rendering', 'encoding', 'done', 'failed')
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are pending."""
+
+
+class JobManager:
+    """Runs render jobs in the background and tracks their state."""
+
+    def __init__(self, renderer, jobs_dir: Path = RENDER_JOBS_DIR, concurrency: int = RENDER_JOB_CONCURRENCY,
+                 max_pending: int = RENDER_JOBS_MAX_PENDING, ttl_seconds: int = RENDER_JOB_TTL_SECONDS,
+                 result_cache: DiskCache = None):
+        self.renderer = renderer
+        self.result_cache = result_cache
+        self.jobs_dir = Path(jobs_dir)
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='render-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, render_request: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a prepared render request (see server.prepare_render_request).
+
+        Returns:
+            Public job status dict (of the pending job for the same render,
+            if there is one)
+
+        Raises:
+            JobQueueFull: Too many jobs are queued or running
+        """
+        self._expire()
+        cache_key = render_request.get('cache_key')
+        with self._lock:
+            pending = [job for job in self._jobs.values() if job['state'] not in ('done', 'failed')]
+            for job in pending:
+                if cache_key is not None and job['cache_key'] == cache_key:
+                    return self._public(job)
+            if len(pending) >= self.max_pending:
+                raise JobQueueFull(f"Too many pending render jobs ({len(pending)})")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'state': 'queued',
+                'progress': 0.0,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'filename': render_request['filename'],
+                'mimetype': render_request['mimetype'],
+                'size_bytes': None,
+                'cached': False,
+                'cache_key': cache_key,
+                'path': None
+            }
+            self._jobs[job_id] = job
+
+        self._executor.submit(self._run, job_id, render_request)
+        return self.status(job_id)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _run(self, job_id: str, render_request: Dict[str, Any]):
+        started = False
+        tmp_path = None
+
+        def progress(stage: str, fraction: float):
+            nonlocal started
+            fields = {'state': stage, 'progress': round(fraction, 3)}
+            if not started:
+                # Reported once a render worker has accepted the render; until
+                # then the job stays queued
+                started = True
+                fields['started_at'] = time.time()
+            self._update(job_id, **fields)
+
+        try:
+            cache_key, ext = render_request.get('cache_key'), render_request['format']
+            cache = self.result_cache if self.result_cache is not None and cache_key is not None else None
+            cached_path = cache.get(cache_key, ext) if cache is not None else None
+            if cached_path is not None:
+                self._update(job_id, state='done', progress=1.0, finished_at=time.time(), cached=True,
+                             path=str(cached_path), size_bytes=cached_path.stat().st_size)
+                return
+
+            self.jobs_dir.mkdir(parents=True, exist_ok=True)
+            path = self.jobs_dir / f"{job_id}.{ext}"
+            tmp_path = cache.scratch_path(ext) if cache is not None and cache.enabled \
+                else path.with_suffix(path.suffix + '.part')
+
+            # Synchronous renders may be using every worker; wait for a free
+            # slot, but no longer than finished jobs are kept
+            deadline = time.monotonic() + self.ttl_seconds
+            while True:
+                try:
+                    size = self.renderer.render_to_file(str(tmp_path), *render_request['args'],
+                                                        progress=progress, **render_request['kwargs'])
+                    break
+                except RenderQueueFull:
+                    if time.monotonic() >= deadline:
+                        raise RenderQueueFull(f"No render worker became free within {self.ttl_seconds}s") from None
+                    time.sleep(1.0)
+
+            cached_path = cache.put_file(cache_key, tmp_path, ext) if cache is not None else None
+            if cached_path is None:
+                # Not cached (cache disabled or result too large): kept with the job
+                shutil.move(str(tmp_path), str(path))
+            self._update(job_id, state='done', progress=1.0, finished_at=time.time(), cached=cached_path is not None,
+                         path=str(cached_path or path), size_bytes=size)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Render job {job_id} failed: {e}", file=sys.stderr)
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+            self._update(job_id, state='failed', error=str(e), finished_at=time.time())
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Public status for a job, or None if unknown/expired."""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return self._public(job)
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in job.items() if k not in ('path', 'cache_key')}
+
+    def result_path(self, job_id: str) -> Optional[str]:
+        """Result file path for a finished job, or None (also once a cached
+        result has been evicted from the result cache)."""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] != 'done':
+                return None
+            path = job['path']
+        return path if os.path.exists(path) else None
+
+    def _expire(self):
+        """Drop finished jobs older than the TTL and delete their results."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job['finished_at'] is not None and job['finished_at'] < cutoff]
+            for job in expired:
+                del self._jobs[job['id']]
+
+        for job in expired:
+            # Cached results belong to the result cache
+            if job['path'] and not job['cached']:
+                try:
+                    os.unlink(job['path'])
+                except OSError:
+                    pass
@@ -0,0 +1,162 @@
+"""In-process cache of loaded Mapnik map templates.
+
+Building the style XML and parsing it with ``mapnik.load_map`` (which also
+sets up every datasource) is the same work for every render that shares a
+theme, layer selection, coverage, bbox preset and scale band. The cache
+keeps loaded maps per style key, hands out one map per concurrent render
+and resizes it to the requested output size.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from datasources import layer_extent
+from snapshots import snapshot_version
+
+# Number of distinct style templates kept loaded (LRU)
+MAP_CACHE_SIZE = int(os.getenv('MAP_CACHE_SIZE', '16'))
+
+# Idle map instances kept per template (one is needed per concurrent render)
+MAP_CACHE_IDLE_PER_TEMPLATE = int(os.getenv('MAP_CACHE_IDLE_PER_TEMPLATE', '4'))
+
+
+def style_cache_key(theme: Dict[str, Any], preset: str, layers: Optional[Dict[str, bool]], coverage: Optional[Dict[str, bool]], band: str = 'full', hillshade: Optional[str] = None) -> str:
+    """Build a canonical hash of everything that goes into the style XML.
+
+    Theme keys starting with an underscore (e.g. ``_composition``) are
+    per-request annotations and do not affect the style, so they are ignored.
+
+    Args:
+        theme: Theme JSON dictionary
+        preset: Bbox preset name
+        layers: Layer visibility dict
+        coverage: Coverage dict from check_coverage()
+        band: Scale band (selects generalized layer tables)
+        hillshade: Computed hillshade file the style reads, if any
+
+    Returns:
+        Hex digest identifying the style template
+    """
+    payload = {
+        'theme': {k: v for k, v in theme.items() if not k.startswith('_')},
+        'preset': preset,
+        'layers': layers,
+        'coverage': coverage,
+        'band': band,
+        # Layer extents come from bbox_presets.json, which can change at runtime
+        'extent': layer_extent(preset),
+        # Styles point at the preset's current snapshot files, if any
+        'snapshot': snapshot_version(preset),
+        'hillshade': hillshade
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _MapTemplate:
+    """Style XML plus the idle map instances loaded from it."""
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        self.idle = []
+
+
+class MapTemplateCache:
+    """LRU cache of loaded map templates.
+
+    Mapnik maps are not safe to render from several threads at once and the
+    Python bindings cannot copy a loaded map, so each template keeps a small
+    free-list of loaded instances. A render checks one out, resizes it and
+    returns it afterwards; a second concurrent render of the same style loads
+    another instance from the cached XML.
+    """
+
+    def __init__(self, loader: Callable[[str, int, int], Any], max_entries: int = MAP_CACHE_SIZE,
+                 idle_per_template: int = MAP_CACHE_IDLE_PER_TEMPLATE):
+        """
+        Args:
+            loader: Callable (xml, width, height) -> loaded map object
+            max_entries: Maximum number of templates kept (0 disables caching)
+            idle_per_template: Maximum idle map instances kept per template
+        """
+        self._loader = loader
+        self._max_entries = max_entries
+        self._idle_per_template = idle_per_template
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._templates)
+
+    def _get_template(self, key: str, build_xml: Callable[[], str]) -> _MapTemplate:
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+        # Build outside the lock; a concurrent miss for the same key simply
+        # builds the same XML twice and the first insert wins
+        xml = build_xml()
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = _MapTemplate(xml)
+                if self._max_entries > 0:
+                    self._templates[key] = template
+                    while len(self._templates) > self._max_entries:
+                        self._templates.popitem(last=False)
+            return template
+
+    def get_xml(self, key: str, build_xml: Callable[[], str]) -> str:
+        """Return the style XML for a key, building it on a miss."""
+        return self._get_template(key, build_xml).xml
+
+    @contextmanager
+    def checkout(self, key: str, build_xml: Callable[[], str], width: int, height: int):
+        """Check out a loaded map for one render.
+
+        Args:
+            key: Style key from style_cache_key()
+            build_xml: Callable returning the style XML (only called on a miss)
+            width: Output width in pixels
+            height: Output height in pixels
+
+        Yields:
+            Loaded map resized to (width, height)
+        """
+        template = self._get_template(key, build_xml)
+
+        map_obj = None
+        with self._lock:
+            if template.idle:
+                map_obj = template.idle.pop()
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if map_obj is None:
+            map_obj = self._loader(template.xml, width, height)
+        else:
+            map_obj.resize(width, height)
+
+        try:
+            yield map_obj
+        finally:
+            with self._lock:
+                # Only keep the instance if its template has not been evicted
+                if self._templates.get(key) is template and len(template.idle) < self._idle_per_template:
+                    template.idle.append(map_obj)
+
+    def clear(self):
+        """Drop all cached templates."""
+        with self._lock:
+            self._templates.clear()
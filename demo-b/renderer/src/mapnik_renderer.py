@@ -1,19 +1,102 @@
 """Mapnik renderer implementation."""
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import mapnik
-import tempfile
-import os
-from pathlib import Path
 from renderer_interface import RendererInterface
 from theme_to_mapnik import theme_to_mapnik_xml
+from map_cache import MapTemplateCache, style_cache_key
+from scale_bands import select_band
+from tiled_render import should_tile, should_parallelize, render_png_strips, full_envelope
+from batch_render import BATCH_RENDER_THREADS, shared_layer_data
+from render_metrics import RENDER_PROFILE_LAYERS, Timer, reset_peak_rss, peak_rss_mb
+from result_cache import data_versions
+from png_encoder import encode_png, write_png
+from hillshade import create_hillshade_service
+from layer_masks import (MASK_RENDER_MAX_PIXELS, create_mask_cache, mask_plan, mask_cache_key, mask_planes,
+                         composite as composite_masks)
+import numpy as np
+
+DEFAULT_LAYERS = {
+    'hillshade': True,
+    'water': True,
+    'parks': True,
+    'roads': True,
+    'buildings': True,
+    'contours': True
+}
+
+MERCATOR_SRS = '+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over'
+
+
+def load_map_from_xml(xml_str: str, width: int, height: int) -> mapnik.Map:
+    """Create a Mapnik map of the given size and load a style XML into it."""
+    map_obj = mapnik.Map(width, height)
+    map_obj.srs = MERCATOR_SRS
+
+    # Parse the style straight from memory (no temp file round trip)
+    mapnik.load_map_from_string(map_obj, xml_str)
+
+    return map_obj
+
+
+def profile_layers(map_obj: mapnik.Map, width: int, height: int, timings: dict):
+    """Time the fetch and draw of each layer of a zoomed map separately.
+
+    Each layer is rendered alone onto a scratch image, after reading its
+    features once to time the datasource query on its own (raster layers
+    count as raster I/O). The output is rendered normally afterwards, so
+    profiling never changes it.
+
+    Adds {'layers': {name: {'fetch': s, 'draw': s}}} and 'raster_io' to timings.
+    """
+    layers = list(map_obj.layers)
+    active = [layer.active for layer in layers]
+    query = mapnik.Query(map_obj.envelope())
+    scratch = mapnik.Image(width, height)
+    layer_timings = timings.setdefault('layers', {})
+    try:
+        for layer in layers:
+            layer.active = False
+        for layer, was_active in zip(layers, active):
+            if not was_active:
+                continue
+            start = time.perf_counter()
+            for _ in layer.datasource.features(query):
+                pass
+            fetch = time.perf_counter() - start
+            if layer.datasource.type() == mapnik.DataType.Raster:
+                timings['raster_io'] = timings.get('raster_io', 0.0) + fetch
+
+            layer.active = True
+            start = time.perf_counter()
+            mapnik.render(map_obj, scratch)
+            layer.active = False
+            # The layer render reads its features again; count that as fetch, not draw
+            layer_timings[layer.name] = {
+                'fetch': fetch,
+                'draw': max(0.0, time.perf_counter() - start - fetch)
+            }
+    finally:
+        for layer, was_active in zip(layers, active):
+            layer.active = was_active
+
 
 class MapnikRenderer(RendererInterface):
     """Mapnik-based renderer."""
 
-    def __init__(self):
+    def __init__(self, map_cache: MapTemplateCache = None):
         # Register default fonts path
         mapnik.register_fonts('/usr/share/fonts/truetype/dejavu')
+        # Loaded styles are reused across renders with the same theme/layers/coverage/preset
+        self.map_cache = map_cache if map_cache is not None else MapTemplateCache(load_map_from_xml)
+        # Per-layer coverage masks for composite renders
+        self.mask_cache = create_mask_cache()
+        # Hillshade computed from the DEM for themed lighting and custom bboxes
+        self.hillshade = create_hillshade_service()
 
-    def render(self, theme: dict, bbox_3857: tuple, output_size: tuple, dpi: int, format: str = 'png', preset: str = 'stockholm_core', layers: dict = None, coverage: dict = None) -> bytes:
+    def render(self, theme: dict, bbox_3857: tuple, output_size: tuple, dpi: int, format: str = 'png', preset: str = 'stockholm_core', layers: dict = None, coverage: dict = None, tiled: bool = None, progress=None, timings: dict = None, composite: bool = False, palette: bool = False) -> bytes:
         """Render map using Mapnik.
 
         Args:
@@ -21,89 +104,354 @@ class MapnikRenderer(RendererInterface):
             bbox_3857: (min_x, min_y, max_x, max_y) in EPSG:3857
             output_size: (width_px, height_px)
             dpi: Output DPI
-            format: 'png' or 'pdf'
+            format: 'png', 'pdf' or 'svg'
             preset: Bbox preset name (used for hillshade file path)
             layers: Layer visibility dict (e.g. {'hillshade': True, 'water': False, ...})
+            coverage: Coverage dict from check_coverage()
+            tiled: Render strips in parallel processes (None = automatic, False = in-process)
+            progress: Optional callback (stage, fraction) with stage 'rendering' or 'encoding'
+            timings: Optional dict filled with stage durations in seconds
+                (style_build, map_load, render, encode or strips, total;
+                per-layer fetch/draw when RENDER_PROFILE_LAYERS is set),
+                output_bytes and peak_rss_mb
+            composite: Composite PNGs of up to MASK_RENDER_MAX_PIXELS from
+                cached per-layer masks (a fast preview approximation, see
+                layer_masks); other outputs are rendered normally
+            palette: Write PNGs as 8-bit palette images (for flat themes)
 
         Returns:
             Rendered image bytes
         """
+        start = time.perf_counter()
+        output = io.BytesIO()
+        self.render_to(output, theme, bbox_3857, output_size, dpi, format, preset, layers, coverage, tiled, progress,
+                       timings, composite, palette)
+        if timings is not None:
+            timings['total'] = time.perf_counter() - start
+            timings['output_bytes'] = output.tell()
+        return output.getvalue()
+
+    def render_to_file(self, path: str, *args, **kwargs) -> int:
+        """Render into a file (same arguments as render()).
+
+        Returns:
+            Number of bytes written
+        """
+        start = time.perf_counter()
+        with open(path, 'wb') as f:
+            self.render_to(f, *args, **kwargs)
+            size = f.tell()
+        if kwargs.get('timings') is not None:
+            kwargs['timings']['total'] = time.perf_counter() - start
+            kwargs['timings']['output_bytes'] = size
+        return size
+
+    def render_to(self, output, theme: dict, bbox_3857: tuple, output_size: tuple, dpi: int, format: str = 'png', preset: str = 'stockholm_core', layers: dict = None, coverage: dict = None, tiled: bool = None, progress=None, timings: dict = None, composite: bool = False, palette: bool = False):
+        """Render map and write the result to a binary file object.
+
+        Large PNGs are rendered and encoded strip by strip, so memory use
+        stays proportional to the strip height instead of the poster area.
+        See render() for the arguments.
+        """
         # Default: all layers visible
         if layers is None:
-            layers = {
-                'hillshade': True,
-                'water': True,
-                'parks': True,
-                'roads': True,
-                'buildings': True,
-                'contours': True
-            }
+            layers = dict(DEFAULT_LAYERS)
         width, height = output_size
         min_x, min_y, max_x, max_y = bbox_3857
 
-        # Create Mapnik map
-        map_obj = mapnik.Map(width, height)
-        map_obj.srs = '+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over'
-        map_obj.background = mapnik.Color(theme.get('background', '#faf8f5'))
+        if progress is None:
+            progress = lambda stage, fraction: None
+        progress('rendering', 0.0)
+        if timings is not None:
+            reset_peak_rss()
+
+        # Check out a loaded map for this style (XML is only generated on a cache miss)
+        band = select_band(bbox_3857, output_size)
+        hillshade = self._hillshade_file(theme, bbox_3857, output_size, preset, layers, coverage, timings)
+        cache_key = style_cache_key(theme, preset, layers, coverage, band, hillshade)
 
-        # Generate Mapnik XML from theme
-        xml_str = theme_to_mapnik_xml(theme, bbox_3857, output_size, dpi, preset, layers, coverage)
+        def build_xml():
+            with Timer(timings, 'style_build'):
+                return theme_to_mapnik_xml(theme, bbox_3857, output_size, dpi, preset, layers, coverage, band,
+                                           hillshade)
 
-        # Write XML to temporary file for Mapnik to load
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as f:
-            f.write(xml_str)
-            xml_file = f.name
+        if composite and format == 'png' and width * height <= MASK_RENDER_MAX_PIXELS:
+            if self._render_composite(output, theme, bbox_3857, output_size, dpi, preset, layers, coverage, band,
+                                      hillshade, progress, timings, palette):
+                self._record_peak_rss(timings)
+                return
 
-        try:
-            # Load style from XML
-            mapnik.load_map(map_obj, xml_file)
+        # Large raster outputs are rendered in strips (across worker processes when enabled)
+        if format == 'png' and should_tile(width, height, tiled):
+            xml = self.map_cache.get_xml(cache_key, build_xml)
+            with Timer(timings, 'strips'):
+                render_png_strips(output, cache_key, xml, bbox_3857, width, height, self.map_cache,
+                                  parallel=should_parallelize(tiled), progress=progress, palette=palette)
+            self._record_peak_rss(timings)
+            return
+
+        load_start = time.perf_counter()
+        with self.map_cache.checkout(cache_key, build_xml, width, height) as map_obj:
+            if timings is not None:
+                # Loading (or resizing a cached map), excluding XML generation
+                timings['map_load'] = time.perf_counter() - load_start - timings.get('style_build', 0.0)
 
             # Set bounding box
             bbox = mapnik.Box2d(min_x, min_y, max_x, max_y)
             map_obj.zoom_to_box(bbox)
 
-            # Render to image
-            if format == 'png':
-                im = mapnik.Image(width, height)
-                mapnik.render(map_obj, im)
-                return im.tostring('png')
-            elif format == 'pdf':
-                # Mapnik PDF rendering via Cairo
-                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_file:
-                    pdf_path = pdf_file.name
+            if RENDER_PROFILE_LAYERS and timings is not None:
+                profile_layers(map_obj, width, height, timings)
+
+            self._render_map(map_obj, output, format, width, height, progress, timings, palette)
+        self._record_peak_rss(timings)
+
+    def _render_composite(self, output, theme: dict, bbox_3857: tuple, output_size: tuple, dpi: int, preset: str,
+                          layers: dict, coverage: dict, band: str, hillshade: str, progress,
+                          timings: dict = None, palette: bool = False) -> bool:
+        """Composite a PNG from the per-layer masks of the theme's style
+        (rendered and cached on a miss) and write it to a binary file object.
+
+        Returns:
+            False if the style cannot be composited (nothing is written)
+        """
+        width, height = output_size
+
+        # Masks cover all layers; the request's toggles are applied when compositing
+        all_layers = dict(DEFAULT_LAYERS)
+        if not layers.get('hillshade', True):
+            hillshade = self._hillshade_file(theme, bbox_3857, output_size, preset, all_layers, coverage, timings)
+        cache_key = style_cache_key(theme, preset, all_layers, coverage, band, hillshade)
+
+        def build_xml():
+            with Timer(timings, 'style_build'):
+                return theme_to_mapnik_xml(theme, bbox_3857, output_size, dpi, preset, all_layers, coverage, band,
+                                           hillshade)
+
+        plan = mask_plan(self.map_cache.get_xml(cache_key, build_xml))
+        if plan is None:
+            return False
+
+        key = mask_cache_key(plan['signature'], bbox_3857, output_size, data_versions(preset))
+        stack = self.mask_cache.load(key)
+        if stack is None:
+            with Timer(timings, 'masks'):
+                stack = self._render_masks(plan, bbox_3857, width, height, timings)
+            self.mask_cache.store(key, stack)
+        progress('rendering', 0.6)
 
+        with Timer(timings, 'composite'):
+            rgba = composite_masks(stack, plan['specs'], plan['background'], layers)
+        progress('encoding', 0.8)
+        with Timer(timings, 'encode'):
+            write_png(output, rgba.reshape(-1), width, height, palette)
+        return True
+
+    def _render_masks(self, plan: dict, bbox_3857: tuple, width: int, height: int, timings: dict = None) -> np.ndarray:
+        """Render the mask layers of a mask plan one by one into a stack of
+        coverage planes (see layer_masks.composite), reading each distinct
+        PostGIS layer once for all of its masks."""
+        specs = plan['specs']
+        planes = mask_planes(specs)
+        stack = np.zeros((len(specs) + sum(1 for spec in specs if spec['kind'] == 'raster'), height, width),
+                         dtype=np.uint8)
+
+        with self.map_cache.checkout(f"masks-{plan['signature']}", lambda: plan['xml'], width, height) as map_obj:
+            map_obj.zoom_to_box(mapnik.Box2d(*bbox_3857))
+            mask_layers = list(map_obj.layers)
+            with shared_layer_data([(map_obj, plan['xml'])], timings):
                 try:
-                    # Use cairo surface for PDF
-                    import cairo
-                    surface = cairo.PDFSurface(pdf_path, width, height)
-                    mapnik.render(map_obj, surface)
-                    surface.finish()
-
-                    with open(pdf_path, 'rb') as f:
-                        return f.read()
+                    for layer in mask_layers:
+                        layer.active = False
+                    for layer, spec, plane in zip(mask_layers, specs, planes):
+                        layer.active = True
+                        im = mapnik.Image(width, height)
+                        mapnik.render(map_obj, im)
+                        layer.active = False
+                        if not im.premultiplied():
+                            im.premultiply()
+                        pixels = np.frombuffer(im.tostring(), dtype=np.uint8).reshape(height, width, 4)
+                        if spec['kind'] == 'raster':
+                            stack[plane] = pixels[..., 0]
+                            stack[plane + 1] = pixels[..., 3]
+                        else:
+                            stack[plane] = pixels[..., 3]
                 finally:
-                    if os.path.exists(pdf_path):
-                        os.unlink(pdf_path)
-            elif format == 'svg':
-                # Mapnik SVG rendering via Cairo
-                with tempfile.NamedTemporaryFile(suffix='.svg', delete=False) as svg_file:
-                    svg_path = svg_file.name
+                    for layer in mask_layers:
+                        layer.active = True
+        return stack
 
-                try:
-                    import cairo
-                    surface = cairo.SVGSurface(svg_path, width, height)
-                    mapnik.render(map_obj, surface)
-                    surface.finish()
+    @staticmethod
+    def _render_map(map_obj: mapnik.Map, output, format: str, width: int, height: int, progress, timings: dict = None,
+                    palette: bool = False):
+        """Render a zoomed map in an output format and write it to a binary file object."""
+        if format == 'png':
+            im = mapnik.Image(width, height)
+            with Timer(timings, 'render'):
+                mapnik.render(map_obj, im)
+            progress('encoding', 0.8)
+            with Timer(timings, 'encode'):
+                im.demultiply()
+                write_png(output, im.tostring(), width, height, palette)
+        elif format in ('pdf', 'svg'):
+            # Mapnik vector rendering via Cairo, written directly to the
+            # output file object as cairo produces it
+            import cairo
+            surface_class = cairo.PDFSurface if format == 'pdf' else cairo.SVGSurface
+            surface = surface_class(output, width, height)
+            with Timer(timings, 'render'):
+                mapnik.render(map_obj, surface)
+            progress('encoding', 0.8)
+            with Timer(timings, 'encode'):
+                surface.finish()
+        else:
+            raise ValueError(f"Unsupported format: {format}. Supported: png, pdf, svg")
 
-                    with open(svg_path, 'rb') as f:
-                        return f.read()
-                finally:
-                    if os.path.exists(svg_path):
-                        os.unlink(svg_path)
-            else:
-                raise ValueError(f"Unsupported format: {format}. Supported: png, pdf, svg")
-        finally:
-            # Clean up temporary XML file
-            if os.path.exists(xml_file):
-                os.unlink(xml_file)
+    def render_batch_to_files(self, paths: list, variants: list, bbox_3857: tuple, output_size: tuple, dpi: int,
+                              format: str = 'png', preset: str = 'stockholm_core', coverage: dict = None,
+                              progress=None, timings: dict = None) -> list:
+        """Render several theme/layer variants of one map into files,
+        fetching the features of each PostGIS layer once for all of them.
+
+        Variants are rendered in parallel threads from the shared data.
+        Outputs that need strip rendering are rendered one by one as usual.
+
+        Args:
+            paths: Output file path per variant
+            variants: List of dicts with keys theme, layers (None = all layers)
+                and optionally palette (see render())
+            bbox_3857, output_size, dpi, format, preset, coverage: As for render()
+            progress: Optional callback (stage, fraction)
+            timings: Optional dict filled with fetch, render and total times
+
+        Returns:
+            Number of bytes written per variant
+        """
+        if progress is None:
+            progress = lambda stage, fraction: None
+        width, height = output_size
+        start = time.perf_counter()
+
+        if format == 'png' and should_tile(width, height):
+            sizes = []
+            for done, (path, variant) in enumerate(zip(paths, variants)):
+                sizes.append(self.render_to_file(path, variant['theme'], bbox_3857, output_size, dpi, format, preset,
+                                                 variant.get('layers'), coverage, palette=variant.get('palette', False)))
+                progress('rendering', (done + 1) / len(variants))
+            return sizes
+
+        if timings is not None:
+            reset_peak_rss()
+        band = select_band(bbox_3857, output_size)
+        progress('rendering', 0.0)
+        with ExitStack() as stack:
+            maps = []
+            for variant in variants:
+                theme, layers = variant['theme'], variant.get('layers') or dict(DEFAULT_LAYERS)
+                hillshade = self._hillshade_file(theme, bbox_3857, output_size, preset, layers, coverage)
+                cache_key = style_cache_key(theme, preset, layers, coverage, band, hillshade)
+                build_xml = (lambda theme=theme, layers=layers, hillshade=hillshade:
+                             theme_to_mapnik_xml(theme, bbox_3857, output_size, dpi, preset, layers, coverage, band,
+                                                 hillshade))
+                xml = self.map_cache.get_xml(cache_key, build_xml)
+                map_obj = stack.enter_context(self.map_cache.checkout(cache_key, build_xml, width, height))
+                map_obj.zoom_to_box(mapnik.Box2d(*bbox_3857))
+                maps.append((map_obj, xml))
+
+            with shared_layer_data(maps, timings):
+                progress('rendering', 0.2)
+                done = []
+
+                def render_variant(map_obj, path, palette):
+                    with open(path, 'wb') as f:
+                        self._render_map(map_obj, f, format, width, height, lambda stage, fraction: None,
+                                         palette=palette)
+                        size = f.tell()
+                    done.append(path)
+                    progress('rendering', 0.2 + 0.8 * len(done) / len(maps))
+                    return size
+
+                with Timer(timings, 'render'), ThreadPoolExecutor(max_workers=BATCH_RENDER_THREADS) as executor:
+                    sizes = list(executor.map(render_variant, [m for m, _ in maps], paths,
+                                              [variant.get('palette', False) for variant in variants]))
+
+        if timings is not None:
+            timings['total'] = time.perf_counter() - start
+            timings['output_bytes'] = sum(sizes)
+        self._record_peak_rss(timings)
+        return sizes
+
+    def render_metatile(self, theme: dict, bbox_3857: tuple, size: int, tile_size: int = 256, buffer: int = 128,
+                        preset: str = 'stockholm_core', layers: dict = None, coverage: dict = None,
+                        timings: dict = None) -> list:
+        """Render a block of size x size map tiles at once and slice it into PNG tiles.
+
+        The block is rendered with a buffer of extra pixels on every side at
+        the same pixel grid, so features crossing tile edges match up.
+
+        Args:
+            theme, preset, layers, coverage: As for render()
+            bbox_3857: Extent of the tile block (without buffer)
+            size: Tiles per side
+            tile_size: Tile width and height in pixels
+            buffer: Pixels rendered around the block and cropped away
+
+        Returns:
+            PNG bytes per tile, row by row from the top-left tile (8-bit
+            palette PNGs if the theme sets "palette")
+        """
+        if layers is None:
+            layers = dict(DEFAULT_LAYERS)
+        start = time.perf_counter()
+        block = size * tile_size
+        width = height = block + 2 * buffer
+        min_x, min_y, max_x, max_y = bbox_3857
+        margin = (max_x - min_x) * buffer / block
+        buffered_bbox = (min_x - margin, min_y - margin, max_x + margin, max_y + margin)
+
+        # Scale band of the tiles themselves, not of the buffered render
+        band = select_band(bbox_3857, (block, block))
+        hillshade = self._hillshade_file(theme, buffered_bbox, (width, height), preset, layers, coverage, timings)
+        cache_key = style_cache_key(theme, preset, layers, coverage, band, hillshade)
+
+        def build_xml():
+            with Timer(timings, 'style_build'):
+                return theme_to_mapnik_xml(theme, buffered_bbox, (width, height), 72, preset, layers, coverage, band,
+                                           hillshade)
+
+        with self.map_cache.checkout(cache_key, build_xml, width, height) as map_obj:
+            map_obj.zoom_to_box(mapnik.Box2d(*buffered_bbox))
+            im = mapnik.Image(width, height)
+            with Timer(timings, 'render'):
+                mapnik.render(map_obj, im)
+
+        with Timer(timings, 'encode'):
+            im.demultiply()
+            pixels = np.frombuffer(im.tostring(), dtype=np.uint8).reshape(height, width, 4)
+            palette = bool(theme.get('palette', False))
+            tiles = []
+            for dy in range(size):
+                for dx in range(size):
+                    top, left = buffer + dy * tile_size, buffer + dx * tile_size
+                    tile = np.ascontiguousarray(pixels[top:top + tile_size, left:left + tile_size])
+                    tiles.append(encode_png(tile, tile_size, tile_size, palette=palette))
+        if timings is not None:
+            timings['total'] = time.perf_counter() - start
+            timings['output_bytes'] = sum(len(tile) for tile in tiles)
+        return tiles
+
+    def _hillshade_file(self, theme: dict, bbox_3857: tuple, output_size: tuple, preset: str, layers: dict,
+                        coverage: dict, timings: dict = None):
+        """Hillshade computed from the DEM for a render, or None to use the
+        preset's prepared hillshade (see hillshade.py)."""
+        if not layers.get('hillshade', True):
+            return None
+        with Timer(timings, 'hillshade'):
+            # Shade the extent mapnik actually draws, not the requested bbox
+            envelope = full_envelope(bbox_3857, *output_size)
+            return self.hillshade.hillshade_file(theme, envelope, output_size, preset, coverage)
 
+    @staticmethod
+    def _record_peak_rss(timings: dict):
+        if timings is not None:
+            timings['peak_rss_mb'] = peak_rss_mb()
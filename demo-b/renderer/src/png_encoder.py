@@ -0,0 +1,428 @@
+"""PNG encoding of raw RGBA pixel buffers.
+
+All raster outputs of the renderer are encoded here rather than with
+``Image.tostring('png')``, which runs a single zlib stream over the whole
+image. PNGStreamWriter encodes rows incrementally and writes IDAT chunks as
+it goes, so memory use depends on the number of rows passed per call, not
+on the image size (strips rendered in separate processes are streamed
+straight through it).
+
+Rows are filtered with NumPy and compressed in chunks by a thread pool
+(zlib releases the GIL). Each chunk is an independent raw deflate stream
+ended with a sync flush, which leaves it byte-aligned and without a final
+block, so the chunks concatenate into one valid zlib stream; the Adler-32
+checksums of the chunks are combined arithmetically. Chunks start at fixed
+row numbers (rows short of a whole chunk wait for the next call), so the
+file is the same however the rows are split across calls and threads.
+
+PalettePNGWriter writes the same rows as an 8-bit palette PNG: opaque
+pixels are binned at 5-6-5 bits per channel and translucent ones at 4 bits
+per channel including alpha while the rows stream in, the 256 most common
+bins (at the mean colour of their pixels) become the palette, and the
+indices are encoded at close. Flat themes have few colours apart from
+anti-aliasing, so their PNGs come out much smaller and faster to compress
+at close to no visible change.
+"""
+
+import io
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Compressed bytes collected before an IDAT chunk is written
+IDAT_CHUNK_SIZE = 256 * 1024
+
+# zlib compression level (0-9) of rendered PNGs
+PNG_COMPRESSION_LEVEL = int(os.getenv('PNG_COMPRESSION_LEVEL', '6'))
+
+# Row filter of RGBA PNGs: none, sub, up or paeth (palette PNGs are not filtered)
+PNG_FILTER = os.getenv('PNG_FILTER', 'up')
+
+# Threads compressing row chunks of one PNG in parallel
+PNG_ENCODE_THREADS = int(os.getenv('PNG_ENCODE_THREADS', str(min(4, os.cpu_count() or 1))))
+
+# Uncompressed bytes per compression task
+PNG_ENCODE_CHUNK_BYTES = 1024 * 1024
+
+PNG_FILTERS = {'none': 0, 'sub': 1, 'up': 2, 'paeth': 4}
+
+COLOR_TYPE_RGBA = 6
+COLOR_TYPE_PALETTE = 3
+
+# zlib stream header (deflate, 32K window, default compression)
+ZLIB_HEADER = b'\x78\x9c'
+
+ADLER_BASE = 65521
+
+# Palette bins: 5-6-5 opaque colours, then 4-4-4-4 translucent ones (see color_bin)
+COLOR_BINS = 2 << 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    """Build a PNG chunk (length, tag, data, CRC)."""
+    crc = zlib.crc32(tag)
+    crc = zlib.crc32(data, crc) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+
+def png_header(width: int, height: int, color_type: int = COLOR_TYPE_RGBA) -> bytes:
+    """PNG signature plus IHDR for an 8-bit RGBA (or palette) image."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return PNG_SIGNATURE + png_chunk(b'IHDR', ihdr)
+
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Adler-32 of two concatenated byte strings from the checksums of each
+    (length2 is the length of the second), as zlib's adler32_combine()."""
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - remainder) % ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def filter_rows(rows: np.ndarray, previous: Optional[np.ndarray], bpp: int, method: str) -> np.ndarray:
+    """Apply a PNG filter to whole rows.
+
+    Args:
+        rows: uint8 array of shape (n, stride)
+        previous: Unfiltered row above the first one (None at the top of the image)
+        bpp: Bytes per pixel
+        method: 'none', 'sub', 'up' or 'paeth'
+
+    Returns:
+        uint8 array of shape (n, stride + 1), each row prefixed with its filter type
+    """
+    n, stride = rows.shape
+    out = np.empty((n, stride + 1), dtype=np.uint8)
+    out[:, 0] = PNG_FILTERS[method]
+    if method == 'none':
+        out[:, 1:] = rows
+        return out
+
+    above = np.empty_like(rows)
+    above[0] = previous if previous is not None else 0
+    above[1:] = rows[:-1]
+    if method == 'up':
+        np.subtract(rows, above, out=out[:, 1:])
+        return out
+
+    left = np.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+    if method == 'sub':
+        np.subtract(rows, left, out=out[:, 1:])
+        return out
+
+    upper_left = np.zeros_like(rows)
+    upper_left[:, bpp:] = above[:, :-bpp]
+    a, b, c = (x.astype(np.int16) for x in (left, above, upper_left))
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+    predictor = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c)).astype(np.uint8)
+    np.subtract(rows, predictor, out=out[:, 1:])
+    return out
+
+
+def _compress_chunk(rows: np.ndarray, previous: Optional[np.ndarray], bpp: int, method: str, level: int):
+    """Filter and compress one chunk of rows into a byte-aligned raw deflate segment.
+
+    Returns:
+        (compressed bytes, Adler-32 of the filtered bytes, filtered length)
+    """
+    filtered = filter_rows(rows, previous, bpp, method)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(filtered) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(filtered), filtered.size
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PNG_ENCODE_THREADS, thread_name_prefix='png-encode')
+    return _executor
+
+
+class PNGStreamWriter:
+    """Incremental RGBA (or palette index) PNG writer.
+
+    Usage:
+        writer = PNGStreamWriter(f, width, height)
+        writer.write_rows(band_rgba)   # any number of whole rows, top to bottom
+        writer.close()                 # after exactly `height` rows
+    """
+
+    def __init__(self, output, width: int, height: int, compression_level: int = None, filter: str = None,
+                 threads: int = None, palette: np.ndarray = None, palette_alpha: np.ndarray = None):
+        """
+        Args:
+            output: Binary file object to write to
+            width: Image width in pixels
+            height: Image height in pixels
+            compression_level: zlib compression level (0-9, default PNG_COMPRESSION_LEVEL)
+            filter: Row filter (default PNG_FILTER; always 'none' for palette images)
+            threads: Compress chunks in the shared pool of PNG_ENCODE_THREADS
+                threads when above 1 (default PNG_ENCODE_THREADS)
+            palette: uint8 array of shape (n, 3) for a palette image whose
+                rows are one index byte per pixel
+            palette_alpha: Optional uint8 alpha per palette entry
+        """
+        if palette is None:
+            color_type, self.bpp, method = COLOR_TYPE_RGBA, 4, filter or PNG_FILTER
+        else:
+            color_type, self.bpp, method = COLOR_TYPE_PALETTE, 1, 'none'
+        if method not in PNG_FILTERS:
+            raise ValueError(f"Unknown PNG filter: {method}. Supported: {', '.join(PNG_FILTERS)}")
+
+        self.output = output
+        self.width = width
+        self.height = height
+        self.stride = width * self.bpp
+        self.rows_written = 0
+        self.filter = method
+        self.compression_level = PNG_COMPRESSION_LEVEL if compression_level is None else compression_level
+        self.threads = PNG_ENCODE_THREADS if threads is None else threads
+        self._adler = zlib.adler32(b'')
+        self._previous = None
+        self._chunk_rows = max(1, PNG_ENCODE_CHUNK_BYTES // self.stride)
+        self._carry = None  # Rows written but not yet compressed (less than a chunk)
+        self._pending = [ZLIB_HEADER]
+        self._pending_size = len(ZLIB_HEADER)
+
+        self.output.write(png_header(width, height, color_type))
+        if palette is not None:
+            self.output.write(png_chunk(b'PLTE', np.ascontiguousarray(palette, dtype=np.uint8).tobytes()))
+            if palette_alpha is not None:
+                self.output.write(png_chunk(b'tRNS', np.ascontiguousarray(palette_alpha, dtype=np.uint8).tobytes()))
+
+    def _emit(self, compressed: bytes, force: bool = False):
+        if compressed:
+            self._pending.append(compressed)
+            self._pending_size += len(compressed)
+        if self._pending and (force or self._pending_size >= IDAT_CHUNK_SIZE):
+            self.output.write(png_chunk(b'IDAT', b''.join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, rgba):
+        """Append whole rows of raw RGBA data (palette indices for palette images).
+
+        Args:
+            rgba: bytes-like object whose length is a multiple of width * 4
+                (width for palette images)
+        """
+        data = np.frombuffer(memoryview(rgba).cast('B'), dtype=np.uint8)
+        rows, remainder = divmod(len(data), self.stride)
+        if remainder:
+            raise ValueError(f"Buffer size {len(data)} is not a whole number of {self.width}px rows")
+        if self.rows_written + rows > self.height:
+            raise ValueError(f"Too many rows: {self.rows_written + rows} > {self.height}")
+        if rows == 0:
+            return
+        data = data.reshape(rows, self.stride)
+        if self._carry is not None:
+            data = np.concatenate([self._carry, data])
+        whole = len(data) - len(data) % self._chunk_rows
+        self._carry = data[whole:].copy() if whole < len(data) else None
+        self.rows_written += rows
+        self._compress_rows(data[:whole])
+
+    def _compress_rows(self, data: np.ndarray):
+        """Filter and compress rows (whole chunks, except at close) and emit them."""
+        if len(data) == 0:
+            return
+        chunk_rows = self._chunk_rows
+        starts = range(0, len(data), chunk_rows)
+        args = [(data[start:start + chunk_rows], data[start - 1] if start else self._previous)
+                for start in starts]
+        if self.threads > 1 and len(args) > 1:
+            results = _get_executor().map(
+                lambda a: _compress_chunk(a[0], a[1], self.bpp, self.filter, self.compression_level), args)
+        else:
+            results = (_compress_chunk(chunk, previous, self.bpp, self.filter, self.compression_level)
+                       for chunk, previous in args)
+
+        for compressed, adler, length in results:
+            self._adler = adler32_combine(self._adler, adler, length)
+            self._emit(compressed)
+        self._previous = data[-1].copy()
+
+    def close(self):
+        """Finish the zlib stream and write the trailing chunks."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Expected {self.height} rows, got {self.rows_written}")
+        if self._carry is not None:
+            self._compress_rows(self._carry)
+            self._carry = None
+        # Empty final block, then the checksum of all filtered bytes
+        final = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)
+        self._emit(final + struct.pack('>I', self._adler), force=True)
+        self.output.write(png_chunk(b'IEND', b''))
+
+
+class PalettePNGWriter:
+    """Incremental RGBA writer producing an 8-bit palette PNG.
+
+    Takes the same rows as PNGStreamWriter, but writes the file at close(),
+    once the palette is known. Binned rows are kept in a spooled temporary
+    file (4 bytes per pixel) in the meantime.
+    """
+
+    PALETTE_SIZE = 256
+
+    def __init__(self, output, width: int, height: int, compression_level: int = None, threads: int = None):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.compression_level = compression_level
+        self.threads = threads
+        self.rows_written = 0
+        self._counts = np.zeros(COLOR_BINS, dtype=np.int64)
+        self._sums = np.zeros((4, COLOR_BINS), dtype=np.float64)
+        self._opaque = True
+        self._spool = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+
+    def write_rows(self, rgba):
+        """Append whole rows of raw RGBA data (see PNGStreamWriter.write_rows)."""
+        pixels = np.frombuffer(memoryview(rgba).cast('B'), dtype=np.uint8)
+        if len(pixels) % (self.width * 4):
+            raise ValueError(f"Buffer size {len(pixels)} is not a whole number of {self.width}px RGBA rows")
+        rows = len(pixels) // (self.width * 4)
+        if self.rows_written + rows > self.height:
+            raise ValueError(f"Too many rows: {self.rows_written + rows} > {self.height}")
+        pixels = pixels.reshape(-1, 4)
+
+        bins = color_bin(pixels)
+        self._counts += np.bincount(bins, minlength=COLOR_BINS)
+        for channel in range(4):
+            self._sums[channel] += np.bincount(bins, weights=pixels[:, channel], minlength=COLOR_BINS)
+        if self._opaque and pixels[:, 3].min() < 255:
+            self._opaque = False
+        self._spool.write(bins.tobytes())
+        self.rows_written += rows
+
+    def close(self):
+        """Build the palette and write the PNG."""
+        if self.rows_written != self.height:
+            raise ValueError(f"Expected {self.height} rows, got {self.rows_written}")
+        palette, alpha, lookup = build_palette(self._counts, self._sums, self.PALETTE_SIZE)
+        writer = PNGStreamWriter(self.output, self.width, self.height, self.compression_level,
+                                 threads=self.threads, palette=palette,
+                                 palette_alpha=None if self._opaque else alpha)
+        self._spool.seek(0)
+        rows_per_read = max(1, (8 * 1024 * 1024) // (self.width * 4))
+        for _ in range(0, self.height, rows_per_read):
+            bins = np.frombuffer(self._spool.read(rows_per_read * self.width * 4), dtype=np.uint32)
+            writer.write_rows(lookup[bins])
+        writer.close()
+        self._spool.close()
+
+
+def rgb565(pixels: np.ndarray) -> np.ndarray:
+    """5-6-5 bit colour bin of each pixel of an (n, 4) uint8 array."""
+    r = pixels[:, 0].astype(np.uint16)
+    g = pixels[:, 1].astype(np.uint16)
+    b = pixels[:, 2].astype(np.uint16)
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+
+def color_bin(pixels: np.ndarray) -> np.ndarray:
+    """Palette bin of each pixel of an (n, 4) uint8 array.
+
+    Opaque pixels fall in their 5-6-5 bin (0 to 65535). Translucent pixels
+    are binned at 4 bits per channel including alpha, above those, so that
+    transparent pixels never share a bin (and a mean colour) with opaque
+    ones.
+    """
+    bins = rgb565(pixels).astype(np.uint32)
+    translucent = pixels[:, 3] < 255
+    if translucent.any():
+        nibbles = pixels[translucent].astype(np.uint32) >> 4
+        bins[translucent] = (1 << 16) | (nibbles[:, 0] << 12) | (nibbles[:, 1] << 8) | (nibbles[:, 2] << 4) \
+            | nibbles[:, 3]
+    return bins
+
+
+def build_palette(counts: np.ndarray, sums: np.ndarray, size: int = 256):
+    """Palette from colour bin statistics.
+
+    The most common bins become palette entries at the mean colour of their
+    pixels; every other bin maps to the nearest entry.
+
+    Args:
+        counts: Pixels per bin
+        sums: Per-channel (RGBA) sums of the pixel values per bin, shape (4, bins)
+        size: Maximum palette entries
+
+    Returns:
+        (palette RGB of shape (n, 3), palette alpha of shape (n,), uint8 lookup bin -> index)
+    """
+    used = np.flatnonzero(counts)
+    chosen = used[np.argsort(counts[used])[::-1][:size]]
+    means = (sums[:, chosen] / counts[chosen]).T
+    palette = np.clip(np.round(means), 0, 255).astype(np.uint8)
+
+    lookup = np.zeros(len(counts), dtype=np.uint8)
+    lookup[chosen] = np.arange(len(chosen), dtype=np.uint8)
+    others = np.setdiff1d(used, chosen, assume_unique=True)
+    if len(others):
+        colors = (sums[:, others] / counts[others]).T
+        for start in range(0, len(others), 4096):
+            block = colors[start:start + 4096, None, :] - means[None, :, :]
+            lookup[others[start:start + 4096]] = np.argmin((block * block).sum(axis=2), axis=1)
+    return palette[:, :3], palette[:, 3], lookup
+
+
+def create_png_writer(output, width: int, height: int, palette: bool = False):
+    """PNG writer for a render (RGBA, or an 8-bit palette when requested)."""
+    if palette:
+        return PalettePNGWriter(output, width, height)
+    return PNGStreamWriter(output, width, height)
+
+
+def write_png(output, rgba, width: int, height: int, palette: bool = False):
+    """Encode a whole raw RGBA buffer as PNG and write it to a binary file object."""
+    if len(memoryview(rgba).cast('B')) != width * 4 * height:
+        raise ValueError(f"Buffer size {len(memoryview(rgba).cast('B'))} does not match {width}x{height} RGBA")
+    writer = create_png_writer(output, width, height, palette)
+    writer.write_rows(rgba)
+    writer.close()
+
+
+def encode_png(rgba, width: int, height: int, compression_level: int = None, palette: bool = False) -> bytes:
+    """Encode a raw RGBA buffer (row-major, 4 bytes per pixel) as PNG.
+
+    Args:
+        rgba: bytes-like object of length width * height * 4
+        width: Image width in pixels
+        height: Image height in pixels
+        compression_level: zlib compression level (0-9, default PNG_COMPRESSION_LEVEL)
+        palette: Write an 8-bit palette PNG
+
+    Returns:
+        PNG file bytes
+    """
+    if len(memoryview(rgba).cast('B')) != width * 4 * height:
+        raise ValueError(f"Buffer size {len(memoryview(rgba).cast('B'))} does not match {width}x{height} RGBA")
+
+    output = io.BytesIO()
+    if palette:
+        writer = PalettePNGWriter(output, width, height, compression_level)
+    else:
+        writer = PNGStreamWriter(output, width, height, compression_level)
+    writer.write_rows(rgba)
+    writer.close()
+    return output.getvalue()
@@ -0,0 +1,159 @@
+"""Persistent history of completed renders.
+
+Every successful render is stored with its parameters and measured
+duration, peak memory and output size in a small SQLite database. The
+render cost model (cost_model.py) is fitted on the most recent entries,
+so estimates follow changes in data, themes and hardware.
+"""
+
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# SQLite database of completed renders (empty disables the history)
+RENDER_HISTORY_DB = os.getenv('RENDER_HISTORY_DB', '/exports/render_history.sqlite')
+
+# Rows kept; older renders are pruned
+RENDER_HISTORY_MAX_ROWS = int(os.getenv('RENDER_HISTORY_MAX_ROWS', '20000'))
+
+COLUMNS = ('created_at', 'preset', 'theme', 'format', 'dpi', 'width_px', 'height_px', 'area_km2',
+           'duration_s', 'peak_rss_mb', 'output_bytes')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    preset TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    format TEXT NOT NULL,
+    dpi INTEGER NOT NULL,
+    width_px INTEGER NOT NULL,
+    height_px INTEGER NOT NULL,
+    area_km2 REAL NOT NULL,
+    duration_s REAL NOT NULL,
+    peak_rss_mb REAL,
+    output_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS renders_format_id ON renders (format, id);
+"""
+
+
+def bbox_area_km2(bbox_3857: tuple) -> float:
+    """Ground area of an EPSG:3857 bbox in km² (corrected for Mercator scale at its centre)."""
+    min_x, min_y, max_x, max_y = bbox_3857
+    center_lat = math.atan(math.sinh(((min_y + max_y) / 2) / 6378137.0))
+    scale = math.cos(center_lat)
+    return (max_x - min_x) * (max_y - min_y) * scale * scale / 1e6
+
+
+def render_record(args: tuple, duration: float, timings: dict) -> Dict:
+    """History entry for a finished render.
+
+    Args:
+        args: Positional render arguments (theme, bbox_3857, output_size, dpi, format, preset, ...)
+        duration: Render time in seconds as seen by the caller (used when
+            the renderer did not report its own total, which excludes
+            waiting for a worker)
+        timings: Timings dict filled by the renderer
+    """
+    theme, bbox_3857, output_size, dpi = args[:4]
+    return {
+        'created_at': time.time(),
+        'preset': args[5] if len(args) > 5 else 'stockholm_core',
+        'theme': theme.get('name', 'unknown') if isinstance(theme, dict) else 'unknown',
+        'format': args[4] if len(args) > 4 else 'png',
+        'dpi': int(dpi),
+        'width_px': int(output_size[0]),
+        'height_px': int(output_size[1]),
+        'area_km2': bbox_area_km2(bbox_3857),
+        'duration_s': timings.get('total', duration),
+        'peak_rss_mb': timings.get('peak_rss_mb'),
+        'output_bytes': timings.get('output_bytes')
+    }
+
+
+class RenderHistory:
+    """SQLite store of completed renders."""
+
+    def __init__(self, path: Optional[str], max_rows: int = RENDER_HISTORY_MAX_ROWS):
+        self.path = Path(path) if path else None
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._initialized = False
+        # Incremented on every insert, so readers can tell when to refit
+        self.version = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=10)
+        if not self._initialized:
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def record(self, entry: Dict):
+        """Store one render (failures are logged, never raised)."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    with conn:
+                        cur = conn.execute(
+                            f"INSERT INTO renders ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                            [entry.get(c) for c in COLUMNS])
+                        if self.max_rows > 0 and cur.lastrowid % 100 == 0:
+                            conn.execute("DELETE FROM renders WHERE id <= ?", (cur.lastrowid - self.max_rows,))
+                finally:
+                    conn.close()
+                self.version += 1
+        except (sqlite3.Error, OSError) as e:
+            print(f"Warning: Failed to record render history: {e}", file=sys.stderr)
+
+    def recent(self, format_type: str, limit: int) -> List[Dict]:
+        """Most recent renders of a format, newest first."""
+        if not self.enabled:
+            return []
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    rows = conn.execute(
+                        f"SELECT {', '.join(COLUMNS)} FROM renders WHERE format = ? ORDER BY id DESC LIMIT ?",
+                        (format_type, limit)).fetchall()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Warning: Failed to read render history: {e}", file=sys.stderr)
+            return []
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def count(self) -> int:
+        """Number of stored renders."""
+        if not self.enabled:
+            return 0
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    return conn.execute("SELECT COUNT(*) FROM renders").fetchone()[0]
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return 0
+
+
+def create_render_history() -> RenderHistory:
+    """Render history configured from the environment."""
+    return RenderHistory(RENDER_HISTORY_DB or None)
@@ -0,0 +1,269 @@
+"""Render timing instrumentation and Prometheus metrics.
+
+Renderers fill a ``timings`` dict while rendering (stage durations,
+optional per-layer fetch/draw times, output size, peak RSS).
+InstrumentedRenderer wraps the server's renderer, collects these for every
+render and records them as histograms labelled by preset, theme, format
+and DPI. ``RenderMetrics.exposition()`` produces the Prometheus text format
+served on /metrics.
+
+Histograms are implemented here (cumulative buckets, _sum and _count)
+rather than pulling in a client library.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from render_history import RenderHistory, render_record
+from render_pool import RenderQueueFull
+from renderer_interface import RendererInterface
+
+# Render each layer separately to time per-layer fetch and draw (diagnostics only:
+# every vector layer is queried twice)
+RENDER_PROFILE_LAYERS = os.getenv('RENDER_PROFILE_LAYERS', '0') == '1'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(2 ** n for n in range(14, 34, 2))  # 16 KB .. 8 GB
+MEGABYTES_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+RENDER_LABELS = ('preset', 'theme', 'format', 'dpi')
+
+
+class Timer:
+    """Context manager adding its elapsed seconds to ``timings[key]``.
+
+    A None ``timings`` makes it a no-op, so render code can time stages
+    unconditionally.
+    """
+
+    def __init__(self, timings: Optional[dict], key: str):
+        self.timings = timings
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            self.timings[self.key] = self.timings.get(self.key, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (VmHWM) for this process, if supported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak RSS (VmHWM) of this process in MB since the last reset_peak_rss()."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Prometheus histogram with a fixed label set."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.label_names, key, (('le', _format_number(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return '\n'.join(lines)
+
+
+class Counter:
+    """Prometheus counter with a fixed label set."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}")
+        return '\n'.join(lines)
+
+
+class RenderMetrics:
+    """All renderer metrics."""
+
+    def __init__(self):
+        self.duration = Histogram('render_duration_seconds', 'Total render time',
+                                  RENDER_LABELS, SECONDS_BUCKETS)
+        self.stage = Histogram('render_stage_seconds',
+                               'Render time per stage (style_build, map_load, render, raster_io, encode, strips, '
+                               'masks, composite, hillshade)',
+                               RENDER_LABELS + ('stage',), SECONDS_BUCKETS)
+        self.layer = Histogram('render_layer_seconds',
+                               'Per-layer SQL/raster fetch and draw time (RENDER_PROFILE_LAYERS=1)',
+                               RENDER_LABELS + ('layer', 'phase'), SECONDS_BUCKETS)
+        self.output_bytes = Histogram('render_output_bytes', 'Size of the rendered file',
+                                      RENDER_LABELS, BYTES_BUCKETS)
+        self.peak_rss = Histogram('render_peak_rss_megabytes', 'Peak RSS of the rendering process during a render',
+                                  RENDER_LABELS, MEGABYTES_BUCKETS)
+        self.failures = Counter('render_failures_total', 'Failed renders', RENDER_LABELS)
+        self.rejected = Counter('render_rejected_total', 'Renders refused because every render worker was busy',
+                                RENDER_LABELS)
+
+    def record(self, labels: Tuple[str, ...], duration: float, timings: Dict):
+        """Record one finished render.
+
+        Args:
+            labels: Values for RENDER_LABELS
+            duration: Wall-clock render time in seconds
+            timings: Timings dict filled by the renderer
+        """
+        self.duration.observe(duration, *labels)
+        for stage in ('style_build', 'map_load', 'render', 'raster_io', 'encode', 'strips', 'fetch', 'masks',
+                      'composite', 'hillshade'):
+            if stage in timings:
+                self.stage.observe(timings[stage], *labels, stage)
+        for layer, phases in timings.get('layers', {}).items():
+            for phase, seconds in phases.items():
+                self.layer.observe(seconds, *labels, layer, phase)
+        if timings.get('output_bytes') is not None:
+            self.output_bytes.observe(timings['output_bytes'], *labels)
+        if timings.get('peak_rss_mb') is not None:
+            self.peak_rss.observe(timings['peak_rss_mb'], *labels)
+
+    def exposition(self) -> str:
+        """Prometheus text exposition format."""
+        metrics = (self.duration, self.stage, self.layer, self.output_bytes, self.peak_rss, self.failures,
+                   self.rejected)
+        return '\n'.join(m.exposition() for m in metrics) + '\n'
+
+
+def render_labels(args: tuple) -> Tuple[str, ...]:
+    """Metric label values from positional render arguments
+    (theme, bbox_3857, output_size, dpi, format, preset, ...)."""
+    theme, _, _, dpi = args[:4]
+    format_type = args[4] if len(args) > 4 else 'png'
+    preset = args[5] if len(args) > 5 else 'stockholm_core'
+    theme_name = theme.get('name', 'unknown') if isinstance(theme, dict) else 'unknown'
+    return (preset, theme_name, format_type, str(dpi))
+
+
+class InstrumentedRenderer(RendererInterface):
+    """Renderer wrapper that records timings of every render in RenderMetrics
+    (and successful renders in the render history, if given, except
+    composited previews).
+
+    Other attributes (e.g. RenderPool.stats()) are passed through to the
+    wrapped renderer.
+    """
+
+    def __init__(self, renderer: RendererInterface, metrics: RenderMetrics, history: RenderHistory = None):
+        self.renderer = renderer
+        self.metrics = metrics
+        self.history = history
+
+    def __getattr__(self, name):
+        return getattr(self.renderer, name)
+
+    def _instrumented(self, method, args: tuple, kwargs: dict):
+        labels = render_labels(args)
+        timings = {}
+        start = time.perf_counter()
+        try:
+            result = method(*args, timings=timings, **kwargs)
+        except RenderQueueFull:
+            # Never started (and jobs retry these), so not a failed render
+            self.metrics.rejected.inc(*labels)
+            raise
+        except Exception:
+            self.metrics.failures.inc(*labels)
+            raise
+        duration = time.perf_counter() - start
+        self.metrics.record(labels, duration, timings)
+        # Composited previews cost milliseconds from cached masks, whatever
+        # their size; they would skew the cost model fitted on the history
+        if self.history is not None and not kwargs.get('composite'):
+            self.history.record(render_record(args, duration, timings))
+        return result
+
+    def render(self, *args, **kwargs) -> bytes:
+        return self._instrumented(self.renderer.render, args, kwargs)
+
+    def render_to_file(self, path: str, *args, **kwargs) -> int:
+        return self._instrumented(lambda *a, **k: self.renderer.render_to_file(path, *a, **k), args, kwargs)
+
+    def render_batch_to_files(self, paths: list, variants: list, bbox_3857: tuple, output_size: tuple, dpi: int,
+                              format: str = 'png', preset: str = 'stockholm_core', *args, **kwargs) -> list:
+        # One observation labelled theme="batch"; batches are not recorded in
+        # the render history, their cost is not that of a single render
+        labels = (preset, 'batch', format, str(dpi))
+        timings = {}
+        start = time.perf_counter()
+        try:
+            result = self.renderer.render_batch_to_files(paths, variants, bbox_3857, output_size, dpi, format, preset,
+                                                         *args, timings=timings, **kwargs)
+        except RenderQueueFull:
+            self.metrics.rejected.inc(*labels)
+            raise
+        except Exception:
+            self.metrics.failures.inc(*labels)
+            raise
+        self.metrics.record(labels, time.perf_counter() - start, timings)
+        return result
@@ -0,0 +1,281 @@
+"""Supervised pool of renderer worker processes.
+
+Each worker is a separate process with its own MapnikRenderer, so
+concurrent /render requests run in parallel instead of contending inside
+one interpreter. Requests wait in a bounded queue for an idle worker;
+when the queue is full the pool rejects new work immediately. Workers are
+recycled after a number of renders or when their RSS passes a watermark,
+and replaced if they die (e.g. when hitting their memory ceiling).
+"""
+
+import atexit
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import threading
+import traceback
+
+from renderer_interface import RendererInterface
+
+# Number of renderer worker processes (0 = render in the server process)
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Requests allowed to wait for a worker before new ones are rejected
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', '8'))
+
+# Seconds a queued request waits for a worker
+RENDER_QUEUE_TIMEOUT = float(os.getenv('RENDER_QUEUE_TIMEOUT', '300'))
+
+# Recycle a worker after this many renders (0 = never)
+RENDER_WORKER_MAX_RENDERS = int(os.getenv('RENDER_WORKER_MAX_RENDERS', '100'))
+
+# Recycle a worker when its RSS exceeds this many MB after a render (0 = never)
+RENDER_WORKER_MAX_RSS_MB = int(os.getenv('RENDER_WORKER_MAX_RSS_MB', '2048'))
+
+# Hard address space ceiling per worker in MB (0 = unlimited)
+RENDER_WORKER_MEMORY_LIMIT_MB = int(os.getenv('RENDER_WORKER_MEMORY_LIMIT_MB', '0'))
+
+
+class RenderQueueFull(Exception):
+    """Raised when no worker is available and the wait queue is full."""
+
+
+class RenderWorkerError(Exception):
+    """Raised when a render fails inside a worker or the worker dies."""
+
+
+def _current_rss_mb() -> float:
+    """Resident set size of the current process in MB."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Fallback: peak RSS (kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """Worker process loop: receive render tasks, send back results.
+
+    Messages sent back are (kind, payload, extra) tuples: ('progress', stage,
+    fraction) while rendering, ('timings', timings dict, None) when the
+    caller asked for timings, then ('result', return value, rss_mb) or
+    ('error', message, rss_mb).
+    """
+    if memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    from mapnik_renderer import MapnikRenderer
+    renderer = MapnikRenderer()
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        method, args, kwargs, report_progress, report_timings = task
+        if report_progress:
+            kwargs['progress'] = lambda stage, fraction: conn.send(('progress', stage, fraction))
+        if report_timings:
+            kwargs['timings'] = {}
+        try:
+            result = getattr(renderer, method)(*args, **kwargs)
+            if report_timings:
+                conn.send(('timings', kwargs['timings'], None))
+            conn.send(('result', result, _current_rss_mb()))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(('error', f"{type(e).__name__}: {e}", _current_rss_mb()))
+
+
+class _Worker:
+    """Handle for one worker process."""
+
+    def __init__(self, ctx, memory_limit_mb: int):
+        self.conn, child_conn = ctx.Pipe()
+        # Not a daemon: workers start their own strip render pools
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=False)
+        self.process.start()
+        child_conn.close()
+        self.renders = 0
+        self.rss_mb = 0.0
+
+    def stop(self, timeout: float = 5.0):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+
+
+class RenderPool(RendererInterface):
+    """Renderer facade that dispatches renders to worker processes."""
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE,
+                 queue_timeout: float = RENDER_QUEUE_TIMEOUT, max_renders: int = RENDER_WORKER_MAX_RENDERS,
+                 max_rss_mb: int = RENDER_WORKER_MAX_RSS_MB, memory_limit_mb: int = RENDER_WORKER_MEMORY_LIMIT_MB):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_renders = max_renders
+        self.max_rss_mb = max_rss_mb
+        self.memory_limit_mb = memory_limit_mb
+
+        # spawn: forked children would share the server's file descriptors and threads
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._all = []
+        self._all_lock = threading.Lock()  # _all is changed from request handler threads
+        self.recycled = 0
+        self.crashed = 0
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx, self.memory_limit_mb)
+        with self._all_lock:
+            self._all.append(worker)
+        return worker
+
+    def _retire(self, worker: _Worker):
+        worker.stop()
+        with self._all_lock:
+            if worker in self._all:
+                self._all.remove(worker)
+
+    def _ensure_started(self):
+        # Workers are started lazily so that importing the server
+        # (which spawned children also do) does not start processes
+        with self._start_lock:
+            if not self._started:
+                for _ in range(self.workers):
+                    self._idle.put(self._spawn())
+                atexit.register(self.shutdown)
+                self._started = True
+
+    def _needs_recycle(self, worker: _Worker) -> bool:
+        if self.max_renders > 0 and worker.renders >= self.max_renders:
+            return True
+        if self.max_rss_mb > 0 and worker.rss_mb >= self.max_rss_mb:
+            return True
+        return False
+
+    def render(self, *args, **kwargs) -> bytes:
+        """Render in a worker process (same signature as MapnikRenderer.render).
+
+        Raises:
+            RenderQueueFull: All workers are busy and the wait queue is full
+            RenderWorkerError: The render failed or the worker died
+        """
+        return self._dispatch('render', args, kwargs)
+
+    def render_to_file(self, path: str, *args, **kwargs) -> int:
+        """Render into a file from a worker process, so the result never
+        passes through this process (see MapnikRenderer.render_to_file)."""
+        return self._dispatch('render_to_file', (path,) + args, kwargs)
+
+    def render_batch_to_files(self, paths: list, *args, **kwargs) -> list:
+        """Render a batch of variants in one worker process, so they share
+        fetched layer data (see MapnikRenderer.render_batch_to_files)."""
+        return self._dispatch('render_batch_to_files', (paths,) + args, kwargs)
+
+    def render_metatile(self, *args, **kwargs) -> list:
+        """Render and slice a block of map tiles in a worker process
+        (see MapnikRenderer.render_metatile)."""
+        return self._dispatch('render_metatile', args, kwargs)
+
+    def _dispatch(self, method: str, args: tuple, kwargs: dict):
+        # Callables cannot cross the process boundary; progress is relayed over the pipe,
+        # and timings filled in the worker are copied into the caller's dict
+        progress = kwargs.pop('progress', None)
+        timings = kwargs.pop('timings', None)
+        self._ensure_started()
+
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull(f"Render queue is full ({self.workers} workers, {self.queue_size} queued)")
+
+        try:
+            try:
+                worker = self._idle.get(timeout=self.queue_timeout)
+            except queue.Empty:
+                raise RenderQueueFull(f"No render worker became available within {self.queue_timeout:.0f}s")
+
+            try:
+                worker.conn.send((method, args, kwargs, progress is not None, timings is not None))
+                while True:
+                    status, payload, extra = worker.conn.recv()
+                    if status == 'progress':
+                        progress(payload, extra)
+                    elif status == 'timings':
+                        timings.update(payload)
+                    else:
+                        break
+            except (EOFError, OSError) as e:
+                # Worker died mid-render (crash or memory ceiling); replace it
+                self.crashed += 1
+                exitcode = worker.process.exitcode
+                self._retire(worker)
+                self._idle.put(self._spawn())
+                raise RenderWorkerError(f"Render worker exited unexpectedly (exit code {exitcode}): {e}")
+            except BaseException:
+                # Failed mid-exchange (e.g. unpicklable arguments or a raising
+                # progress callback): the pipe state is unknown, so replace the worker
+                self._retire(worker)
+                self._idle.put(self._spawn())
+                raise
+
+            worker.renders += 1
+            worker.rss_mb = extra
+            if self._needs_recycle(worker):
+                print(f"Recycling render worker pid={worker.process.pid} after {worker.renders} renders "
+                      f"(rss {worker.rss_mb:.0f} MB)", file=sys.stderr)
+                self.recycled += 1
+                self._retire(worker)
+                worker = self._spawn()
+            self._idle.put(worker)
+
+            if status == 'error':
+                raise RenderWorkerError(payload)
+            return payload
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Pool state for health reporting."""
+        return {
+            'workers': self.workers,
+            'idle': self._idle.qsize(),
+            'queue_size': self.queue_size,
+            'started': self._started,
+            'recycled': self.recycled,
+            'crashed': self.crashed
+        }
+
+    def shutdown(self):
+        """Stop all worker processes."""
+        with self._all_lock:
+            workers = list(self._all)
+        for worker in workers:
+            self._retire(worker)
+
+
+def create_renderer() -> RendererInterface:
+    """Create the renderer used by the server: a worker pool, or an
+    in-process MapnikRenderer when RENDER_WORKERS is 0."""
+    if RENDER_WORKERS > 0:
+        return RenderPool()
+
+    from mapnik_renderer import MapnikRenderer
+    return MapnikRenderer()
@@ -0,0 +1,89 @@
+"""Stream a render result to the client while it is still being written.
+
+The render runs in a background thread (usually waiting on a worker
+process) and writes into a file; the response body follows that file as
+it grows. Vector documents are sent while cairo is still finishing them
+instead of after a complete write and read-back.
+"""
+
+import threading
+from pathlib import Path
+from typing import Callable, Iterator
+
+# Poll interval while waiting for more output
+STREAM_POLL_SECONDS = 0.05
+
+
+class RenderStream:
+    """Background file render plus a generator over the growing file."""
+
+    def __init__(self, render_fn: Callable[[Callable[[str, float], None]], None], path: Path):
+        """
+        Args:
+            render_fn: Called with a progress callback; renders into `path`
+            path: File the render writes to
+        """
+        self.render_fn = render_fn
+        self.path = Path(path)
+        self.error = None
+        self._started = threading.Event()
+        self._done = threading.Event()
+        self._file = None
+
+    def _progress(self, stage: str, fraction: float):
+        self._started.set()
+
+    def _run(self):
+        try:
+            self.render_fn(self._progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def start(self):
+        """Start rendering and wait until a worker has picked the render up.
+
+        Raises:
+            Exception: Whatever the render raised if it failed before starting
+                (e.g. RenderQueueFull), so the caller can still send a
+                proper error response.
+        """
+        # Open the file before the render may rename it into the result cache
+        self.path.touch()
+        self._file = open(self.path, 'rb')
+
+        threading.Thread(target=self._run, name='render-stream', daemon=True).start()
+        while not self._started.wait(STREAM_POLL_SECONDS):
+            if self._done.is_set():
+                break
+
+        if self._done.is_set() and self.error is not None:
+            self._file.close()
+            raise self.error
+
+    def iter_chunks(self, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+        """Yield file content as it is written until the render is done.
+
+        Raises the render error if the render fails part way (the client
+        then sees an aborted transfer rather than a truncated file).
+        """
+        try:
+            while True:
+                chunk = self._file.read(chunk_size)
+                if chunk:
+                    yield chunk
+                    continue
+                if self._done.is_set():
+                    # Drain anything written between the last read and completion
+                    rest = self._file.read()
+                    if rest:
+                        yield rest
+                        continue
+                    break
+                self._done.wait(STREAM_POLL_SECONDS)
+
+            if self.error is not None:
+                raise self.error
+        finally:
+            self._file.close()
@@ -21,9 +21,28 @@ class RendererInterface(ABC):
         """
         pass
 
+    def render_to_file(self, path: str, *args, **kwargs) -> int:
+        """Render into a file (same arguments as render()).
 
+        Returns:
+            Number of bytes written
+        """
+        data = self.render(*args, **kwargs)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return len(data)
 
+    def render_batch_to_files(self, paths: list, variants: list, bbox_3857: tuple, output_size: tuple, dpi: int,
+                              format: str = 'png', preset: str = 'stockholm_core', coverage: dict = None,
+                              progress=None, timings: dict = None) -> list:
+        """Render theme/layer variants of one map into files, one path per variant.
 
+        Args:
+            variants: List of dicts with keys theme and layers
 
-
-
+        Returns:
+            Number of bytes written per variant
+        """
+        return [self.render_to_file(path, variant['theme'], bbox_3857, output_size, dpi, format, preset,
+                                    variant.get('layers'), coverage)
+                for path, variant in zip(paths, variants)]
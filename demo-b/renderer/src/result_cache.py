@@ -0,0 +1,85 @@
+"""Content-addressed cache of finished render results.
+
+Demo B output is byte-stable (see DETERMINISM.md), so a render is fully
+determined by its parameters, the theme content and the input data. The
+cache key hashes all of these; it doubles as the response ETag.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+from disk_cache import DiskCache
+from snapshots import snapshot_version
+
+# Cache location and size budget (0 disables the cache)
+RESULT_CACHE_DIR = Path(os.getenv('RESULT_CACHE_DIR', '/exports/cache'))
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '2048'))
+
+# Bump to invalidate every cached result after a data re-import into PostGIS
+RENDER_DATA_VERSION = os.getenv('RENDER_DATA_VERSION', '1')
+
+# Bump when renderer changes alter output bytes
+RENDERER_OUTPUT_VERSION = '9'
+
+DATA_DIR = Path(os.getenv('DATA_DIR', '/data'))
+
+
+def _file_version(path: Path):
+    """(mtime_ns, size) of a data file, or None if it does not exist."""
+    try:
+        st = path.stat()
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def data_versions(preset: str) -> Dict[str, Any]:
+    """Versions of the input data a render of this preset depends on."""
+    return {
+        'data_version': RENDER_DATA_VERSION,
+        'renderer': RENDERER_OUTPUT_VERSION,
+        'osm': _file_version(DATA_DIR / 'osm' / f"{preset}.osm.pbf"),
+        'hillshade': _file_version(DATA_DIR / 'terrain' / 'hillshade' / f"{preset}_hillshade.tif"),
+        # Hillshade computed from the DEM (hillshade.py)
+        'dem': (_file_version(DATA_DIR / 'dem' / f"{preset}_eudem.tif")
+                or _file_version(DATA_DIR / 'dem' / 'manual' / f"{preset}_eudem.tif")),
+        'snapshot': snapshot_version(preset)
+    }
+
+
+def render_cache_key(render_args: tuple, render_kwargs: Dict[str, Any]) -> str:
+    """Canonical hash of a render request.
+
+    Args:
+        render_args: Positional renderer.render() arguments
+            (theme, bbox_3857, output_size, dpi, format, preset, layers, coverage)
+        render_kwargs: Keyword renderer.render() arguments
+
+    Returns:
+        Hex digest (also used as ETag)
+    """
+    theme, bbox_3857, output_size, dpi, format_type, preset, layers, coverage = render_args
+    payload = {
+        # Theme dict content, not just its name, so edited theme files miss
+        'theme': theme,
+        'bbox_3857': list(bbox_3857),
+        'output_size': list(output_size),
+        'dpi': dpi,
+        'format': format_type,
+        'preset': preset,
+        'layers': layers,
+        'coverage': coverage,
+        # Strip rendering gives the same file, so 'tiled' does not count
+        'options': {k: v for k, v in render_kwargs.items() if k not in ('progress', 'tiled')},
+        'data': data_versions(preset)
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def create_result_cache() -> DiskCache:
+    """Result cache configured from the environment."""
+    return DiskCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,110 @@
+"""Scale bands and the PostGIS source of each vector layer per band.
+
+Layers read dedicated per-layer tables built by the importer
+(importers/osm-importer/render_tables.sql). Small-scale renders (large areas
+on few pixels) read simplified, merged and filtered versions of them instead
+(generalize.sql). The band follows from the output scale denominator;
+large-scale renders use the 'full' band.
+"""
+
+import os
+from typing import Optional, Tuple
+
+# Use generalized tables for small-scale renders (0 = always full detail)
+RENDER_SCALE_BANDS = os.getenv('RENDER_SCALE_BANDS', '1') == '1'
+
+# Standardized rendering pixel size in metres (OGC SLD / Mapnik: 0.28 mm)
+STANDARD_PIXEL_SIZE_M = 0.00028
+
+# (band, exclusive upper scale denominator); must match generalize.sql
+SCALE_BANDS = [
+    ('full', 100000),
+    ('mid', 400000),
+    ('low', None)
+]
+
+# Layers dropped entirely in a band (too small to see)
+OMITTED_LAYERS = {
+    'low': {'roads_minor'}
+}
+
+# Contour interval (m) drawn per band; must be one of the classes in the
+# contours table (2, 10, 50 - see importers/osm-importer/contours.sql)
+CONTOUR_INTERVALS = {
+    'full': 10,
+    'mid': 10,
+    'low': 50
+}
+
+# Contours at a multiple of this many intervals are drawn as major lines
+CONTOUR_MAJOR_EVERY = 5
+
+
+def scale_denominator(bbox_3857: Tuple[float, float, float, float], output_size: Tuple[int, int]) -> float:
+    """Scale denominator of a render, as Mapnik computes it.
+
+    Uses the larger of the x/y resolutions, since zoom_to_box grows the
+    bbox to the output aspect ratio.
+    """
+    min_x, min_y, max_x, max_y = bbox_3857
+    width, height = output_size
+    resolution = max((max_x - min_x) / width, (max_y - min_y) / height)
+    return resolution / STANDARD_PIXEL_SIZE_M
+
+
+def select_band(bbox_3857: Tuple[float, float, float, float], output_size: Tuple[int, int]) -> str:
+    """Scale band for a render ('full', 'mid' or 'low')."""
+    if not RENDER_SCALE_BANDS:
+        return 'full'
+    denominator = scale_denominator(bbox_3857, output_size)
+    for band, max_denominator in SCALE_BANDS:
+        if max_denominator is None or denominator < max_denominator:
+            return band
+    return 'full'
+
+
+def layer_table(layer: str, band: str = 'full') -> Optional[str]:
+    """Table a vector layer is read from in a band.
+
+    Args:
+        layer: 'water', 'parks', 'roads_minor', 'roads_major' or 'buildings'
+        band: Scale band from select_band()
+
+    Returns:
+        Table name, or None if the layer is not drawn in this band
+    """
+    if band == 'full':
+        return f"render_{layer}"
+    if layer in OMITTED_LAYERS.get(band, set()):
+        return None
+    return f"gen_{layer}_{band}"
+
+
+def layer_query(layer: str, band: str = 'full') -> Optional[str]:
+    """PostGIS table/subquery for a vector layer in a band.
+
+    Returns:
+        Subquery for the Mapnik ``table`` parameter, or None if the layer
+        is not drawn in this band (see layer_table())
+    """
+    table = layer_table(layer, band)
+    if table is None:
+        return None
+    return f"(SELECT way FROM {table}) AS {layer}"
+
+
+def contour_interval(band: str, theme: dict = None) -> int:
+    """Contour interval in metres for a band (theme ``contours.interval`` overrides)."""
+    override = (theme or {}).get('contours', {}).get('interval')
+    return int(override) if override else CONTOUR_INTERVALS.get(band, 10)
+
+
+def contours_query(preset: str, interval: int) -> str:
+    """Subquery for the contours of a preset at an interval.
+
+    Rows carry their interval class, so styles can draw coarser classes as
+    major lines. Served by one index on (preset, interval_m, way).
+    """
+    preset_literal = preset.replace("'", "''")
+    return (f"(SELECT way, interval_m FROM contours "
+            f"WHERE preset = '{preset_literal}' AND interval_m >= {int(interval)}) AS contours")
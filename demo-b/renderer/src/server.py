@@ -1,19 +1,69 @@
 """Renderer service server."""
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
 import io
-import json
 import os
+import re
 import sys
+import unicodedata
+import zipfile
 from pathlib import Path
-from mapnik_renderer import MapnikRenderer
-from theme_to_mapnik import load_theme
-from filename_builder import build_export_filename
+from urllib.parse import quote
+from render_pool import create_renderer, RenderPool, RenderQueueFull, RENDER_WORKER_MEMORY_LIMIT_MB
+from jobs import JobManager, JobQueueFull
+from result_cache import create_result_cache, render_cache_key
+from render_stream import RenderStream
+from config_registry import registry as config
+from filename_builder import build_export_filename, sanitize_filename
+from render_metrics import InstrumentedRenderer, RenderMetrics
+from render_history import create_render_history
+from cost_model import RenderCostModel
+from tiles import TILE_MAX_AGE, TileService, create_tile_cache, tile_bbox, valid_tile
+from datasources import contours_loaded, tile_preset
+from snapshots import RENDER_DATA_SOURCE, snapshot_manifest
 
 app = Flask(__name__)
-renderer = MapnikRenderer()
+metrics = RenderMetrics()
+history = create_render_history()
+cost_model = RenderCostModel(history)
+renderer = InstrumentedRenderer(create_renderer(), metrics, history)
+result_cache = create_result_cache()
+jobs = JobManager(renderer, result_cache=result_cache)
+tiles = TileService(renderer, create_tile_cache())
+
+# Send PDF/SVG bytes while the document is still being written (0 = send when complete)
+STREAM_VECTOR_RESPONSES = os.getenv('STREAM_VECTOR_RESPONSES', '1') == '1'
+
+# Longest side in pixels of render_mode=draft previews
+DRAFT_MAX_SIZE_PX = int(os.getenv('DRAFT_MAX_SIZE_PX', '1024'))
+
+# Composite render_mode=draft previews from cached per-layer masks unless
+# the request sets "composite": false
+DRAFT_COMPOSITE = os.getenv('DRAFT_COMPOSITE', '1') == '1'
+
+# Reject renders whose estimated peak memory exceeds this many MB
+# (0 = no limit; defaults to the render worker memory ceiling)
+RENDER_ADMISSION_MAX_RSS_MB = int(os.getenv('RENDER_ADMISSION_MAX_RSS_MB', str(RENDER_WORKER_MEMORY_LIMIT_MB)))
+
+# Refuse synchronous /render requests estimated to take longer than this
+# many seconds; they can still be queued as jobs (0 = no limit)
+RENDER_SYNC_MAX_SECONDS = float(os.getenv('RENDER_SYNC_MAX_SECONDS', '0'))
+
+# Maximum number of theme/layer variants in one /render/batch request
+BATCH_RENDER_MAX_VARIANTS = int(os.getenv('BATCH_RENDER_MAX_VARIANTS', '40'))
+
+# Keys a /render/batch variant may set; everything else is shared by the batch
+BATCH_VARIANT_KEYS = ('theme', 'layers', 'title', 'subtitle', 'attribution', 'preset_id')
+
+# Volume shared with the API; files on it are returned as a handle (path
+# relative to it) to requests with an X-Export-Handle header
+EXPORTS_DIR = Path(os.getenv('EXPORTS_DIR', '/exports'))
+
+MIMETYPES = {
+    'png': 'image/png',
+    'pdf': 'application/pdf',
+    'svg': 'image/svg+xml'
+}
 
-THEMES_DIR = Path('/app/themes') if Path('/app/themes').exists() else Path(__file__).parent.parent.parent.parent / 'themes'
-LIMITS_CONFIG = None
 
 def check_coverage(preset: str) -> dict:
     """Check which layers are available for a preset.
@@ -31,41 +81,34 @@ def check_coverage(preset: str) -> dict:
     hillshade_file = f"/data/terrain/hillshade/{preset}_hillshade.tif"
     coverage['hillshade'] = os.path.exists(hillshade_file)
 
-    # For contours, we assume they're in PostGIS
-    # If the table doesn't exist, the query will return empty (graceful)
-    # For now, we'll assume contours are available if hillshade exists
-    # (since they're generated together)
-    coverage['contours'] = coverage['hillshade']
+    # Contours come from the preset's snapshot when it has them, else from
+    # PostGIS if load_contours.sh was run for the preset
+    manifest = snapshot_manifest(preset) if RENDER_DATA_SOURCE != 'postgis' else None
+    coverage['contours'] = bool(manifest and manifest.get('contours')) or contours_loaded(preset)
 
     return coverage
 
 def load_preset_limits():
-    """Load preset limits configuration."""
-    global LIMITS_CONFIG
-    if LIMITS_CONFIG is not None:
-        return LIMITS_CONFIG
-
-    config_path = Path('/app/prep-config/preset_limits.json')
-    if not config_path.exists():
-        config_path = Path(__file__).parent.parent.parent.parent / 'prep-service' / 'config' / 'preset_limits.json'
-
-    if config_path.exists():
-        try:
-            with open(config_path) as f:
-                LIMITS_CONFIG = json.load(f)
-                print(f"Loaded preset limits from {config_path}", file=sys.stderr)
-        except Exception as e:
-            print(f"Warning: Failed to load preset limits: {e}", file=sys.stderr)
-            LIMITS_CONFIG = {}
-    else:
-        LIMITS_CONFIG = {}
-
-    return LIMITS_CONFIG
-
-def validate_render_request(preset: str, dpi: int, width_mm: float, height_mm: float) -> dict:
+    """Load preset limits configuration (reloaded when the file changes)."""
+    return config.preset_limits()
+
+def admission_error(estimate: dict) -> str:
+    """Reason to refuse a render with this estimated cost, or None to admit it."""
+    if not estimate or RENDER_ADMISSION_MAX_RSS_MB <= 0:
+        return None
+    peak_rss_mb = estimate.get('peak_rss_mb')
+    if peak_rss_mb is not None and peak_rss_mb > RENDER_ADMISSION_MAX_RSS_MB:
+        return (f"Estimated peak memory ({peak_rss_mb:.0f} MB) exceeds the render limit "
+                f"({RENDER_ADMISSION_MAX_RSS_MB} MB). Reduce DPI or format size.")
+    return None
+
+def validate_render_request(preset: str, dpi: int, width_mm: float, height_mm: float, estimate: dict = None) -> dict:
     """
     Validate render request against preset limits.
 
+    ``estimate`` (from the render cost model) replaces the static
+    estimated_render_time_seconds of preset_limits.json when given.
+
     Returns:
         dict with keys:
         - valid: bool
@@ -144,32 +187,23 @@ def validate_render_request(preset: str, dpi: int, width_mm: float, height_mm: f
         if detected_format in format_warnings:
             result['warnings'].append(f"Format {detected_format} may produce very large files for '{preset}'")
 
-    # Estimate render time
+    # Estimate render time: cost model fitted on past renders, else the static table
     est_times = preset_limits.get('warning_thresholds', {}).get('estimated_render_time_seconds', {})
-    if detected_format:
-        key = f"{detected_format}_{dpi}"
-        if key in est_times:
-            result['info']['estimated_render_time'] = est_times[key]
-            if est_times[key] > 300:
-                result['warnings'].append(f"Estimated render time: {est_times[key]}s (may take several minutes)")
+    estimated_time = None
+    if estimate and estimate.get('duration_s') is not None:
+        estimated_time = round(estimate['duration_s'])
+    elif detected_format:
+        estimated_time = est_times.get(f"{detected_format}_{dpi}")
+    if estimated_time is not None:
+        result['info']['estimated_render_time'] = estimated_time
+        if estimated_time > 300:
+            result['warnings'].append(f"Estimated render time: {estimated_time}s (may take several minutes)")
 
     return result
 
 def load_bbox_preset(preset_name: str) -> tuple:
     """Load bbox preset and convert to EPSG:3857."""
-    # Try to load from config file, fallback to hardcoded presets
-    config_path = Path('/app/prep-config/bbox_presets.json')
-    presets = {}
-
-    if config_path.exists():
-        try:
-            with open(config_path) as f:
-                config = json.load(f)
-                for preset in config.get('presets', []):
-                    bbox = preset['bbox_wgs84']
-                    presets[preset['name']] = tuple(bbox)
-        except Exception as e:
-            print(f"Warning: Failed to load presets from config: {e}", file=sys.stderr)
+    presets = config.bbox_presets()
 
     # Fallback to hardcoded presets if config not found or empty
     if not presets:
@@ -204,131 +238,573 @@ def wgs84_to_mercator(lon: float, lat: float) -> tuple:
     y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * earth_radius
     return (x, y)
 
+class RenderRequestError(Exception):
+    """Invalid render request; carries the JSON error body and HTTP status."""
+
+    def __init__(self, body: dict, status: int = 400):
+        super().__init__(body.get('error'))
+        self.body = body
+        self.status = status
+
+def draft_output_size(output_size: tuple, dpi: int) -> tuple:
+    """Scale a print output size down to a screen-sized draft.
+
+    Returns:
+        (output_size, dpi) with the longest side at most DRAFT_MAX_SIZE_PX
+    """
+    width_px, height_px = output_size
+    scale = min(1.0, DRAFT_MAX_SIZE_PX / max(width_px, height_px))
+    draft_size = (max(1, round(width_px * scale)), max(1, round(height_px * scale)))
+    return draft_size, max(1, round(dpi * scale))
+
+def prepare_render_request(data: dict) -> dict:
+    """Parse and validate a /render request body.
+
+    Returns:
+        dict with keys:
+        - args/kwargs: arguments for renderer.render()
+        - format: output format
+        - mimetype: response mimetype
+        - filename: standardized export filename
+        - cache_key: content hash of the request (result cache key and ETag)
+        - estimate: predicted cost from the render cost model (None for
+          drafts or without enough render history)
+
+    Raises:
+        RenderRequestError: if the request is invalid
+    """
+    if not data:
+        raise RenderRequestError({'error': 'No JSON data provided'})
+
+    # Parse parameters
+    preset = data.get('bbox_preset', 'stockholm_core')
+    custom_bbox = data.get('custom_bbox')  # [west, south, east, north] in WGS84
+    theme_name = data.get('theme', 'paper')
+    render_mode = data.get('render_mode', 'print')
+    dpi = int(data.get('dpi', 150))
+    width_mm = float(data.get('width_mm', 420))
+    height_mm = float(data.get('height_mm', 594))
+    format_type = data.get('format', 'png')
+    preset_id = data.get('preset_id')  # Optional export preset ID
+    tiled = data.get('tiled')  # Optional: force (true) or disable (false) strip rendering
+    composite = data.get('composite')  # Optional: composite PNGs from cached per-layer masks
+    palette = data.get('palette')  # Optional: 8-bit palette PNG (default: the theme's "palette")
+
+    # Composition elements
+    title = data.get('title', '')
+    subtitle = data.get('subtitle', '')
+    attribution = data.get('attribution', 'Map data: OpenStreetMap contributors')
+
+    # Drafts are screen-sized PNG previews of the same layout
+    draft = render_mode == 'draft'
+    if draft:
+        format_type = 'png'
+    if composite is None:
+        composite = draft and DRAFT_COMPOSITE
+
+    # Layer visibility (default: all layers visible)
+    layers = data.get('layers', {
+        'hillshade': True,
+        'water': True,
+        'parks': True,
+        'roads': True,
+        'buildings': True,
+        'contours': True
+    })
+
+    # Calculate output size in pixels (use round for correct dimensions)
+    width_px = round(width_mm * dpi / 25.4)
+    height_px = round(height_mm * dpi / 25.4)
+    output_size = (width_px, height_px)
+    if draft:
+        # Coarse output resolution also selects generalized tables and hillshade overviews
+        output_size, dpi = draft_output_size(output_size, dpi)
+
+    # Load theme (a copy; composition settings are added below)
+    theme = config.theme(theme_name)
+    if theme is None:
+        raise RenderRequestError({'error': f'Theme not found: {theme_name}'}, 500)
+    if palette is None:
+        palette = bool(theme.get('palette', False))
+
+    # Get bbox (custom or preset)
+    if custom_bbox:
+        # Convert custom bbox from WGS84 to EPSG:3857
+        west, south, east, north = custom_bbox
+        min_x, min_y = wgs84_to_mercator(west, south)
+        max_x, max_y = wgs84_to_mercator(east, north)
+        bbox_3857 = (min_x, min_y, max_x, max_y)
+        preset = 'custom'  # For coverage check fallback
+    else:
+        bbox_3857 = load_bbox_preset(preset)
+
+    # Check coverage (graceful handling when terrain missing)
+    coverage = check_coverage(preset)
+
+    # Drafts are cheap and always admitted
+    estimate = None if draft else cost_model.predict(bbox_3857, output_size, format_type, theme.get('name'))
+
+    # Validate render request against preset limits (skip for custom bbox and drafts)
+    if preset and not custom_bbox and not draft:
+        validation = validate_render_request(preset, dpi, width_mm, height_mm, estimate)
+        if not validation['valid']:
+            raise RenderRequestError({
+                'error': validation['error'],
+                'validation': validation
+            })
+
+        # Log warnings if any
+        if validation['warnings']:
+            for warning in validation['warnings']:
+                print(f"Warning: {warning}", file=sys.stderr)
+
+    # Admission control on the estimated cost (also for custom bboxes)
+    error = admission_error(estimate)
+    if error:
+        raise RenderRequestError({'error': error, 'estimate': estimate})
+
+    # Add composition elements to theme for renderer
+    theme['_composition'] = {
+        'title': title,
+        'subtitle': subtitle,
+        'attribution': attribution,
+        'render_mode': render_mode
+    }
+
+    # Determine mimetype
+    mimetype = MIMETYPES.get(format_type, 'application/octet-stream')
+
+    # Generate standardized filename
+    effective_bbox_preset = 'custom' if custom_bbox else preset
+    filename = build_export_filename(
+        bbox_preset=effective_bbox_preset,
+        dpi=dpi,
+        format_type=format_type,
+        preset_id=preset_id,
+        request_params={
+            'dpi': dpi,
+            'format': format_type,
+            'theme': theme_name,
+            'width_mm': width_mm,
+            'height_mm': height_mm,
+            'layers': layers
+        }
+    )
+
+    render_args = (theme, bbox_3857, output_size, dpi, format_type, preset, layers, coverage)
+    render_kwargs = {'tiled': tiled}
+    if composite:
+        render_kwargs['composite'] = True
+    if palette and format_type == 'png':
+        render_kwargs['palette'] = True
+
+    return {
+        'args': render_args,
+        'kwargs': render_kwargs,
+        'format': format_type,
+        'mimetype': mimetype,
+        'filename': filename,
+        'cache_key': render_cache_key(render_args, render_kwargs),
+        'estimate': estimate
+    }
+
+def send_export(path, mimetype: str, filename: str, etag: str = None) -> Response:
+    """Send a finished file (conditional and Range requests are supported).
+
+    Requests with an X-Export-Handle header get a handle instead if the
+    file is on the exports volume: JSON with its path relative to
+    EXPORTS_DIR, mimetype, filename and etag, marked by an X-Export-Handle
+    response header. The caller serves the file from its own mount.
+    """
+    if request.headers.get('X-Export-Handle'):
+        try:
+            relative = Path(path).resolve().relative_to(EXPORTS_DIR.resolve())
+        except ValueError:
+            relative = None
+        if relative is not None:
+            response = jsonify({'path': str(relative), 'mimetype': mimetype, 'filename': filename, 'etag': etag})
+            response.headers['X-Export-Handle'] = '1'
+            return response
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=filename,
+                     etag=etag if etag is not None else True)
+
+def set_attachment(response: Response, filename: str):
+    """Quoted Content-Disposition attachment header, as send_file(download_name=...) sets it."""
+    try:
+        filename.encode('ascii')
+        options = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    response.headers.set('Content-Disposition', 'attachment', **options)
+
+def result_location(render_request: dict) -> str:
+    """URL of a cached render result (see get_result)."""
+    return f"/results/{render_request['cache_key']}.{render_request['format']}?filename={quote(render_request['filename'])}"
+
+def stream_render_response(render_request: dict) -> Response:
+    """Render into a scratch file and stream it to the client as it is written.
+
+    The result is moved into the result cache once complete; the open
+    stream keeps reading the same file after the move.
+
+    Raises:
+        Exception: Render errors that occur before the render starts
+            (e.g. RenderQueueFull), so the usual error responses apply.
+    """
+    etag = render_request['cache_key']
+    ext = render_request['format']
+    scratch_path = result_cache.scratch_path(ext)
+    stored = {}
+
+    def run(progress):
+        renderer.render_to_file(str(scratch_path), *render_request['args'],
+                                progress=progress, **render_request['kwargs'])
+        stored['path'] = result_cache.put_file(etag, scratch_path, ext)
+
+    stream = RenderStream(run, scratch_path)
+    try:
+        stream.start()
+    except Exception:
+        scratch_path.unlink(missing_ok=True)
+        raise
+
+    response = Response(stream.iter_chunks(), mimetype=render_request['mimetype'], headers={
+        'ETag': f'"{etag}"',
+        'X-Cache': 'MISS'
+    })
+    set_attachment(response, render_request['filename'])
+    # Not cached (cache disabled, too large or failed render): remove after sending
+    response.call_on_close(lambda: stored.get('path') or scratch_path.unlink(missing_ok=True))
+    return response
+
+def submit_refine_job(data: dict) -> dict:
+    """Queue the full-resolution render of a draft request
+    (in ``refine_mode``, default 'print').
+
+    Returns:
+        Headers pointing at the cached result if there is one, else at the
+        job (the pending one if the same render is already queued), or
+        X-Refine-Error if it could not be queued (the draft is still served)
+    """
+    try:
+        refine_mode = data.get('refine_mode', 'print')
+        if refine_mode == 'draft':
+            refine_mode = 'print'
+        render_request = prepare_render_request(dict(data, render_mode=refine_mode, refine=False, composite=False))
+        if result_cache.get(render_request['cache_key'], render_request['format']) is not None:
+            return {'X-Refine-Location': result_location(render_request)}
+        job = jobs.submit(render_request)
+    except (RenderRequestError, JobQueueFull) as e:
+        print(f"Warning: Refine job not queued: {e}", file=sys.stderr)
+        return {'X-Refine-Error': str(e)}
+    return {'X-Refine-Job': job['id'], 'X-Refine-Location': f"/jobs/{job['id']}"}
+
+def prepare_batch_request(data: dict) -> dict:
+    """Parse and validate a /render/batch request body.
+
+    The body holds the /render parameters shared by all variants plus
+    ``variants`` (list of objects with BATCH_VARIANT_KEYS) or ``themes``
+    (list of theme names).
+
+    Returns:
+        dict with keys:
+        - variants: prepared request per variant (see prepare_render_request),
+          each with an added 'archive_name'
+        - args: shared renderer.render_batch_to_files() arguments after the
+          variants (bbox_3857, output_size, dpi, format, preset, coverage)
+
+    Raises:
+        RenderRequestError: if the request or any variant is invalid
+    """
+    if not data:
+        raise RenderRequestError({'error': 'No JSON data provided'})
+    variants = data.get('variants') or [{'theme': name} for name in data.get('themes', [])]
+    if not variants:
+        raise RenderRequestError({'error': 'Batch needs a non-empty variants or themes list'})
+    if len(variants) > BATCH_RENDER_MAX_VARIANTS:
+        raise RenderRequestError({'error': f'Batch has {len(variants)} variants (max {BATCH_RENDER_MAX_VARIANTS})'})
+
+    shared = {k: v for k, v in data.items() if k not in ('variants', 'themes', 'refine')}
+    prepared = []
+    for n, variant in enumerate(variants, 1):
+        unknown = sorted(set(variant) - set(BATCH_VARIANT_KEYS))
+        if unknown:
+            raise RenderRequestError({'error': f"Variant {n}: unsupported keys {', '.join(unknown)} "
+                                               f"(variants may set {', '.join(BATCH_VARIANT_KEYS)})"})
+        try:
+            render_request = prepare_render_request(dict(shared, **variant))
+        except RenderRequestError as e:
+            e.body['variant'] = n
+            raise
+        theme_name = variant.get('theme', shared.get('theme', 'paper'))
+        render_request['archive_name'] = f"{n:02d}_{sanitize_filename(theme_name)}__{render_request['filename']}"
+        prepared.append(render_request)
+
+    # Variants only differ in styling, so the rest of the render arguments is shared
+    theme, bbox_3857, output_size, dpi, format_type, preset, layers, coverage = prepared[0]['args']
+    return {
+        'variants': prepared,
+        'args': (bbox_3857, output_size, dpi, format_type, preset, coverage)
+    }
+
 @app.route('/render', methods=['POST'])
 def render():
     """Render map endpoint."""
     try:
-        data = request.json
-        if not data:
-            return jsonify({'error': 'No JSON data provided'}), 400
-
-        # Parse parameters
-        preset = data.get('bbox_preset', 'stockholm_core')
-        custom_bbox = data.get('custom_bbox')  # [west, south, east, north] in WGS84
-        theme_name = data.get('theme', 'paper')
-        render_mode = data.get('render_mode', 'print')
-        dpi = int(data.get('dpi', 150))
-        width_mm = float(data.get('width_mm', 420))
-        height_mm = float(data.get('height_mm', 594))
-        format_type = data.get('format', 'png')
-        preset_id = data.get('preset_id')  # Optional export preset ID
-
-        # Composition elements
-        title = data.get('title', '')
-        subtitle = data.get('subtitle', '')
-        attribution = data.get('attribution', 'Map data: OpenStreetMap contributors')
-
-        # Validate render request against preset limits (skip for custom bbox)
-        if preset and not custom_bbox:
-            validation = validate_render_request(preset, dpi, width_mm, height_mm)
-            if not validation['valid']:
-                return jsonify({
-                    'error': validation['error'],
-                    'validation': validation
-                }), 400
-
-            # Log warnings if any
-            if validation['warnings']:
-                for warning in validation['warnings']:
-                    print(f"Warning: {warning}", file=sys.stderr)
-
-        # Layer visibility (default: all layers visible)
-        layers = data.get('layers', {
-            'hillshade': True,
-            'water': True,
-            'parks': True,
-            'roads': True,
-            'buildings': True,
-            'contours': True
-        })
-
-        # Calculate output size in pixels (use round for correct dimensions)
-        width_px = round(width_mm * dpi / 25.4)
-        height_px = round(height_mm * dpi / 25.4)
-        output_size = (width_px, height_px)
-
-        # Load theme
-        theme_path = THEMES_DIR / f"{theme_name}.json"
-        if not theme_path.exists():
-            return jsonify({'error': f'Themes directory not found: {THEMES_DIR}'}), 500
-
-        theme = load_theme(str(theme_path))
-
-        # Get bbox (custom or preset)
-        if custom_bbox:
-            # Convert custom bbox from WGS84 to EPSG:3857
-            west, south, east, north = custom_bbox
-            min_x, min_y = wgs84_to_mercator(west, south)
-            max_x, max_y = wgs84_to_mercator(east, north)
-            bbox_3857 = (min_x, min_y, max_x, max_y)
-            preset = 'custom'  # For coverage check fallback
+        render_request = prepare_render_request(request.json)
+        etag = render_request['cache_key']
+        ext = render_request['format']
+
+        # Drafts can queue the full-resolution render as a job to follow up with
+        refine_headers = {}
+        if request.json.get('render_mode') == 'draft' and request.json.get('refine'):
+            refine_headers = submit_refine_job(request.json)
+
+        # Output is deterministic, so a matching ETag means the client copy is current
+        if etag in request.if_none_match:
+            return '', 304, dict(refine_headers, ETag=f'"{etag}"')
+
+        # Cache-Control: no-cache forces a fresh render (the result is still stored)
+        cached_path = None if request.cache_control.no_cache else result_cache.get(etag, ext)
+        if cached_path is not None:
+            response = send_export(cached_path, render_request['mimetype'], render_request['filename'], etag)
+            response.headers['X-Cache'] = 'HIT'
+            response.headers['X-Result-Location'] = result_location(render_request)
+            response.headers.update(refine_headers)
+            return response
+
+        # Long renders go through /jobs instead of holding the request open
+        estimate = render_request['estimate']
+        if RENDER_SYNC_MAX_SECONDS > 0 and estimate and (estimate.get('duration_s') or 0) > RENDER_SYNC_MAX_SECONDS:
+            return jsonify({
+                'error': f"Estimated render time ({estimate['duration_s']:.0f}s) exceeds {RENDER_SYNC_MAX_SECONDS:.0f}s "
+                         f"for synchronous renders. Submit it as a job (POST /jobs).",
+                'estimate': estimate
+            }), 400
+
+        if STREAM_VECTOR_RESPONSES and ext in ('pdf', 'svg'):
+            return stream_render_response(render_request)
+
+        # Render straight into a file so the result is never held in memory
+        scratch_path = result_cache.scratch_path(ext)
+        try:
+            renderer.render_to_file(str(scratch_path), *render_request['args'], **render_request['kwargs'])
+            cached_path = result_cache.put_file(etag, scratch_path, ext)
+        except Exception:
+            scratch_path.unlink(missing_ok=True)
+            raise
+
+        if cached_path is not None:
+            response = send_export(cached_path, render_request['mimetype'], render_request['filename'], etag)
+            response.headers['X-Result-Location'] = result_location(render_request)
         else:
-            bbox_3857 = load_bbox_preset(preset)
+            # Not cached (cache disabled or result too large): remove after sending
+            response = send_file(
+                scratch_path,
+                mimetype=render_request['mimetype'],
+                as_attachment=True,
+                download_name=render_request['filename'],
+                etag=etag
+            )
+            response.call_on_close(lambda: scratch_path.unlink(missing_ok=True))
+        response.headers['X-Cache'] = 'MISS'
+        response.headers.update(refine_headers)
+        return response
+    except RenderRequestError as e:
+        return jsonify(e.body), e.status
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
-        # Check coverage (graceful handling when terrain missing)
-        coverage = check_coverage(preset)
+@app.route('/render/batch', methods=['POST'])
+def render_batch():
+    """Render one map in several themes/layer sets and return them as a ZIP archive.
 
-        # Add composition elements to theme for renderer
-        theme['_composition'] = {
-            'title': title,
-            'subtitle': subtitle,
-            'attribution': attribution,
-            'render_mode': render_mode
-        }
+    Variants found in the result cache are reused; the others are rendered
+    together, fetching each layer's features once for all of them.
+    """
+    try:
+        batch = prepare_batch_request(request.json)
+        variants = batch['variants']
+
+        paths = {}
+        for n, variant in enumerate(variants):
+            cached_path = None if request.cache_control.no_cache else result_cache.get(variant['cache_key'], variant['format'])
+            if cached_path is not None:
+                paths[n] = cached_path
+        misses = [n for n in range(len(variants)) if n not in paths]
+
+        # Batch outputs are not stored in the result cache: their layer data is
+        # read once for the union of the variants' extents, so bytes may differ
+        # from the single render of the same request
+        scratch_paths = {n: result_cache.scratch_path(variants[n]['format']) for n in misses}
+        archive_path = result_cache.scratch_path('zip')
+        try:
+            if misses:
+                renderer.render_batch_to_files([str(scratch_paths[n]) for n in misses],
+                                               [{'theme': variants[n]['args'][0], 'layers': variants[n]['args'][6],
+                                                 'palette': variants[n]['kwargs'].get('palette', False)}
+                                                for n in misses],
+                                               *batch['args'])
+                paths.update(scratch_paths)
+            # Rendered images are already compressed
+            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED) as archive:
+                for n, variant in enumerate(variants):
+                    archive.write(paths[n], variant['archive_name'])
+        except Exception:
+            archive_path.unlink(missing_ok=True)
+            raise
+        finally:
+            for path in scratch_paths.values():
+                path.unlink(missing_ok=True)
+
+        base_name = variants[0]['filename'].rsplit('.', 1)[0]
+        response = send_file(archive_path, mimetype='application/zip', as_attachment=True,
+                             download_name=f"{base_name}__batch.zip")
+        response.call_on_close(lambda: archive_path.unlink(missing_ok=True))
+        response.headers['X-Cache-Hits'] = str(len(variants) - len(misses))
+        return response
+    except RenderRequestError as e:
+        return jsonify(e.body), e.status
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
-        # Render
-        result = renderer.render(theme, bbox_3857, output_size, dpi, format_type, preset, layers, coverage)
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue an asynchronous render job (same body as /render)."""
+    try:
+        render_request = prepare_render_request(request.json)
+        job = jobs.submit(render_request)
+        return jsonify(job), 202, {'Location': f"/jobs/{job['id']}"}
+    except RenderRequestError as e:
+        return jsonify(e.body), e.status
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
 
-        # Determine mimetype
-        mimetypes = {
-            'png': 'image/png',
-            'pdf': 'application/pdf',
-            'svg': 'image/svg+xml'
-        }
-        mimetype = mimetypes.get(format_type, 'application/octet-stream')
-
-        # Generate standardized filename
-        effective_bbox_preset = 'custom' if custom_bbox else preset
-        filename = build_export_filename(
-            bbox_preset=effective_bbox_preset,
-            dpi=dpi,
-            format_type=format_type,
-            preset_id=preset_id,
-            request_params={
-                'dpi': dpi,
-                'format': format_type,
-                'theme': theme_name,
-                'width_mm': width_mm,
-                'height_mm': height_mm,
-                'layers': layers
-            }
-        )
-
-        return send_file(
-            io.BytesIO(result),
-            mimetype=mimetype,
-            as_attachment=True,
-            download_name=filename
-        )
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report job state (queued/rendering/encoding/done/failed) and progress."""
+    job = jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Download the result of a finished job."""
+    job = jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    path = jobs.result_path(job_id)
+    if path is None and job['state'] == 'done':
+        return jsonify({'error': f"Result of job {job_id} was evicted from the result cache", 'job': job}), 404
+    if path is None:
+        return jsonify({'error': f"Job {job_id} is not finished (state: {job['state']})", 'job': job}), 409
+    return send_export(path, job['mimetype'], job['filename'])
+
+@app.route('/results/<key>.<ext>', methods=['GET'])
+def get_result(key, ext):
+    """Download a cached render result by its ETag (resumable with Range requests)."""
+    if ext not in MIMETYPES or not re.fullmatch(r'[0-9a-f]{64}', key):
+        return jsonify({'error': 'Invalid result name'}), 404
+    path = result_cache.get(key, ext)
+    if path is None:
+        return jsonify({'error': f'Unknown or evicted result: {key}.{ext}'}), 404
+    filename = request.args.get('filename', '')
+    if not re.fullmatch(r'[A-Za-z0-9_-][A-Za-z0-9._-]*', filename) or not filename.endswith(f'.{ext}'):
+        filename = f"{key}.{ext}"
+    return send_export(path, MIMETYPES[ext], filename, key)
+
+@app.route('/tiles/<theme_name>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_tile(theme_name, z, x, y):
+    """XYZ map tile (rendered as part of a cached metatile).
+
+    Query parameters:
+        preset: Bbox preset whose data and terrain to use (default: the
+            smallest preset containing the tile)
+        layers: Comma-separated visible layers (default: all)
+    """
+    if not valid_tile(z, x, y):
+        return jsonify({'error': f'Tile out of range: {z}/{x}/{y}'}), 404
+    theme = config.theme(theme_name)
+    if theme is None:
+        return jsonify({'error': f'Theme not found: {theme_name}'}), 404
+
+    preset = request.args.get('preset') or tile_preset(tile_bbox(z, x, y))
+    if preset != 'custom' and preset not in config.bbox_presets():
+        return jsonify({'error': f'Unknown preset: {preset}'}), 400
+    layers = None
+    if request.args.get('layers') is not None:
+        visible = set(filter(None, request.args['layers'].split(',')))
+        layers = {name: name in visible for name in ('hillshade', 'water', 'parks', 'roads', 'buildings', 'contours')}
+
+    try:
+        tile = tiles.tile(theme_name, theme, z, x, y, preset, layers, check_coverage(preset))
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+    source = tile.get('path') or io.BytesIO(tile['data'])
+    response = send_file(source, mimetype='image/png', etag=tile['etag'], max_age=TILE_MAX_AGE)
+    response.headers['X-Cache'] = 'HIT' if tile['hit'] else 'MISS'
+    return response
+
+@app.route('/tiles/<theme_name>', methods=['DELETE'])
+def purge_tiles(theme_name):
+    """Drop all cached tiles of a theme."""
+    if config.theme(theme_name) is None:
+        return jsonify({'error': f'Theme not found: {theme_name}'}), 404
+    return jsonify({'theme': theme_name, 'deleted': tiles.cache.purge_theme(theme_name)})
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
-    return jsonify({'status': 'ok'})
+    status = {'status': 'ok'}
+    if isinstance(renderer.renderer, RenderPool):
+        status['render_pool'] = renderer.stats()
+    if result_cache.enabled:
+        status['result_cache'] = result_cache.stats()
+    if history.enabled:
+        status['render_history'] = {'renders': history.count()}
+    if tiles.cache.enabled:
+        status['tile_cache'] = tiles.stats()
+    return jsonify(status)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Render timings in the Prometheus text format."""
+    return Response(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def estimate_request(theme_name: str, preset: str, custom_bbox, dpi: int, width_mm: float, height_mm: float,
+                     format_type: str) -> dict:
+    """Cost model estimate for /validate parameters (None if unknown)."""
+    if custom_bbox:
+        west, south, east, north = custom_bbox
+        bbox_3857 = wgs84_to_mercator(west, south) + wgs84_to_mercator(east, north)
+    else:
+        try:
+            bbox_3857 = load_bbox_preset(preset)
+        except ValueError:
+            return None
+    theme = config.theme(theme_name)
+    theme_label = theme.get('name') if theme else None
+    output_size = (round(width_mm * dpi / 25.4), round(height_mm * dpi / 25.4))
+    return cost_model.predict(bbox_3857, output_size, format_type, theme_label)
 
 @app.route('/validate', methods=['POST'])
 def validate():
@@ -339,11 +815,19 @@ def validate():
             return jsonify({'error': 'No JSON data provided'}), 400
 
         preset = data.get('bbox_preset', 'stockholm_core')
+        custom_bbox = data.get('custom_bbox')
         dpi = int(data.get('dpi', 150))
         width_mm = float(data.get('width_mm', 420))
         height_mm = float(data.get('height_mm', 594))
+        format_type = data.get('format', 'png')
 
-        validation = validate_render_request(preset, dpi, width_mm, height_mm)
+        estimate = estimate_request(data.get('theme', 'paper'), preset, custom_bbox, dpi, width_mm, height_mm, format_type)
+        validation = validate_render_request(preset, dpi, width_mm, height_mm, estimate)
+        validation['estimate'] = estimate
+        error = admission_error(estimate)
+        if validation['valid'] and error:
+            validation['valid'] = False
+            validation['error'] = error
         return jsonify(validation)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -355,5 +839,5 @@ def get_preset_limits():
     return jsonify(limits)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    app.run(host='0.0.0.0', port=5001, threaded=True)
 
@@ -0,0 +1,83 @@
+"""Local vector snapshots of bbox presets.
+
+importers/osm-importer/export_snapshots.sh exports the render tables of a
+preset from PostGIS into FlatGeobuf files (one per table, each with a
+packed R-tree) under SNAPSHOT_DIR/<preset>/, plus a manifest.json written
+last. Styles for a preset with a snapshot read its vector layers from
+those files through Mapnik's ogr plugin instead of PostGIS, so render
+workers need no database connection for it.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+from xml.sax.saxutils import escape
+
+from config_registry import ConfigFile
+
+# Directory holding one snapshot directory per preset
+SNAPSHOT_DIR = Path(os.getenv('SNAPSHOT_DIR', '/snapshots'))
+
+# Vector data source: 'auto' (snapshot when the preset has one, else PostGIS),
+# 'postgis' (never use snapshots) or 'snapshot' (require a snapshot; no PostGIS)
+RENDER_DATA_SOURCE = os.getenv('RENDER_DATA_SOURCE', 'auto')
+
+_manifests: Dict[str, ConfigFile] = {}
+_manifests_lock = threading.Lock()
+
+
+def snapshot_path(preset: str, table: str) -> Path:
+    """FlatGeobuf file of one render table in a preset's snapshot."""
+    return SNAPSHOT_DIR / preset / f"{table}.fgb"
+
+
+def snapshot_manifest(preset: str) -> Optional[Dict[str, Any]]:
+    """Manifest of a preset's snapshot (re-read when replaced), or None if there is none."""
+    with _manifests_lock:
+        manifest = _manifests.get(preset)
+        if manifest is None:
+            manifest = _manifests[preset] = ConfigFile([SNAPSHOT_DIR / preset / 'manifest.json'])
+    return manifest.get()
+
+
+def use_snapshot(preset: str) -> bool:
+    """Whether styles for a preset read its snapshot instead of PostGIS.
+
+    Raises:
+        ValueError: RENDER_DATA_SOURCE is 'snapshot' and the preset has none
+    """
+    if RENDER_DATA_SOURCE == 'postgis':
+        return False
+    manifest = snapshot_manifest(preset)
+    if manifest is None and RENDER_DATA_SOURCE == 'snapshot':
+        raise ValueError(f"No vector snapshot for preset '{preset}' in {SNAPSHOT_DIR} "
+                         f"(RENDER_DATA_SOURCE=snapshot); run export_snapshots.sh {preset}")
+    return manifest is not None
+
+
+def snapshot_version(preset: str) -> Optional[str]:
+    """Creation time of the snapshot renders of a preset read, or None if they read PostGIS."""
+    if RENDER_DATA_SOURCE == 'postgis':
+        return None
+    manifest = snapshot_manifest(preset)
+    return manifest.get('created_at') if manifest else None
+
+
+def snapshot_layer_datasource(table: str, preset: str, where: str = None) -> str:
+    """``<Datasource>`` element for a layer read from a preset snapshot.
+
+    Args:
+        table: Render table name (e.g. 'render_water', 'contours')
+        preset: Bbox preset name
+        where: Optional OGR SQL filter on the table's attributes
+    """
+    params = [('type', 'ogr'), ('file', snapshot_path(preset, table))]
+    if where:
+        params.append(('layer_by_sql', f"SELECT * FROM {table} WHERE {where}"))
+    else:
+        params.append(('layer', table))
+    lines = '\n'.join(f'        <Parameter name="{name}">{escape(str(value))}</Parameter>' for name, value in params)
+    return f"""      <Datasource>
+{lines}
+      </Datasource>"""
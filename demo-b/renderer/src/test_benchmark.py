@@ -0,0 +1,24 @@
+"""Tests for the renderer benchmark harness (matrix and baseline comparison)."""
+from benchmark import build_matrix, compare
+
+
+def test_matrix_skips_combinations_beyond_preset_limits():
+    cases = build_matrix(['stockholm_wide'], ['A4', 'A1'], [150, 300], ['png'])
+    ids = [case['id'] for case in cases]
+    assert 'stockholm_wide/A1/300/png' in ids
+    assert build_matrix(['svealand'], ['A1'], [300], ['png']) == []
+    assert len(build_matrix(['svealand'], ['A1'], [300], ['png'], respect_limits=False)) == 1
+    assert cases[0]['output_size'] == (1240, 1754)
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = {
+        'thresholds': {'wall_s': {'relative': 0.2, 'absolute': 0.05}},
+        'results': {'a': {'wall_s': 1.0}, 'b': {'wall_s': 0.01}}
+    }
+    results = {'a': {'wall_s': 1.3}, 'b': {'wall_s': 0.03}, 'c': {'wall_s': 1.0}}
+    status = {(e['case'], e['metric']): e['status'] for e in compare(results, baseline)}
+    assert status[('a', 'wall_s')] == 'regression'
+    # Relative change is large but below the absolute noise floor
+    assert status[('b', 'wall_s')] == 'ok'
+    assert status[('c', 'wall_s')] == 'new'
@@ -0,0 +1,43 @@
+"""Tests for the hot-reloading configuration registry."""
+import json
+import os
+
+from config_registry import ConfigDirectory, ConfigFile, registry
+
+
+def _write(path, data, mtime):
+    path.write_text(json.dumps(data))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_file_reloads_when_changed(tmp_path):
+    path = tmp_path / 'limits.json'
+    config = ConfigFile([tmp_path / 'missing.json', path], default={}, check_seconds=0)
+    assert config.get() == {}
+
+    _write(path, {'max_dpi': 300}, 1_000_000_000)
+    assert config.get() == {'max_dpi': 300}
+
+    _write(path, {'max_dpi': 600}, 2_000_000_000)
+    assert config.get() == {'max_dpi': 600}
+
+    # Keep the last good version while a file is invalid
+    path.write_text('{')
+    assert config.get() == {'max_dpi': 600}
+
+
+def test_directory_indexes_new_files(tmp_path):
+    themes = ConfigDirectory([tmp_path], check_seconds=0)
+    assert themes.get('paper') is None
+
+    _write(tmp_path / 'paper.json', {'name': 'Paper'}, 1_000_000_000)
+    os.utime(tmp_path, ns=(1_000_000_000, 1_000_000_000))
+    assert themes.get('paper') == {'name': 'Paper'}
+    assert themes.names() == ['paper']
+
+
+def test_registry_returns_copies():
+    theme = registry.theme('paper')
+    theme['_composition'] = {}
+    assert '_composition' not in registry.theme('paper')
+    assert 'stockholm_core' in registry.bbox_presets()
@@ -0,0 +1,32 @@
+"""Tests for the render history and cost model."""
+from cost_model import COST_MODEL_MIN_SAMPLES, RenderCostModel
+from render_history import RenderHistory
+
+BBOX = (1992649.0, 8250000.0, 2012687.0, 8256000.0)
+
+
+def _record(history, theme, size, duration):
+    history.record({
+        'created_at': 0, 'preset': 'stockholm_core', 'theme': theme, 'format': 'png', 'dpi': 150,
+        'width_px': size[0], 'height_px': size[1], 'area_km2': 30.0,
+        'duration_s': duration, 'peak_rss_mb': 100 + size[0] * size[1] / 1e5, 'output_bytes': size[0] * size[1]
+    })
+
+
+def test_predicts_from_history_per_theme(tmp_path):
+    history = RenderHistory(str(tmp_path / 'history.sqlite'))
+    model = RenderCostModel(history, refit_every=1)
+    assert model.predict(BBOX, (1000, 1000)) is None
+
+    for i in range(COST_MODEL_MIN_SAMPLES):
+        side = 1000 + 500 * i
+        # Paper: 1 s + 2 s per megapixel; Dark renders twice as slow
+        _record(history, 'Paper', (side, side), 1 + 2 * side * side / 1e6)
+        _record(history, 'Dark', (side, side), 2 + 4 * side * side / 1e6)
+
+    paper = model.predict(BBOX, (3000, 3000), 'png', 'Paper')
+    assert paper['basis'] == 'theme'
+    assert abs(paper['duration_s'] - 19) < 0.1
+    assert abs(model.predict(BBOX, (3000, 3000), 'png', 'Dark')['duration_s'] - 38) < 0.1
+    assert model.predict(BBOX, (3000, 3000), 'png', 'Other')['basis'] == 'format'
+    assert model.predict(BBOX, (3000, 3000), 'pdf') is None
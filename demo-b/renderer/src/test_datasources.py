@@ -0,0 +1,83 @@
+"""Tests for the shared PostGIS datasource configuration in generated styles."""
+import xml.etree.ElementTree as ET
+
+import datasources
+from datasources import (WEB_MERCATOR_EXTENT, POSTGIS_DATASOURCE, contours_loaded, layer_share_keys, preset_bbox,
+                         preset_extent)
+from theme_to_mapnik import theme_to_mapnik_xml
+
+
+def _style(preset):
+    xml = theme_to_mapnik_xml({}, (0, 0, 1, 1), (10, 10), 72, preset, coverage={'hillshade': False, 'contours': True})
+    return ET.fromstring(xml.encode('utf-8'))
+
+
+def test_layers_inherit_shared_pooled_datasource():
+    root = _style('stockholm_core')
+    templates = root.findall('Datasource')
+    assert [t.get('name') for t in templates] == [POSTGIS_DATASOURCE]
+    params = {p.get('name'): p.text for p in templates[0]}
+    assert params['persist_connection'] == 'true'
+    assert params['estimate_extent'] == 'false'
+
+    for layer in root.findall('Layer'):
+        datasource = layer.find('Datasource')
+        assert datasource.get('base') == POSTGIS_DATASOURCE
+        assert {p.get('name') for p in datasource} == {'table', 'extent'}
+
+
+def test_layer_extent_follows_preset():
+    def extent(preset):
+        layer = _style(preset).find('Layer')
+        return tuple(float(v) for v in layer.find("Datasource/Parameter[@name='extent']").text.split(','))
+
+    min_x, min_y, max_x, max_y = extent('stockholm_core')
+    assert min_x < 17.90 * 111319.49 < max_x
+    assert extent('stockholm_core') == preset_extent('stockholm_core')
+    assert extent('custom') == WEB_MERCATOR_EXTENT
+
+
+def test_layer_extent_covers_envelope_wider_than_preset():
+    # A portrait A2 render of the (landscape) preset: zoom_to_box grows the
+    # envelope vertically to the output aspect, far past the preset bbox
+    output_size = (2480, 3508)
+    min_x, min_y, max_x, max_y = preset_bbox('stockholm_core')
+    height = (max_x - min_x) * output_size[1] / output_size[0]
+    center_y = (min_y + max_y) / 2
+    envelope = (min_x, center_y - height / 2, max_x, center_y + height / 2)
+    assert envelope[1] < min_y - 5000 and envelope[3] > max_y + 5000
+
+    layer = ET.fromstring(theme_to_mapnik_xml({}, envelope, output_size, 72, 'stockholm_core',
+                                              coverage={'hillshade': False, 'contours': True})).find('Layer')
+    ext_min_x, ext_min_y, ext_max_x, ext_max_y = (
+        float(v) for v in layer.find("Datasource/Parameter[@name='extent']").text.split(','))
+    assert ext_min_x <= envelope[0] and ext_min_y <= envelope[1]
+    assert ext_max_x >= envelope[2] and ext_max_y >= envelope[3]
+
+
+def test_layer_share_keys_ignore_styling():
+    coverage = {'hillshade': True, 'contours': True}
+    light = theme_to_mapnik_xml({'background': '#ffffff'}, (0, 0, 1, 1), (10, 10), 72, 'stockholm_core', coverage=coverage)
+    dark = theme_to_mapnik_xml({'background': '#000000'}, (0, 0, 1, 1), (10, 10), 72, 'stockholm_core', coverage=coverage)
+    keys = layer_share_keys(light)
+    assert keys == layer_share_keys(dark)
+    # Raster layers are not shared; vector layers each read their own data
+    assert keys[0] is None
+    vector_keys = [k for k in keys if k is not None]
+    assert vector_keys and len(set(vector_keys)) == len(vector_keys)
+
+
+def test_no_contours_loaded(monkeypatch):
+    def no_table(preset):
+        raise RuntimeError('relation "contours" does not exist')
+
+    monkeypatch.setattr(datasources, '_contours_checked', {})
+    monkeypatch.setattr(datasources, '_query_contours_loaded', no_table)
+    assert not contours_loaded('stockholm_core')
+
+    # Styles for a preset without contours have no layer querying them
+    xml = theme_to_mapnik_xml({}, (0, 0, 1, 1), (10, 10), 72, 'stockholm_core',
+                              coverage={'hillshade': True, 'contours': contours_loaded('stockholm_core')})
+    root = ET.fromstring(xml.encode('utf-8'))
+    assert 'contours' not in [layer.get('name') for layer in root.findall('Layer')]
+    assert 'FROM contours' not in xml
@@ -0,0 +1,60 @@
+"""Tests for the on-disk LRU cache and render result keys."""
+import os
+
+from disk_cache import DiskCache
+from result_cache import render_cache_key
+
+
+def test_get_after_put(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1024)
+    assert cache.get('abcd', 'png') is None
+    path = cache.put_bytes('abcd', b'data', 'png')
+    assert cache.get('abcd', 'png') == path
+    assert path.read_bytes() == b'data'
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=250)
+    cache.put_bytes('aa01', b'x' * 100, 'png')
+    cache.put_bytes('bb02', b'x' * 100, 'png')
+    # Make 'aa01' the most recently used entry
+    os.utime(cache.path_for('bb02', 'png'), (1, 1))
+    cache.get('aa01', 'png')
+
+    cache.put_bytes('cc03', b'x' * 100, 'png')
+    assert cache.get('bb02', 'png') is None
+    assert cache.get('aa01', 'png') is not None
+    assert cache.get('cc03', 'png') is not None
+
+
+def test_disabled_cache(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=0)
+    assert cache.put_bytes('aa01', b'x', 'png') is None
+    assert cache.get('aa01', 'png') is None
+
+
+def test_render_cache_key_covers_theme_content():
+    args = ({'background': '#fff'}, (0, 0, 1, 1), (100, 100), 150, 'png', 'stockholm_core', None, None)
+    changed = ({'background': '#000'},) + args[1:]
+    assert render_cache_key(args, {}) == render_cache_key(args, {})
+    assert render_cache_key(args, {}) != render_cache_key(changed, {})
+    assert render_cache_key(args, {}) != render_cache_key(args, {'palette': True})
+    # Strip rendering produces the same file
+    assert render_cache_key(args, {}) == render_cache_key(args, {'tiled': True})
+
+
+def test_stale_scratch_files_are_swept(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=1024)
+    stale = cache.scratch_path('png')
+    stale.write_bytes(b'x')
+    os.utime(stale, (1, 1))
+    fresh = cache.scratch_path('png')
+    fresh.write_bytes(b'x')
+    orphan = tmp_path / 'ab' / 'tmpx1y2.part'
+    orphan.parent.mkdir()
+    orphan.write_bytes(b'x')
+    os.utime(orphan, (1, 1))
+
+    DiskCache(tmp_path, max_bytes=1024)
+    assert not stale.exists() and not orphan.exists()
+    assert fresh.exists()
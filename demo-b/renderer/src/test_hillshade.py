@@ -0,0 +1,53 @@
+"""Tests for DEM hillshading and the choice between computed and prepared hillshade."""
+import numpy as np
+
+import hillshade
+from hillshade import DEFAULT_LIGHTING, pixel_grid, shade, theme_lighting, use_dem_hillshade
+
+
+def test_shade_lighting():
+    flat = np.zeros((5, 6), dtype=np.float32)
+    out = shade(flat, 10.0, 10.0)
+    assert out.shape == (3, 4)
+    # Flat ground is lit at sin(altitude), scaled like gdaldem (1..255)
+    assert (out == 181).all()
+
+    # Ground rising towards the south-east faces the default north-west light
+    y, x = np.mgrid[0:5, 0:6].astype(np.float32)
+    facing = shade((x + y) * 5.0, 10.0, 10.0)
+    away = shade(-(x + y) * 5.0, 10.0, 10.0)
+    assert (facing > 181).all() and (away < 181).all()
+    assert (shade((x + y) * 5.0, 10.0, 10.0, azimuth=135.0) == away).all()
+
+    # Exaggeration darkens slopes facing away further
+    assert (shade(-(x + y) * 5.0, 10.0, 10.0, z_factor=3.0) < away).all()
+
+
+def test_shade_nodata():
+    elevation = np.zeros((4, 4), dtype=np.float32)
+    elevation[0, 0] = np.nan
+    out = shade(elevation, 1.0, 1.0)
+    assert out[0, 0] == 0 and out[1, 1] == 181
+
+
+def test_use_dem_hillshade(monkeypatch):
+    paper = {'hillshade': {'opacity': 0.2}}
+    lit = {'hillshade': {'opacity': 0.2, 'azimuth': 270, 'zFactor': 2}}
+    assert theme_lighting(paper) == DEFAULT_LIGHTING
+    assert theme_lighting(lit) == {'azimuth': 270.0, 'altitude': 45.0, 'z_factor': 2.0}
+
+    # Prepared hillshade for default lighting, DEM for theme lighting or without one
+    assert not use_dem_hillshade(paper, 'stockholm_core', {'hillshade': True})
+    assert use_dem_hillshade(lit, 'stockholm_core', {'hillshade': True})
+    assert use_dem_hillshade(paper, 'custom', {'hillshade': False})
+
+    monkeypatch.setattr(hillshade, 'HILLSHADE_SOURCE', 'baked')
+    assert not use_dem_hillshade(lit, 'stockholm_core', {'hillshade': True})
+
+
+def test_pixel_grid_is_square_and_centred():
+    # Matching aspect: the envelope itself
+    assert pixel_grid((0, 0, 200, 100), (20, 10)) == (0, 100, 10)
+    # Too tall for the output: grown horizontally around the centre like mapnik
+    min_x, max_y, res = pixel_grid((0, 0, 100, 100), (20, 10))
+    assert (min_x, max_y, res) == (-50, 100, 10)
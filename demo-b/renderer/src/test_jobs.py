@@ -0,0 +1,69 @@
+"""Tests for asynchronous render jobs."""
+import threading
+import time
+from pathlib import Path
+
+from disk_cache import DiskCache
+from jobs import JobManager
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def render_to_file(self, path, *args, progress=None, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        Path(path).write_bytes(b'data')
+        return 4
+
+
+def _request(key='ab' * 32):
+    return {'args': (), 'kwargs': {}, 'format': 'png', 'filename': 'map.png', 'mimetype': 'image/png',
+            'cache_key': key}
+
+
+def _wait_done(manager, job_id):
+    for _ in range(100):
+        if manager.status(job_id)['state'] in ('done', 'failed'):
+            return manager.status(job_id)
+        time.sleep(0.02)
+    raise AssertionError('job did not finish')
+
+
+def test_pending_render_is_not_queued_twice(tmp_path):
+    renderer = FakeRenderer()
+    manager = JobManager(renderer, jobs_dir=tmp_path / 'jobs', result_cache=DiskCache(tmp_path / 'cache', 1 << 20))
+    first = manager.submit(_request())
+    assert manager.submit(_request())['id'] == first['id']
+    assert manager.submit(_request('cd' * 32))['id'] != first['id']
+
+    renderer.release.set()
+    assert _wait_done(manager, first['id'])['cached']
+    assert renderer.calls == 2
+
+
+def test_cached_result_finishes_job_without_render(tmp_path):
+    renderer = FakeRenderer()
+    renderer.release.set()
+    manager = JobManager(renderer, jobs_dir=tmp_path / 'jobs', result_cache=DiskCache(tmp_path / 'cache', 1 << 20))
+    _wait_done(manager, manager.submit(_request())['id'])
+
+    job = _wait_done(manager, manager.submit(_request())['id'])
+    assert job['cached'] and job['size_bytes'] == 4
+    assert Path(manager.result_path(job['id'])).read_bytes() == b'data'
+    assert renderer.calls == 1
+
+
+def test_failed_job_leaves_no_partial_file(tmp_path):
+    class FailingRenderer:
+        def render_to_file(self, path, *args, progress=None, **kwargs):
+            progress('rendering', 0.0)
+            Path(path).write_bytes(b'partial')
+            raise RuntimeError('render failed')
+
+    manager = JobManager(FailingRenderer(), jobs_dir=tmp_path / 'jobs')
+    job = _wait_done(manager, manager.submit(_request())['id'])
+    assert job['state'] == 'failed' and job['started_at'] is not None
+    assert list((tmp_path / 'jobs').iterdir()) == []
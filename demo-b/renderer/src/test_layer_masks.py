@@ -0,0 +1,95 @@
+"""Tests for splitting styles into per-layer masks and compositing them."""
+import json
+from pathlib import Path
+
+import numpy as np
+
+from layer_masks import MaskCache, composite, mask_plan
+from theme_to_mapnik import hillshade_stops, theme_to_mapnik_xml
+
+THEMES_DIR = Path(__file__).resolve().parents[3] / 'themes'
+BBOX = (2000000.0, 8200000.0, 2010000.0, 8210000.0)
+COVERAGE = {'osm': True, 'contours': True, 'hillshade': True}
+
+
+def style_xml(theme):
+    return theme_to_mapnik_xml(theme, BBOX, (800, 800), 72, 'stockholm_core', None, COVERAGE)
+
+
+def load_theme(name):
+    return json.loads((THEMES_DIR / f"{name}.json").read_text())
+
+
+def test_mask_plan_splits_symbolizers():
+    plan = mask_plan(style_xml(load_theme('paper')))
+    assert plan['background'] == (0xfa, 0xf8, 0xf5)
+    specs = plan['specs']
+    assert specs[0]['layer'] == 'hillshade' and specs[0]['kind'] == 'raster'
+    assert [s['layer'] for s in specs[1:3]] == ['water', 'water']
+    assert specs[1]['color'] == (0xcc, 0xe0, 0xed)
+    assert {s['toggle'] for s in specs if s['layer'].startswith('roads')} == {'roads'}
+    contours = [s for s in specs if s['layer'] == 'contours']
+    assert [s['opacity'] for s in contours] == [0.8, 0.5]
+
+    # Mask styles are black and opaque, and keep every rule's filter
+    assert 'stroke-opacity' not in plan['xml'] and '#cce0ed' not in plan['xml']
+    assert plan['xml'].count('<ElseFilter') == len(contours)
+
+
+def test_signature_ignores_colours():
+    paper = load_theme('paper')
+    recoloured = json.loads(json.dumps(paper))
+    recoloured['background'] = '#000000'
+    recoloured['water']['fill'] = '#123456'
+    a, b = mask_plan(style_xml(paper)), mask_plan(style_xml(recoloured))
+    assert a['signature'] == b['signature']
+    assert a['specs'] != b['specs']
+
+
+def test_composite_blends_in_order_and_toggles():
+    specs = [
+        {'layer': 'water', 'toggle': 'water', 'kind': 'vector', 'color': (0, 0, 255), 'opacity': 1.0},
+        {'layer': 'roads-major', 'toggle': 'roads', 'kind': 'vector', 'color': (255, 0, 0), 'opacity': 0.5}
+    ]
+    stack = np.zeros((2, 1, 3), dtype=np.uint8)
+    stack[0, 0, :2] = 255
+    stack[1, 0, 1:] = 255
+
+    rgba = composite(stack, specs, (255, 255, 255))
+    assert rgba[0].tolist() == [[0, 0, 255, 255], [128, 0, 128, 255], [255, 128, 128, 255]]
+
+    rgba = composite(stack, specs, (255, 255, 255), {'roads': False})
+    assert rgba[0].tolist() == [[0, 0, 255, 255], [0, 0, 255, 255], [255, 255, 255, 255]]
+
+
+def test_mask_cache_round_trip(tmp_path):
+    cache = MaskCache(tmp_path, max_bytes=1 << 20)
+    stack = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+    assert cache.load('ab' * 32) is None
+    cache.store('ab' * 32, stack)
+    assert np.array_equal(cache.load('ab' * 32), stack)
+
+
+def test_hillshade_effects():
+    plan = mask_plan(style_xml(load_theme('paper')))
+    hillshade = plan['specs'][0]
+    assert hillshade['comp_op'] == 'multiply'
+    values, levels = hillshade['levels']
+    assert [(v, l) for v, l in zip(values, levels)] == hillshade_stops(0.95, 1.08)
+    # Masks read the plain greyscale raster; levels and blend are applied when compositing
+    assert 'RasterColorizer' not in plan['xml'] and 'comp-op' not in plan['xml']
+    assert '<Parameter name="band">' not in plan['xml']
+
+    # Gamma and contrast alone do not change the masks
+    flat = load_theme('paper')
+    flat['hillshade'].update(gamma=1.0, contrast=1.0)
+    assert mask_plan(style_xml(flat))['signature'] == plan['signature']
+
+    stack = np.array([[[128, 255]], [[255, 255]]], dtype=np.uint8)
+    spec = {'layer': 'hillshade', 'toggle': 'hillshade', 'kind': 'raster', 'opacity': 0.5,
+            'comp_op': 'multiply', 'levels': None}
+    rgba = composite(stack, [spec], (200, 100, 0))
+    # Multiply at half opacity: out * (1 - 0.5 + 0.5 * shade)
+    assert rgba[0, :, :3].tolist() == [[150, 75, 0], [200, 100, 0]]
+    rgba = composite(stack, [dict(spec, comp_op='screen')], (200, 100, 0))
+    assert rgba[0, :, :3].tolist() == [[214, 139, 64], [228, 178, 128]]
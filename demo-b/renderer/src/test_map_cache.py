@@ -0,0 +1,51 @@
+"""Tests for the Mapnik map template cache (no Mapnik required)."""
+from map_cache import MapTemplateCache, style_cache_key
+
+
+class FakeMap:
+    def __init__(self, xml, width, height):
+        self.xml = xml
+        self.size = (width, height)
+
+    def resize(self, width, height):
+        self.size = (width, height)
+
+
+def test_style_key_ignores_composition():
+    theme = {'background': '#fff', 'water': {'fill': '#00f'}}
+    annotated = dict(theme, _composition={'title': 'Stockholm'})
+    assert style_cache_key(theme, 'stockholm_core', None, None) == style_cache_key(annotated, 'stockholm_core', None, None)
+    assert style_cache_key(theme, 'stockholm_core', None, None) != style_cache_key(theme, 'svealand', None, None)
+
+
+def test_checkout_reuses_and_resizes_loaded_map():
+    builds = []
+    cache = MapTemplateCache(FakeMap, max_entries=2)
+
+    def build():
+        builds.append(1)
+        return '<Map/>'
+
+    with cache.checkout('a', build, 100, 200) as first:
+        pass
+    with cache.checkout('a', build, 300, 400) as second:
+        assert second is first
+        assert second.size == (300, 400)
+    assert len(builds) == 1
+
+
+def test_concurrent_checkouts_get_separate_maps():
+    cache = MapTemplateCache(FakeMap, max_entries=2)
+    with cache.checkout('a', lambda: '<Map/>', 10, 10) as first:
+        with cache.checkout('a', lambda: '<Map/>', 10, 10) as second:
+            assert first is not second
+
+
+def test_lru_eviction():
+    cache = MapTemplateCache(FakeMap, max_entries=2)
+    for key in ('a', 'b', 'a', 'c'):
+        with cache.checkout(key, lambda: key, 10, 10):
+            pass
+    assert len(cache) == 2
+    with cache.checkout('b', lambda: 'rebuilt', 10, 10) as map_obj:
+        assert map_obj.xml == 'rebuilt'
@@ -0,0 +1,174 @@
+"""Tests for the raw RGBA PNG encoder."""
+import io
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+import png_encoder
+from png_encoder import PNG_SIGNATURE, PNGStreamWriter, adler32_combine, encode_png
+
+
+def _read_chunks(png: bytes):
+    pos = len(PNG_SIGNATURE)
+    while pos < len(png):
+        length, tag = struct.unpack('>I4s', png[pos:pos + 8])
+        yield tag, png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _unfilter(raw: bytes, width: int, height: int, bpp: int = 4) -> bytes:
+    stride = width * bpp
+    previous = bytearray(stride)
+    rows = []
+    for y in range(height):
+        kind = raw[y * (stride + 1)]
+        row = bytearray(raw[y * (stride + 1) + 1:(y + 1) * (stride + 1)])
+        for i in range(stride):
+            a = row[i - bpp] if i >= bpp else 0
+            b = previous[i]
+            c = previous[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                row[i] = (row[i] + a) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + b) & 0xff
+            elif kind == 4:
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xff
+        rows.append(bytes(row))
+        previous = row
+    return b''.join(rows)
+
+
+def test_encode_png_roundtrip(monkeypatch):
+    monkeypatch.setattr(png_encoder, 'PNG_FILTER', 'none')
+    width, height = 3, 2
+    rgba = bytes(range(width * height * 4))
+    png = encode_png(rgba, width, height)
+
+    assert png.startswith(PNG_SIGNATURE)
+    chunks = dict(_read_chunks(png))
+    assert struct.unpack('>II', chunks[b'IHDR'][:8]) == (width, height)
+
+    raw = zlib.decompress(chunks[b'IDAT'])
+    stride = width * 4
+    rows = [raw[y * (stride + 1):(y + 1) * (stride + 1)] for y in range(height)]
+    assert all(row[0] == 0 for row in rows)
+    assert b''.join(row[1:] for row in rows) == rgba
+
+
+def test_encode_png_rejects_wrong_size():
+    with pytest.raises(ValueError):
+        encode_png(b'\x00' * 10, 2, 2)
+
+
+def test_stream_writer_bands_and_chunks(monkeypatch):
+    monkeypatch.setattr(png_encoder, 'IDAT_CHUNK_SIZE', 1024)
+    width, height = 128, 130
+    rgba = bytes((i * 7) % 256 for i in range(width * height * 4))
+
+    output = io.BytesIO()
+    writer = PNGStreamWriter(output, width, height, compression_level=0, filter='none')
+    for row in range(0, height, 32):
+        writer.write_rows(rgba[row * width * 4:min(row + 32, height) * width * 4])
+    writer.close()
+
+    chunks = list(_read_chunks(output.getvalue()))
+    idat = [data for tag, data in chunks if tag == b'IDAT']
+    assert len(idat) > 1
+    assert chunks[-1][0] == b'IEND'
+
+    raw = zlib.decompress(b''.join(idat))
+    stride = width * 4 + 1
+    assert b''.join(raw[y * stride + 1:(y + 1) * stride] for y in range(height)) == rgba
+
+
+def test_stream_writer_requires_all_rows():
+    writer = PNGStreamWriter(io.BytesIO(), 2, 2)
+    writer.write_rows(b'\x00' * 8)
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+@pytest.mark.parametrize('method', ['none', 'sub', 'up', 'paeth'])
+def test_parallel_chunks_and_filters(monkeypatch, method):
+    # Several compression chunks per call, each a separately flushed deflate segment
+    monkeypatch.setattr(png_encoder, 'PNG_ENCODE_CHUNK_BYTES', 4096)
+    width, height = 37, 90
+    rgba = np.random.default_rng(1).integers(0, 256, width * height * 4, dtype=np.uint8).tobytes()
+
+    output = io.BytesIO()
+    writer = PNGStreamWriter(output, width, height, filter=method, threads=3)
+    writer.write_rows(rgba[:40 * width * 4])
+    writer.write_rows(rgba[40 * width * 4:])
+    writer.close()
+
+    # zlib.decompress verifies the combined Adler-32 checksum
+    idat = b''.join(data for tag, data in _read_chunks(output.getvalue()) if tag == b'IDAT')
+    assert _unfilter(zlib.decompress(idat), width, height) == rgba
+
+
+def test_adler32_combine():
+    a, b = b'hillshade', b'contours' * 1000
+    assert adler32_combine(zlib.adler32(a), zlib.adler32(b), len(b)) == zlib.adler32(a + b)
+
+
+def test_palette_png():
+    width, height = 40, 30
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[...] = (245, 245, 245, 255)
+    pixels[10:20] = (80, 80, 80, 255)
+    pixels[:, :5] = (224, 224, 224, 255)
+    pixels[0, 0] = (81, 81, 81, 255)  # Same 5-6-5 bin as the dark band
+    png = encode_png(pixels.tobytes(), width, height, palette=True)
+
+    chunks = dict(_read_chunks(png))
+    assert chunks[b'IHDR'][9] == 3
+    assert b'tRNS' not in chunks
+    palette = np.frombuffer(chunks[b'PLTE'], dtype=np.uint8).reshape(-1, 3)
+    assert len(palette) == 3
+
+    raw = np.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=np.uint8).reshape(height, width + 1)
+    assert (raw[:, 0] == 0).all()
+    decoded = palette[raw[:, 1:]]
+    expected = pixels[..., :3].astype(int)
+    assert np.abs(decoded.astype(int) - expected).max() <= 1
+
+
+def test_palette_png_keeps_transparent_and_dark_pixels_apart():
+    width, height = 16, 8
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)  # Transparent
+    pixels[:4] = (3, 3, 3, 255)  # Same 5-6-5 bin as transparent black
+    pixels[:, :2] = (200, 40, 40, 128)
+    png = encode_png(pixels.tobytes(), width, height, palette=True)
+
+    chunks = dict(_read_chunks(png))
+    palette = np.frombuffer(chunks[b'PLTE'], dtype=np.uint8).reshape(-1, 3)
+    alpha = np.frombuffer(chunks[b'tRNS'], dtype=np.uint8)
+    raw = np.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=np.uint8).reshape(height, width + 1)
+    indices = raw[:, 1:]
+    decoded = np.dstack([palette[indices], alpha[indices]])
+    assert np.abs(decoded.astype(int) - pixels.astype(int)).max() <= 1
+
+
+def test_encoded_bytes_do_not_depend_on_threads_or_bands(monkeypatch):
+    # Golden baselines are byte-identical whatever PNG_ENCODE_THREADS is set
+    # to, and strip renders match whole-image renders
+    monkeypatch.setattr(png_encoder, 'PNG_ENCODE_CHUNK_BYTES', 4096)
+    width, height = 64, 100
+    rgba = np.random.default_rng(2).integers(0, 256, width * height * 4, dtype=np.uint8).tobytes()
+
+    def encode(threads, band_rows):
+        output = io.BytesIO()
+        writer = PNGStreamWriter(output, width, height, threads=threads)
+        for row in range(0, height, band_rows):
+            writer.write_rows(rgba[row * width * 4:min(row + band_rows, height) * width * 4])
+        writer.close()
+        return output.getvalue()
+
+    expected = encode(1, height)
+    assert encode(4, height) == expected
+    assert encode(4, 7) == expected
+    assert encode(1, 33) == expected
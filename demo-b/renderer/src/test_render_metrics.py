@@ -0,0 +1,61 @@
+"""Tests for render metrics."""
+import pytest
+
+from render_history import RenderHistory
+from render_metrics import Histogram, InstrumentedRenderer, RenderMetrics
+from render_pool import RenderQueueFull
+from renderer_interface import RendererInterface
+
+
+class FakeRenderer(RendererInterface):
+    def render(self, *args, timings=None, **kwargs):
+        timings.update({'render': 0.3, 'layers': {'water': {'fetch': 0.1, 'draw': 0.2}}, 'output_bytes': 4})
+        return b'data'
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('h', 'help', ('preset',), (1, 5))
+    histogram.observe(0.5, 'a')
+    histogram.observe(3, 'a')
+    lines = histogram.exposition().splitlines()
+    assert 'h_bucket{preset="a",le="1"} 1' in lines
+    assert 'h_bucket{preset="a",le="5"} 2' in lines
+    assert 'h_bucket{preset="a",le="+Inf"} 2' in lines
+    assert 'h_sum{preset="a"} 3.5' in lines
+    assert 'h_count{preset="a"} 2' in lines
+
+
+def test_instrumented_renderer_records_labels():
+    metrics = RenderMetrics()
+    renderer = InstrumentedRenderer(FakeRenderer(), metrics)
+    assert renderer.render({'name': 'Paper'}, (0, 0, 1, 1), (10, 10), 150, 'png', 'stockholm_core') == b'data'
+
+    text = metrics.exposition()
+    labels = 'preset="stockholm_core",theme="Paper",format="png",dpi="150"'
+    assert f'render_duration_seconds_count{{{labels}}} 1' in text
+    assert f'render_stage_seconds_count{{{labels},stage="render"}} 1' in text
+    assert f'render_layer_seconds_sum{{{labels},layer="water",phase="fetch"}} 0.1' in text
+    assert f'render_output_bytes_sum{{{labels}}} 4' in text
+
+
+def test_composite_renders_stay_out_of_history(tmp_path):
+    history = RenderHistory(str(tmp_path / 'history.sqlite'))
+    renderer = InstrumentedRenderer(FakeRenderer(), RenderMetrics(), history)
+    args = ({'name': 'Paper'}, (0, 0, 1, 1), (10, 10), 150, 'png', 'stockholm_core')
+    renderer.render(*args)
+    renderer.render(*args, composite=True)
+    assert len(history.recent('png', 10)) == 1
+
+
+def test_busy_pool_is_not_a_failure():
+    class BusyRenderer(RendererInterface):
+        def render(self, *args, **kwargs):
+            raise RenderQueueFull('busy')
+
+    metrics = RenderMetrics()
+    with pytest.raises(RenderQueueFull):
+        InstrumentedRenderer(BusyRenderer(), metrics).render({'name': 'Paper'}, (0, 0, 1, 1), (10, 10), 150, 'png',
+                                                            'stockholm_core')
+    text = metrics.exposition()
+    assert 'render_failures_total{' not in text
+    assert 'render_rejected_total{preset="stockholm_core",theme="Paper",format="png",dpi="150"} 1' in text
@@ -0,0 +1,30 @@
+"""Tests for scale band selection and per-band layer sources."""
+from scale_bands import contour_interval, contours_query, layer_query, layer_table, scale_denominator, select_band
+
+# EPSG:3857 bboxes of the stockholm_core and svealand presets
+STOCKHOLM_CORE = (1992619.0, 8249875.0, 2012656.0, 8256423.0)
+SVEALAND = (1614133.0, 8073094.0, 2115070.0, 8625823.0)
+
+
+def test_band_follows_output_scale():
+    a2_150dpi = (2480, 3508)
+
+    assert scale_denominator((0, 0, 2800, 1000), (1000, 1000)) == 10000
+    assert select_band(STOCKHOLM_CORE, a2_150dpi) == 'full'
+    assert select_band(SVEALAND, a2_150dpi) == 'low'
+    assert select_band(SVEALAND, (12000, 12000)) == 'mid'
+
+
+def test_layer_query_per_band():
+    assert layer_query('buildings', 'full') == '(SELECT way FROM render_buildings) AS buildings'
+    assert layer_query('buildings', 'mid') == '(SELECT way FROM gen_buildings_mid) AS buildings'
+    assert layer_query('roads_minor', 'low') is None
+    assert layer_table('water', 'low') == 'gen_water_low'
+
+
+def test_contours_query_selects_interval_class():
+    assert contour_interval('low') == 50
+    assert contour_interval('full', {'contours': {'interval': 2}}) == 2
+    query = contours_query("o'hare", 10)
+    assert "preset = 'o''hare'" in query
+    assert 'interval_m >= 10' in query
@@ -0,0 +1,66 @@
+"""Tests for styles reading per-preset vector snapshots instead of PostGIS."""
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import snapshots
+from datasources import POSTGIS_DATASOURCE
+from map_cache import style_cache_key
+from theme_to_mapnik import theme_to_mapnik_xml
+
+COVERAGE = {'hillshade': False, 'contours': True}
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, 'SNAPSHOT_DIR', tmp_path)
+    monkeypatch.setattr(snapshots, '_manifests', {})
+    return tmp_path
+
+
+def _write_manifest(snapshot_dir, preset, contours=True):
+    (snapshot_dir / preset).mkdir()
+    manifest = {'preset': preset, 'format': 'FlatGeobuf', 'created_at': '2026-01-01T00:00:00Z', 'contours': contours}
+    (snapshot_dir / preset / 'manifest.json').write_text(json.dumps(manifest))
+
+
+def _style(preset, band='full'):
+    xml = theme_to_mapnik_xml({}, (0, 0, 1, 1), (10, 10), 72, preset, coverage=COVERAGE, band=band)
+    return ET.fromstring(xml.encode('utf-8'))
+
+
+def test_preset_with_snapshot_reads_files(snapshot_dir):
+    _write_manifest(snapshot_dir, 'stockholm_core')
+    root = _style('stockholm_core', band='mid')
+    assert root.findall('Datasource') == []
+
+    params = {layer.get('name'): {p.get('name'): p.text for p in layer.find('Datasource')}
+              for layer in root.findall('Layer')}
+    assert params['water'] == {'type': 'ogr', 'file': str(snapshot_dir / 'stockholm_core' / 'gen_water_mid.fgb'),
+                               'layer': 'gen_water_mid'}
+    assert params['contours']['layer_by_sql'] == 'SELECT * FROM contours WHERE interval_m >= 10'
+
+
+def test_contours_fall_back_to_postgis_when_not_snapshotted(snapshot_dir):
+    _write_manifest(snapshot_dir, 'stockholm_core', contours=False)
+    root = _style('stockholm_core')
+    assert [t.get('name') for t in root.findall('Datasource')] == [POSTGIS_DATASOURCE]
+    contours = [layer for layer in root.findall('Layer') if layer.get('name') == 'contours'][0]
+    assert contours.find('Datasource').get('base') == POSTGIS_DATASOURCE
+
+
+def test_data_source_modes(snapshot_dir, monkeypatch):
+    _write_manifest(snapshot_dir, 'stockholm_core')
+    assert snapshots.use_snapshot('stockholm_core')
+    assert not snapshots.use_snapshot('svealand')
+    snapshot_key = style_cache_key({}, 'stockholm_core', None, COVERAGE)
+
+    monkeypatch.setattr(snapshots, 'RENDER_DATA_SOURCE', 'postgis')
+    assert not snapshots.use_snapshot('stockholm_core')
+    assert snapshots.snapshot_version('stockholm_core') is None
+    assert style_cache_key({}, 'stockholm_core', None, COVERAGE) != snapshot_key
+
+    monkeypatch.setattr(snapshots, 'RENDER_DATA_SOURCE', 'snapshot')
+    with pytest.raises(ValueError):
+        snapshots.use_snapshot('svealand')
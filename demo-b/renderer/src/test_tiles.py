@@ -0,0 +1,92 @@
+"""Tests for XYZ tile math, the per-theme tile cache and metatile rendering."""
+import threading
+import time
+
+import pytest
+
+from tiles import TileCache, TileService, metatile_origin, tile_bbox, valid_tile, WEB_MERCATOR_HALF
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.calls = []
+
+    def render_metatile(self, theme, bbox_3857, size, tile_size, buffer, preset, layers, coverage):
+        self.calls.append((bbox_3857, size))
+        return [f"{theme['name']}:{i}".encode() for i in range(size * size)]
+
+
+def test_tile_math():
+    assert tile_bbox(0, 0, 0) == pytest.approx((-WEB_MERCATOR_HALF, -WEB_MERCATOR_HALF, WEB_MERCATOR_HALF, WEB_MERCATOR_HALF))
+    assert tile_bbox(1, 1, 0) == pytest.approx((0, 0, WEB_MERCATOR_HALF, WEB_MERCATOR_HALF))
+    assert tile_bbox(3, 0, 0, count=8) == pytest.approx(tile_bbox(0, 0, 0))
+    assert metatile_origin(12, 2250, 1185, 8) == (2248, 1184, 8)
+    assert metatile_origin(1, 1, 1, 8) == (0, 0, 2)
+    assert valid_tile(2, 3, 3) and not valid_tile(2, 4, 0)
+
+
+def test_metatile_rendered_once_and_sliced(tmp_path):
+    renderer = FakeRenderer()
+    service = TileService(renderer, TileCache(tmp_path, max_bytes=1 << 20))
+    theme = {'name': 'paper'}
+
+    first = service.tile('paper', theme, 12, 2250, 1185, 'stockholm_core', None, {})
+    assert not first['hit'] and first['path'].read_bytes() == b'paper:10'
+    neighbour = service.tile('paper', theme, 12, 2255, 1191, 'stockholm_core', None, {})
+    assert neighbour['hit'] and neighbour['path'].read_bytes() == b'paper:63'
+    assert len(renderer.calls) == 1
+    assert renderer.calls[0] == (pytest.approx(tile_bbox(12, 2248, 1184, 8)), 8)
+
+    # Edited themes get new tiles
+    assert not service.tile('paper', {'name': 'paper', 'background': '#000'}, 12, 2250, 1185,
+                            'stockholm_core', None, {})['hit']
+
+
+def test_purge_theme(tmp_path):
+    cache = TileCache(tmp_path, max_bytes=1 << 20)
+    service = TileService(FakeRenderer(), cache)
+    service.tile('paper', {'name': 'paper'}, 3, 0, 0, 'custom', None, {})
+    service.tile('ink', {'name': 'ink'}, 3, 0, 0, 'custom', None, {})
+
+    assert cache.purge_theme('paper') == 64
+    assert cache.stats()['size_bytes'] == sum(len(f"ink:{i}") for i in range(64))
+    assert not service.tile('paper', {'name': 'paper'}, 3, 0, 0, 'custom', None, {})['hit']
+    assert service.tile('ink', {'name': 'ink'}, 3, 1, 1, 'custom', None, {})['hit']
+
+    # Names that do not map to a theme directory never reach the cache root
+    for name in ('..', '.', '_', ''):
+        with pytest.raises(ValueError):
+            cache.purge_theme(name)
+    assert service.tile('ink', {'name': 'ink'}, 3, 1, 1, 'custom', None, {})['hit']
+
+
+def test_concurrent_requests_render_metatile_once(tmp_path):
+    release = threading.Event()
+
+    class SlowRenderer(FakeRenderer):
+        def render_metatile(self, *args):
+            release.wait(5)
+            return super().render_metatile(*args)
+
+    renderer = SlowRenderer()
+    service = TileService(renderer, TileCache(tmp_path, max_bytes=1 << 20))
+    results = []
+    threads = [threading.Thread(target=lambda x=x: results.append(
+        service.tile('paper', {'name': 'paper'}, 12, 2248 + x, 1184, 'custom', None, {})))
+        for x in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(renderer.calls) == 1
+    assert sorted(result['hit'] for result in results) == [False] + [True] * 5
+    assert service._locks == {}
+
+
+def test_disabled_tile_cache_returns_data(tmp_path):
+    service = TileService(FakeRenderer(), TileCache(tmp_path, max_bytes=0))
+    tile = service.tile('paper', {'name': 'paper'}, 0, 0, 0, 'custom', None, {})
+    assert tile['data'] == b'paper:0'
@@ -2,10 +2,75 @@
 import json
 import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
+from datasources import postgis_datasource_template, postgis_layer_datasource
+from scale_bands import CONTOUR_MAJOR_EVERY, contour_interval, contours_query, layer_query, layer_table, select_band
+from snapshots import snapshot_layer_datasource, snapshot_manifest, use_snapshot
 
-def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tuple, dpi: int, preset: str = 'stockholm_core', layers: Dict[str, bool] = None, coverage: Dict[str, bool] = None) -> str:
+# Theme hillshade "blend" values drawn with the Mapnik comp-op of the same name
+HILLSHADE_BLEND_MODES = ('multiply', 'screen', 'overlay', 'soft-light', 'hard-light', 'darken', 'lighten')
+
+# Hillshade values between colorizer stops (Mapnik interpolates linearly between them)
+HILLSHADE_LEVEL_STEP = 16
+
+
+def hillshade_level(value: float, gamma: float = 1.0, contrast: float = 1.0) -> int:
+    """Shade level (0-255) of a hillshade value after gamma and contrast.
+
+    Gamma above 1 lightens midtones; contrast scales around mid grey.
+    """
+    level = (value / 255.0) ** (1.0 / gamma)
+    level = (level - 0.5) * contrast + 0.5
+    return round(min(1.0, max(0.0, level)) * 255)
+
+
+def hillshade_stops(gamma: float, contrast: float) -> List[Tuple[float, int]]:
+    """(value, level) colorizer stops applying gamma and contrast to hillshade values 1-255.
+
+    Stops are HILLSHADE_LEVEL_STEP apart, plus the points where contrast
+    clips to black or white, so linear interpolation between them follows
+    the curve to within a level. Value 0 (no data) stays transparent.
+    """
+    values = set(range(1, 256, HILLSHADE_LEVEL_STEP)) | {255}
+    for clipped in (0.5 - 0.5 / contrast, 0.5 + 0.5 / contrast):
+        if 0.0 < clipped < 1.0:
+            values.add(round(255.0 * clipped ** gamma, 2))
+    return [(value, hillshade_level(value, gamma, contrast)) for value in sorted(values) if value >= 1]
+
+
+def hillshade_symbolizer(theme: Dict[str, Any]) -> Tuple[str, bool]:
+    """RasterSymbolizer for the theme's hillshade block.
+
+    ``blend`` becomes the symbolizer comp-op and ``gamma``/``contrast`` a
+    RasterColorizer that remaps the shade levels while Mapnik draws the
+    raster, so neither costs an extra pass over the image.
+
+    Returns:
+        (symbolizer XML, whether the layer must read raw band values for the colorizer)
+    """
+    hillshade = theme.get('hillshade', {})
+    # Note: opacity is applied via RasterSymbolizer, NOT as a Layer attribute (invalid in Mapnik)
+    attributes = f'opacity="{hillshade.get("opacity", 0.15)}" scaling="{hillshade.get("scaling", "bilinear")}"'
+    blend = hillshade.get('blend')
+    if blend in HILLSHADE_BLEND_MODES:
+        attributes += f' comp-op="{blend}"'
+
+    gamma = float(hillshade.get('gamma', 1.0))
+    contrast = float(hillshade.get('contrast', 1.0))
+    if gamma == 1.0 and contrast == 1.0:
+        return f"<RasterSymbolizer {attributes} />", False
+
+    stops = '\n'.join(f'          <stop value="{value:g}" color="#{level:02x}{level:02x}{level:02x}" />'
+                      for value, level in hillshade_stops(gamma, contrast))
+    return f"""<RasterSymbolizer {attributes}>
+          <RasterColorizer default-mode="linear" default-color="transparent">
+{stops}
+          </RasterColorizer>
+        </RasterSymbolizer>""", True
+
+
+def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tuple, dpi: int, preset: str = 'stockholm_core', layers: Dict[str, bool] = None, coverage: Dict[str, bool] = None, band: str = None, hillshade_file: str = None) -> str:
     """Generate Mapnik XML from theme JSON.
 
     Args:
@@ -15,6 +80,9 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
         dpi: Output DPI
         preset: Bbox preset name (used for hillshade file path)
         layers: Layer visibility dict (e.g. {'hillshade': True, 'water': False, ...})
+        band: Scale band for vector layers (default: from bbox and output size)
+        hillshade_file: Hillshade computed for this render (see hillshade.py),
+            used instead of the preset's prepared hillshade
 
     Returns:
         Mapnik XML string
@@ -33,23 +101,43 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
     width, height = output_size
     min_x, min_y, max_x, max_y = bbox_3857
 
+    # Small-scale renders read generalized tables
+    if band is None:
+        band = select_band(bbox_3857, output_size)
+
+    # Vector layers read the preset's local snapshot when it has one
+    snapshot = use_snapshot(preset)
+    uses_postgis = False
+
+    def vector_datasource(layer: str) -> str:
+        nonlocal uses_postgis
+        if snapshot:
+            return snapshot_layer_datasource(layer_table(layer, band), preset)
+        uses_postgis = True
+        return postgis_layer_datasource(layer_query(layer, band), preset)
+
     # Build layers XML
     layers_xml = []
 
     # Note: Background is handled by map background-color attribute, no layer needed
 
     # Hillshade layer (raster)
-    # Note: opacity is applied via RasterSymbolizer, NOT as a Layer attribute (invalid in Mapnik)
-    hillshade_opacity = theme.get('hillshade', {}).get('opacity', 0.15)
-    hillshade_file = f"/data/terrain/hillshade/{preset}_hillshade.tif"
-
-    # Check if hillshade file exists (graceful handling when terrain missing)
-    has_hillshade = False
-    if coverage is not None:
-        has_hillshade = coverage.get('hillshade', False)
+    # Hillshade is a COG with overviews: GDAL reads the overview level matching
+    # the output resolution, resampled with the theme's scaling method
+    hillshade_symbolizer_xml, hillshade_band = hillshade_symbolizer(theme)
+    # The colorizer needs the raw shade values instead of a greyscale image
+    hillshade_band_xml = '\n        <Parameter name="band">1</Parameter>' if hillshade_band else ''
+    if hillshade_file is not None:
+        # Computed for this render from the DEM (hillshade.py)
+        has_hillshade = True
     else:
-        # Fallback: check file existence
-        has_hillshade = os.path.exists(hillshade_file)
+        hillshade_file = f"/data/terrain/hillshade/{preset}_hillshade.tif"
+        # Check if hillshade file exists (graceful handling when terrain missing)
+        if coverage is not None:
+            has_hillshade = coverage.get('hillshade', False)
+        else:
+            # Fallback: check file existence
+            has_hillshade = os.path.exists(hillshade_file)
 
     if layers.get('hillshade', True) and has_hillshade:
         layers_xml.append(f"""    <Layer name="hillshade" srs="EPSG:3857">
@@ -57,6 +145,7 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
       <Datasource>
         <Parameter name="type">gdal</Parameter>
         <Parameter name="file">{hillshade_file}</Parameter>
+        <Parameter name="shared">true</Parameter>{hillshade_band_xml}
       </Datasource>
     </Layer>""")
 
@@ -64,31 +153,19 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
     water_fill = theme.get('water', {}).get('fill', '#d4e4f0')
     water_stroke = theme.get('water', {}).get('stroke', '#a8c5d8')
     if layers.get('water', True):
+        water_datasource = vector_datasource('water')
         layers_xml.append(f"""    <Layer name="water" srs="EPSG:3857">
       <StyleName>water</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_polygon WHERE "natural"='water' OR waterway IS NOT NULL) AS water</Parameter>
-      </Datasource>
+{water_datasource}
     </Layer>""")
 
     # Parks layer
     parks_fill = theme.get('parks', {}).get('fill', '#e8f0e0')
     if layers.get('parks', True):
+        parks_datasource = vector_datasource('parks')
         layers_xml.append(f"""    <Layer name="parks" srs="EPSG:3857">
       <StyleName>parks</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_polygon WHERE landuse IN ('park', 'recreation_ground', 'forest')) AS parks</Parameter>
-      </Datasource>
+{parks_datasource}
     </Layer>""")
 
     # Roads layer (minor first, then major)
@@ -102,44 +179,28 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
         major_width = roads_stroke_width
 
     if layers.get('roads', True):
-        layers_xml.append(f"""    <Layer name="roads-minor" srs="EPSG:3857">
+        # Minor roads are not drawn at small scales
+        if layer_table('roads_minor', band) is not None:
+            roads_minor_datasource = vector_datasource('roads_minor')
+            layers_xml.append(f"""    <Layer name="roads-minor" srs="EPSG:3857">
       <StyleName>roads-minor</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_line WHERE highway IN ('residential', 'service', 'unclassified')) AS roads</Parameter>
-      </Datasource>
+{roads_minor_datasource}
     </Layer>""")
 
+        roads_major_datasource = vector_datasource('roads_major')
         layers_xml.append(f"""    <Layer name="roads-major" srs="EPSG:3857">
       <StyleName>roads-major</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_line WHERE highway IN ('primary', 'secondary', 'tertiary', 'trunk', 'motorway')) AS roads</Parameter>
-      </Datasource>
+{roads_major_datasource}
     </Layer>""")
 
     # Buildings layer
     buildings_fill = theme.get('buildings', {}).get('fill', '#d0d0d0')
     buildings_stroke = theme.get('buildings', {}).get('stroke', '#909090')
     if layers.get('buildings', True):
+        buildings_datasource = vector_datasource('buildings')
         layers_xml.append(f"""    <Layer name="buildings" srs="EPSG:3857">
       <StyleName>buildings</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_polygon WHERE building IS NOT NULL) AS buildings</Parameter>
-      </Datasource>
+{buildings_datasource}
     </Layer>""")
 
     # Contours layer - NO LABELS (critical constraint)
@@ -152,24 +213,22 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
         minor_width_contour = contours_width * 0.5
         major_width_contour = contours_width
 
-    # Contours are stored in PostGIS or as GeoJSON files
-    # For now, assume they're in PostGIS
+    # Contours are loaded into PostGIS per preset (importers/osm-importer/load_contours.sh)
     # Check if contours are available (graceful handling when terrain missing)
     has_contours = True  # Default: assume available (PostGIS query will return empty if not)
     if coverage is not None:
         has_contours = coverage.get('contours', True)
+    interval = contour_interval(band, theme)
 
     if layers.get('contours', True) and has_contours:
+        if snapshot and snapshot_manifest(preset).get('contours'):
+            contours_datasource = snapshot_layer_datasource('contours', preset, f"interval_m >= {int(interval)}")
+        else:
+            uses_postgis = True
+            contours_datasource = postgis_layer_datasource(contours_query(preset, interval), preset)
         layers_xml.append(f"""    <Layer name="contours" srs="EPSG:3857">
       <StyleName>contours</StyleName>
-      <Datasource>
-        <Parameter name="type">postgis</Parameter>
-        <Parameter name="host">demo-b-db</Parameter>
-        <Parameter name="port">5432</Parameter>
-        <Parameter name="dbname">gis</Parameter>
-        <Parameter name="user">postgres</Parameter>
-        <Parameter name="table">(SELECT way FROM planet_osm_line WHERE "natural"='contour') AS contours</Parameter>
-      </Datasource>
+{contours_datasource}
     </Layer>""")
 
     # Build styles XML
@@ -182,7 +241,7 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
     if has_hillshade:
         styles_xml.append(f"""    <Style name="hillshade">
       <Rule>
-        <RasterSymbolizer opacity="{hillshade_opacity}" />
+        {hillshade_symbolizer_xml}
       </Rule>
     </Style>""")
 
@@ -240,12 +299,21 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
             minor_opacity = 0.5
 
         # Blend opacity with stroke color for visual hierarchy
+        # Major lines: contours of a coarser interval class (e.g. 50 m lines among 10 m)
         styles_xml.append(f"""    <Style name="contours">
       <Rule>
+        <Filter>[interval_m] &gt;= {interval * CONTOUR_MAJOR_EVERY}</Filter>
         <LineSymbolizer stroke="{contours_stroke}" stroke-width="{major_width_contour}" stroke-linejoin="round" stroke-linecap="round" stroke-opacity="{major_opacity}" />
       </Rule>
+      <Rule>
+        <ElseFilter />
+        <LineSymbolizer stroke="{contours_stroke}" stroke-width="{minor_width_contour}" stroke-linejoin="round" stroke-linecap="round" stroke-opacity="{minor_opacity}" />
+      </Rule>
     </Style>""")
 
+    # Renders served entirely from a snapshot do not declare (or connect to) PostGIS
+    postgis_template = postgis_datasource_template() if uses_postgis else ''
+
     # Build full XML - Note: Style and Layer elements are direct children of Map (no wrapper elements)
     xml = f"""<?xml version="1.0" encoding="utf-8"?>
 <Map srs="+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over" background-color="{bg_color}" minimum-version="3.0.0">
@@ -253,6 +321,8 @@ def theme_to_mapnik_xml(theme: Dict[str, Any], bbox_3857: tuple, output_size: tu
     <Parameter name="bbox">!bbox!</Parameter>
   </Parameters>
 
+{postgis_template}
+
 {chr(10).join(styles_xml)}
 
 {chr(10).join(layers_xml)}
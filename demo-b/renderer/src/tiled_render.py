@@ -0,0 +1,195 @@
+"""Banded and parallel strip rendering for large raster exports.
+
+A large poster is split into full-width horizontal strips. Each strip is
+rendered on a map that is taller than the strip by a buffer above and
+below, using exactly the same pixel grid as the full map. Features
+crossing a strip edge are therefore drawn identically on both sides, and
+cropping the buffer away gives seamless joins at line caps, line joins
+and polygon edges.
+
+Strips are encoded into the PNG as soon as they are available, top to
+bottom, so peak memory is proportional to the strip height rather than to
+the poster area. Strips are rendered by a process pool when more than one
+strip worker is configured, otherwise one after another in-process.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import mapnik
+
+from map_cache import MapTemplateCache
+from png_encoder import create_png_writer
+
+# Outputs larger than this (width * height) are rendered and encoded in strips
+TILED_RENDER_MIN_PIXELS = int(os.getenv('TILED_RENDER_MIN_PIXELS', '16000000'))
+
+# Strip height and overlap buffer in pixels
+TILED_RENDER_STRIP_HEIGHT = int(os.getenv('TILED_RENDER_STRIP_HEIGHT', '1024'))
+TILED_RENDER_BUFFER = int(os.getenv('TILED_RENDER_BUFFER', '128'))
+
+# Number of strip worker processes (1 = render strips in-process). Each
+# render worker (RENDER_WORKERS) starts its own strip pool, whose processes
+# escape the render workers' RSS recycling, so size the two together
+TILED_RENDER_WORKERS = int(os.getenv('TILED_RENDER_WORKERS', '1'))
+
+_executor = None
+
+# Per-process template cache used by strip workers
+_worker_cache = None
+
+
+def should_tile(width: int, height: int, tiled: Optional[bool] = None) -> bool:
+    """Decide whether an output should be rendered in strips.
+
+    Args:
+        width: Output width in pixels
+        height: Output height in pixels
+        tiled: True forces strips; otherwise strips are used above TILED_RENDER_MIN_PIXELS
+    """
+    if tiled:
+        return True
+    return width * height >= TILED_RENDER_MIN_PIXELS
+
+
+def should_parallelize(tiled: Optional[bool] = None) -> bool:
+    """Whether strips go to the process pool (tiled=False keeps them in-process)."""
+    return tiled is not False and TILED_RENDER_WORKERS > 1
+
+
+def plan_strips(envelope: Tuple[float, float, float, float], width: int, height: int,
+                strip_height: int = TILED_RENDER_STRIP_HEIGHT, buffer: int = TILED_RENDER_BUFFER) -> List[Dict]:
+    """Split a map extent into buffered horizontal strips.
+
+    Args:
+        envelope: (min_x, min_y, max_x, max_y) of the full map after aspect fixing
+        width: Full output width in pixels
+        height: Full output height in pixels
+        strip_height: Output rows per strip
+        buffer: Extra rows rendered above and below each strip
+
+    Returns:
+        List of strips with keys: row, rows, map_height, bbox
+    """
+    min_x, min_y, max_x, max_y = envelope
+    res_y = (max_y - min_y) / height
+
+    strips = []
+    for row in range(0, height, strip_height):
+        rows = min(strip_height, height - row)
+        strips.append({
+            'row': row,
+            'rows': rows,
+            'map_height': rows + 2 * buffer,
+            'bbox': (
+                min_x,
+                max_y - (row + rows + buffer) * res_y,
+                max_x,
+                max_y - (row - buffer) * res_y
+            )
+        })
+    return strips
+
+
+def _render_strip_rows(map_cache: MapTemplateCache, cache_key: str, xml: str, width: int, strip: Dict, buffer: int) -> bytes:
+    """Render one buffered strip and return the cropped rows as raw RGBA."""
+    with map_cache.checkout(cache_key, lambda: xml, width, strip['map_height']) as map_obj:
+        map_obj.zoom_to_box(mapnik.Box2d(*strip['bbox']))
+        im = mapnik.Image(width, strip['map_height'])
+        mapnik.render(map_obj, im)
+
+    im.demultiply()
+    return im.view(0, buffer, width, strip['rows']).tostring()
+
+
+def _init_worker():
+    """Set up fonts and a template cache in a strip worker process."""
+    global _worker_cache
+    from mapnik_renderer import load_map_from_xml
+    mapnik.register_fonts('/usr/share/fonts/truetype/dejavu')
+    _worker_cache = MapTemplateCache(load_map_from_xml)
+
+
+def _render_strip(cache_key: str, xml: str, width: int, strip: Dict, buffer: int) -> bytes:
+    """Strip worker entry point."""
+    return _render_strip_rows(_worker_cache, cache_key, xml, width, strip, buffer)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: forked children would share the parent's datasource connections
+        _executor = ProcessPoolExecutor(
+            max_workers=TILED_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+    return _executor
+
+
+def _parallel_strip_rows(cache_key: str, xml: str, width: int, strips: List[Dict], buffer: int) -> Iterator[bytes]:
+    """Render strips in the process pool and yield them in order.
+
+    Only a couple of strips per worker are in flight at a time so finished
+    strips waiting for an earlier one do not pile up in memory.
+    """
+    executor = _get_executor()
+    max_in_flight = 2 * TILED_RENDER_WORKERS
+    pending = deque()
+    for strip in strips:
+        pending.append(executor.submit(_render_strip, cache_key, xml, width, strip, buffer))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def full_envelope(bbox_3857: tuple, width: int, height: int) -> Tuple[float, float, float, float]:
+    """Extent mapnik actually uses for this output size
+    (zoom_to_box grows the bbox to match the output aspect ratio)."""
+    full_map = mapnik.Map(width, height)
+    full_map.zoom_to_box(mapnik.Box2d(*bbox_3857))
+    env = full_map.envelope()
+    return (env.minx, env.miny, env.maxx, env.maxy)
+
+
+def render_png_strips(output, cache_key: str, xml: str, bbox_3857: tuple, width: int, height: int,
+                      map_cache: MapTemplateCache, parallel: bool = True,
+                      strip_height: int = TILED_RENDER_STRIP_HEIGHT, buffer: int = TILED_RENDER_BUFFER,
+                      progress: Callable[[str, float], None] = None, palette: bool = False):
+    """Render a PNG strip by strip and stream it to a file object.
+
+    Args:
+        output: Binary file object the PNG is written to
+        cache_key: Style key (lets renderers reuse loaded maps across strips)
+        xml: Mapnik style XML
+        bbox_3857: Requested (min_x, min_y, max_x, max_y) in EPSG:3857
+        width: Output width in pixels
+        height: Output height in pixels
+        map_cache: Template cache used for in-process strips
+        parallel: Render strips in the process pool
+        strip_height: Output rows per strip
+        buffer: Overlap rows above and below each strip
+        progress: Optional callback (stage, fraction) called as strips complete
+        palette: Write an 8-bit palette PNG
+    """
+    envelope = full_envelope(bbox_3857, width, height)
+    strips = plan_strips(envelope, width, height, strip_height, buffer)
+
+    if parallel:
+        strip_rows = _parallel_strip_rows(cache_key, xml, width, strips, buffer)
+    else:
+        strip_rows = (_render_strip_rows(map_cache, cache_key, xml, width, strip, buffer) for strip in strips)
+
+    writer = create_png_writer(output, width, height, palette)
+    for done, rows in enumerate(strip_rows, 1):
+        writer.write_rows(rows)
+        if progress:
+            progress('rendering', 0.95 * done / len(strips))
+
+    if progress:
+        progress('encoding', 0.95)
+    writer.close()
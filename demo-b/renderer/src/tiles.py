@@ -0,0 +1,191 @@
+"""XYZ raster tiles rendered as metatiles.
+
+A tile request renders the whole METATILE_SIZE x METATILE_SIZE block of
+256 px tiles around it in one Mapnik render (with a buffer so features
+crossing tile edges are drawn identically on both sides), slices it and
+stores every tile in a size-bounded disk cache. Neighbouring tiles, which
+a panning preview requests next, are then cache hits. Concurrent requests
+for tiles of the same metatile wait for a single render.
+
+Tiles are cached per theme and zoom level; a tile's key covers the theme
+content, layers, preset coverage and data versions, so edited themes and
+re-imported data are rendered afresh, and a theme's tiles can be dropped
+as a whole (TileCache.purge_theme).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from disk_cache import DiskCache
+from filename_builder import sanitize_filename
+from result_cache import RENDERER_OUTPUT_VERSION, data_versions
+
+TILE_SIZE = 256
+
+# Tiles per metatile side (one render produces METATILE_SIZE² tiles)
+METATILE_SIZE = int(os.getenv('METATILE_SIZE', '8'))
+
+# Pixels rendered around a metatile and cropped away (edge features and line caps)
+TILE_BUFFER = int(os.getenv('TILE_BUFFER', '128'))
+
+# Zoom levels served
+TILE_MIN_ZOOM = int(os.getenv('TILE_MIN_ZOOM', '0'))
+TILE_MAX_ZOOM = int(os.getenv('TILE_MAX_ZOOM', '18'))
+
+# Tile cache location and size budget (0 disables the cache)
+TILE_CACHE_DIR = Path(os.getenv('TILE_CACHE_DIR', '/exports/tiles'))
+TILE_CACHE_MAX_MB = int(os.getenv('TILE_CACHE_MAX_MB', '1024'))
+
+# Browser cache lifetime of served tiles in seconds (revalidated with the ETag)
+TILE_MAX_AGE = int(os.getenv('TILE_MAX_AGE', '300'))
+
+WEB_MERCATOR_HALF = 20037508.342789244
+
+
+def tile_bbox(z: int, x: int, y: int, count: int = 1) -> Tuple[float, float, float, float]:
+    """EPSG:3857 bbox of a block of count x count tiles with top-left tile (x, y)."""
+    span = 2 * WEB_MERCATOR_HALF / (1 << z)
+    min_x = -WEB_MERCATOR_HALF + x * span
+    max_y = WEB_MERCATOR_HALF - y * span
+    return (min_x, max_y - count * span, min_x + count * span, max_y)
+
+
+def metatile_origin(z: int, x: int, y: int, size: int = METATILE_SIZE) -> Tuple[int, int, int]:
+    """Top-left tile and side length (in tiles) of the metatile containing a tile."""
+    size = min(size, 1 << z)
+    return (x - x % size, y - y % size, size)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return TILE_MIN_ZOOM <= z <= TILE_MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def metatile_digest(theme: Dict, preset: str, layers: Optional[Dict[str, bool]], coverage: Dict[str, bool],
+                    z: int, mx: int, my: int) -> str:
+    """Content hash of a metatile render (shared by all of its tiles)."""
+    payload = {
+        'theme': {k: v for k, v in theme.items() if not k.startswith('_')},
+        'preset': preset,
+        'layers': layers,
+        'coverage': coverage,
+        'metatile': [z, mx, my, METATILE_SIZE, TILE_SIZE, TILE_BUFFER],
+        'data': data_versions(preset),
+        'renderer': RENDERER_OUTPUT_VERSION
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class TileCache(DiskCache):
+    """Tiles stored as <root>/<theme>/<z>/<key>.png, bounded in total size.
+
+    Keys are '<theme>/<z>/<digest>'.
+    """
+
+    entry_glob = '*/*/*'
+
+    def path_for(self, key: str, ext: str) -> Path:
+        theme, z, digest = key.split('/')
+        return self.root / theme / z / f"{digest}.{ext}"
+
+    def purge_theme(self, theme_name: str) -> int:
+        """Delete all tiles of a theme.
+
+        Returns:
+            Number of deleted tiles
+
+        Raises:
+            ValueError: if the theme name does not map to a theme directory
+        """
+        name = sanitize_filename(theme_name)
+        theme_dir = self.root / name
+        if not name or theme_dir.parent != self.root:
+            raise ValueError(f"Invalid theme name: {theme_name!r}")
+        with self._lock:
+            count = sum(1 for _ in theme_dir.glob('*/*')) if theme_dir.is_dir() else 0
+            shutil.rmtree(theme_dir, ignore_errors=True)
+            self._size = None
+        return count
+
+
+class TileService:
+    """Serves tiles from the cache, rendering their metatile on a miss."""
+
+    def __init__(self, renderer, cache: TileCache):
+        """
+        Args:
+            renderer: Renderer with render_metatile() (MapnikRenderer, RenderPool
+                or a wrapper of either)
+            cache: Tile cache
+        """
+        self.renderer = renderer
+        self.cache = cache
+        self._locks = {}  # Metatile digest -> [lock, threads holding or waiting for it]
+        self._locks_guard = threading.Lock()
+        self.metatiles_rendered = 0
+
+    @contextmanager
+    def _metatile_lock(self, digest: str):
+        # One lock per metatile being rendered, dropped once no thread holds or waits for it
+        with self._locks_guard:
+            entry = self._locks.setdefault(digest, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[digest]
+
+    def tile(self, theme_name: str, theme: Dict, z: int, x: int, y: int, preset: str,
+             layers: Optional[Dict[str, bool]], coverage: Dict[str, bool]) -> Dict:
+        """Get one tile.
+
+        Returns:
+            dict with keys: etag, hit (bool), and path (cached file) or data
+            (PNG bytes, when the cache is disabled or the tile was not stored)
+        """
+        mx, my, size = metatile_origin(z, x, y)
+        digest = metatile_digest(theme, preset, layers, coverage, z, mx, my)
+        theme_dir = sanitize_filename(theme_name)
+        etag = f"{digest[:32]}-{x - mx}-{y - my}"
+
+        def key(dx, dy):
+            return f"{theme_dir}/{z}/{digest}_{dx}_{dy}"
+
+        path = self.cache.get(key(x - mx, y - my), 'png')
+        if path is not None:
+            return {'etag': etag, 'hit': True, 'path': path}
+
+        with self._metatile_lock(digest):
+            # Another request may have rendered this metatile while we waited
+            path = self.cache.get(key(x - mx, y - my), 'png')
+            if path is not None:
+                return {'etag': etag, 'hit': True, 'path': path}
+
+            tiles = self.renderer.render_metatile(theme, tile_bbox(z, mx, my, size), size, TILE_SIZE, TILE_BUFFER,
+                                                  preset, layers, coverage)
+            self.metatiles_rendered += 1
+            requested = {'etag': etag, 'hit': False, 'data': tiles[(y - my) * size + (x - mx)]}
+            for dy in range(size):
+                for dx in range(size):
+                    stored = self.cache.put_bytes(key(dx, dy), tiles[dy * size + dx], 'png')
+                    if stored and (dx, dy) == (x - mx, y - my):
+                        requested = {'etag': etag, 'hit': False, 'path': stored}
+            return requested
+
+    def stats(self) -> Dict:
+        return dict(self.cache.stats(), metatiles_rendered=self.metatiles_rendered)
+
+
+def create_tile_cache() -> TileCache:
+    """Tile cache configured from the environment."""
+    return TileCache(TILE_CACHE_DIR, TILE_CACHE_MAX_MB * 1024 * 1024)
@@ -1,6 +1,7 @@
 const express = require('express');
 const path = require('path');
 const fs = require('fs');
+const { Readable } = require('stream');
 
 const app = express();
 const PORT = process.env.PORT || 3000;
@@ -56,10 +57,13 @@ app.post('/api/render', async (req, res) => {
       return res.status(response.status).send(errorText);
     }
 
-    const contentType = response.headers.get('content-type');
-    if (contentType) {
-      res.setHeader('Content-Type', contentType);
-    }
+    // Content headers plus the refine job of draft previews
+    ['content-type', 'content-disposition', 'etag', 'x-cache', 'x-refine-job', 'x-refine-error'].forEach(header => {
+      const value = response.headers.get(header);
+      if (value) {
+        res.setHeader(header, value);
+      }
+    });
 
     const buffer = await response.arrayBuffer();
     res.send(Buffer.from(buffer));
@@ -69,6 +73,67 @@ app.post('/api/render', async (req, res) => {
   }
 });
 
+// Proxy job status requests (refined renders queued behind draft previews)
+app.get('/api/jobs/:id', async (req, res) => {
+  try {
+    const response = await fetch(`${API_URL}/jobs/${encodeURIComponent(req.params.id)}`);
+    const json = await response.json();
+    res.status(response.status).json(json);
+  } catch (error) {
+    console.error('Job status proxy error:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Stream finished job results through without buffering them
+app.get('/api/jobs/:id/result', async (req, res) => {
+  try {
+    const response = await fetch(`${API_URL}/jobs/${encodeURIComponent(req.params.id)}/result`);
+    if (!response.ok) {
+      const json = await response.json();
+      return res.status(response.status).json(json);
+    }
+    ['content-type', 'content-length', 'content-disposition'].forEach(header => {
+      const value = response.headers.get(header);
+      if (value) {
+        res.setHeader(header, value);
+      }
+    });
+    Readable.fromWeb(response.body).pipe(res);
+  } catch (error) {
+    console.error('Job result proxy error:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
+// Proxy map tiles for the pannable preview (ETag revalidation passes through)
+app.get('/api/tiles/:theme/:z/:x/:y.png', async (req, res) => {
+  try {
+    const query = new URLSearchParams(req.query).toString();
+    const url = `${API_URL}/tiles/${encodeURIComponent(req.params.theme)}/${req.params.z}/${req.params.x}/${req.params.y}.png`;
+    const headers = {};
+    if (req.headers['if-none-match']) {
+      headers['If-None-Match'] = req.headers['if-none-match'];
+    }
+    const response = await fetch(query ? `${url}?${query}` : url, { headers });
+    ['content-type', 'etag', 'cache-control', 'x-cache'].forEach(header => {
+      const value = response.headers.get(header);
+      if (value) {
+        res.setHeader(header, value);
+      }
+    });
+    res.status(response.status);
+    if (response.status === 304) {
+      return res.end();
+    }
+    const buffer = await response.arrayBuffer();
+    res.send(Buffer.from(buffer));
+  } catch (error) {
+    console.error('Tile proxy error:', error);
+    res.status(500).json({ error: error.message });
+  }
+});
+
 // Proxy validate requests to the API service
 app.post('/api/validate', async (req, res) => {
   try {
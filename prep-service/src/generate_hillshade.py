@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Generate hillshade from DEM."""
+"""Generate hillshade from DEM (written as a Cloud-Optimized GeoTIFF)."""
 import argparse
 import json
 import os
@@ -13,6 +13,26 @@ DEM_DIR = Path(DATA_DIR) / 'dem'
 TERRAIN_DIR = Path(DATA_DIR) / 'terrain' / 'hillshade'
 TERRAIN_DIR.mkdir(parents=True, exist_ok=True)
 
+# Cloud-Optimized GeoTIFF with internal overviews: renderers read the
+# overview level that matches their output resolution. DEFLATE with a
+# horizontal predictor compresses smooth shading well and decodes fast.
+COG_CREATION_OPTIONS = [
+    'COMPRESS=DEFLATE',
+    'PREDICTOR=YES',
+    'BLOCKSIZE=512',
+    'OVERVIEWS=IGNORE_EXISTING',
+    'OVERVIEW_RESAMPLING=AVERAGE',
+    'BIGTIFF=IF_SAFER',
+    'NUM_THREADS=ALL_CPUS'
+]
+
+def cog_options():
+    """gdalwarp/gdal_translate arguments for writing the hillshade COG."""
+    args = ['-of', 'COG']
+    for option in COG_CREATION_OPTIONS:
+        args += ['-co', option]
+    return args
+
 def load_presets():
     with open(CONFIG_DIR / 'bbox_presets.json') as f:
         return json.load(f)
@@ -91,8 +111,7 @@ def main():
             '-t_srs', 'EPSG:3857',
             '-te', str(min_x), str(min_y), str(max_x), str(max_y),
             '-r', 'bilinear',
-            '-co', 'COMPRESS=LZW',
-            '-co', 'TILED=YES',
+            *cog_options(),
             str(temp_hillshade),
             str(output_file)
         ], check=True)
@@ -101,8 +120,14 @@ def main():
         temp_hillshade.unlink(missing_ok=True)
     except Exception as e:
         print(f"Warning: Could not clip to buffered bbox, using original: {e}", file=sys.stderr)
-        # Fallback: just use the temp file
-        temp_hillshade.replace(output_file)
+        # Fallback: convert the unclipped hillshade to a COG
+        subprocess.run([
+            'gdal_translate',
+            *cog_options(),
+            str(temp_hillshade),
+            str(output_file)
+        ], check=True)
+        temp_hillshade.unlink(missing_ok=True)
 
     print(f"Hillshade generated: {output_file}")
 
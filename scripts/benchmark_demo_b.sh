@@ -0,0 +1,34 @@
+#!/bin/bash
+# Benchmark the Demo B renderer against a PostGIS container loaded with a fixture extract
+#
+# Usage: ./scripts/benchmark_demo_b.sh [benchmark.py options...]
+#   e.g. ./scripts/benchmark_demo_b.sh --papers A4 A3 --dpis 72 150 --formats png
+#        ./scripts/benchmark_demo_b.sh --update-baseline
+#
+# The fixture is the clipped OSM extract of BENCHMARK_PRESET (default: stockholm_core),
+# prepared with the prep service (see README). Set SKIP_IMPORT=1 to reuse an already
+# loaded database. Results go to the exports volume (/exports/benchmarks); the baseline
+# is demo-b/renderer/benchmarks/baseline.json.
+set -e
+
+PRESET="${BENCHMARK_PRESET:-stockholm_core}"
+ROOT_DIR="$(cd "$(dirname "$0")/.." && pwd)"
+
+cd "$ROOT_DIR"
+
+echo "=== Demo B Renderer Benchmark: $PRESET ==="
+
+docker-compose --profile demoB up -d demo-b-db
+
+if [ "${SKIP_IMPORT:-0}" != "1" ]; then
+    echo "Loading fixture extract into PostGIS..."
+    docker-compose --profile demoB run --rm demo-b-importer /app/import.sh "$PRESET"
+    docker-compose --profile demoB run --rm --entrypoint /app/load_contours.sh demo-b-importer "$PRESET" || \
+        echo "Warning: contours not loaded (benchmarking without contours)"
+fi
+
+# Render in-process (no worker pool) with the baseline directory mounted for --update-baseline
+docker-compose --profile demoB run --rm --no-deps \
+    -e RENDER_WORKERS=0 \
+    -v "$ROOT_DIR/demo-b/renderer/benchmarks:/app/benchmarks" \
+    demo-b-renderer python src/benchmark.py --presets "$PRESET" "$@"
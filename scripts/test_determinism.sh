@@ -24,8 +24,10 @@ for i in {1..3}; do
         curl -s "http://localhost:8082/render?bbox_preset=$PRESET&theme=$THEME&render_mode=print&dpi=$DPI&width_mm=$WIDTH_MM&height_mm=$HEIGHT_MM" \
             -o "$OUTPUT"
     elif [ "$DEMO" = "demo-b" ]; then
+        # Bypass the result cache so every run is an actual render
         curl -s -X POST "http://localhost:5000/render" \
             -H "Content-Type: application/json" \
+            -H "Cache-Control: no-cache" \
             -d "{\"bbox_preset\":\"$PRESET\",\"theme\":\"$THEME\",\"render_mode\":\"print\",\"dpi\":$DPI,\"width_mm\":$WIDTH_MM,\"height_mm\":$HEIGHT_MM,\"format\":\"png\"}" \
             -o "$OUTPUT"
     else